@@ -0,0 +1,64 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import gzip
+import lzma
+import os
+import shutil
+import tempfile
+import time
+
+from elit.reader import TSVReader
+
+__author__ = 'Jinho D. Choi'
+
+
+def throughput(reader: TSVReader, filename: str, background: bool) -> float:
+    """
+    :return: the number of sentences read per second.
+    """
+    st = time.time()
+    reader.open(filename, background=background)
+    count = sum(1 for _ in reader)
+    reader.close()
+    return count / (time.time() - st)
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare the throughput of reading plain, gzip, and xz TSV files')
+    parser.add_argument('tsv', type=str, metavar='filepath', help='path to the plain TSV file')
+    args = parser.parse_args()
+
+    reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+    tmpdir = tempfile.mkdtemp()
+
+    try:
+        files = [('plain', args.tsv)]
+        for name, opener in (('gzip', gzip.open), ('xz', lzma.open)):
+            filename = os.path.join(tmpdir, os.path.basename(args.tsv) + '.' + name)
+            with open(args.tsv, 'rb') as fin, opener(filename, 'wb') as fout: shutil.copyfileobj(fin, fout)
+            files.append((name, filename))
+
+        for name, filename in files:
+            print('%-6s: %10.1f sentences/sec (background), %10.1f sentences/sec (inline), %6.1f MB' %
+                  (name, throughput(reader, filename, True), throughput(reader, filename, False),
+                   os.path.getsize(filename) / 1e6))
+    finally:
+        shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    main()
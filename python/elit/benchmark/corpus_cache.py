@@ -0,0 +1,53 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import shutil
+import time
+
+from elit.reader import TSVReader
+
+__author__ = 'Jinho D. Choi'
+
+
+def timeit(label: str, func):
+    st = time.time()
+    result = func()
+    print('%-24s: %8.3f sec' % (label, time.time() - st))
+    return result
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare parsing a TSV file against loading its binary corpus cache')
+    parser.add_argument('tsv', type=str, metavar='filepath', help='path to the TSV file')
+    args = parser.parse_args()
+
+    reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+    shutil.rmtree(reader.cache_path(args.tsv), ignore_errors=True)
+
+    def parse():
+        reader.open(args.tsv)
+        graphs = reader.next_all
+        reader.close()
+        return graphs
+
+    timeit('parse graphs', parse)
+    timeit('parse + write cache', lambda: reader.read_cached(args.tsv))
+    corpus = timeit('load cache', lambda: reader.read_cached(args.tsv))
+    timeit('materialize graphs', lambda: list(corpus.graphs()))
+
+
+if __name__ == '__main__':
+    main()
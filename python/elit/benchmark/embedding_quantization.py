@@ -0,0 +1,115 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import copy
+import logging
+import os
+import random
+import time
+from typing import List
+
+import mxnet as mx
+import numpy as np
+
+from elit.component.pos_tagger import POSLexicon, POSModel, POSState
+from elit.component.template.lexicon import DTYPES, load_word2vec
+from elit.component.template.util import read_graphs
+from elit.reader import TSVReader
+from elit.structure import NLPGraph
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+def feature_time(model: POSModel, states: List[POSState], passes: int=1) -> float:
+    """
+    :return: the seconds taken to extract the features of every token in the states per pass; the first pass is
+             not timed, so that the embeddings are resolved and cached beforehand.
+    """
+    def run():
+        for state in states:
+            for idx in range(1, len(state.graph.nodes)):
+                state.idx_curr = idx
+                model.x(state)
+
+            state.reset()
+
+    run()
+    st = time.time()
+    for _ in range(passes): run()
+    return (time.time() - st) / passes
+
+
+def embedding_error(base: POSLexicon, lexicon: POSLexicon, graphs: List[NLPGraph]) -> float:
+    """
+    :return: the mean absolute difference between the full-precision and the quantized embeddings of the tokens.
+    """
+    nodes = [node for graph in graphs for node in graph]
+    return float(np.abs(base.w2v.get_batch(nodes) - lexicon.w2v.get_batch(nodes)).mean())
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare POSModel accuracy and throughput for each storage type of embeddings')
+    parser.add_argument('--w2v', type=str, metavar='filepath', required=True,
+                        help='path to the word2vec bin file or the embedding table npy file')
+    parser.add_argument('--trn', type=str, metavar='filepath', default=SAMPLE_TSV, help='path to the training data')
+    parser.add_argument('--dev', type=str, metavar='filepath', default=SAMPLE_TSV, help='path to the development data')
+    parser.add_argument('--dtypes', type=str, nargs='+', choices=DTYPES, default=DTYPES, help='storage types')
+    parser.add_argument('--num_steps', type=int, metavar='int', default=100, help='number of training steps')
+    parser.add_argument('--bagging_ratio', type=float, metavar='float', default=1.0,
+                        help='ratio of the training states drawn for each step')
+    parser.add_argument('--learning_rate', type=float, metavar='float', default=0.1, help='learning rate of SGD')
+    parser.add_argument('--passes', type=int, metavar='int', default=100,
+                        help='number of passes over the development data to time feature extraction')
+    parser.add_argument('--seed', type=int, metavar='int', default=0, help='random seed shared by all storage types')
+    args = parser.parse_args()
+    logging.basicConfig(format='%(message)s', level=logging.WARNING)
+
+    reader = TSVReader(word_index=1, pos_index=3)
+    trn_graphs = read_graphs(reader, args.trn)
+    dev_graphs = read_graphs(reader, args.dev)
+    num_tokens = sum(len(graph) for graph in dev_graphs)
+
+    w2v = load_word2vec(args.w2v)
+    base = POSLexicon(w2v=w2v)
+
+    for dtype in args.dtypes:
+        # the states take the gold tags out of their graphs and write predictions back, so every run gets copies
+        random.seed(args.seed)
+        np.random.seed(args.seed)
+        mx.random.seed(args.seed)
+
+        lexicon = POSLexicon(w2v=w2v, dtype=dtype)
+        model = POSModel(num_label=len(lexicon.pos_zeros), w2v_dim=lexicon.node_dim)
+        states = [POSState(graph, lexicon, save_gold=True) for graph in copy.deepcopy(dev_graphs)]
+        tt = feature_time(model, states, args.passes)
+        err = embedding_error(base, lexicon, dev_graphs)
+        line = '%-8s: %7.3f MB, error = %.5f, features = %8d tokens/sec' % \
+               (dtype, lexicon.w2v.vsm.syn0.nbytes / 1e6, err, num_tokens / tt)
+
+        if args.num_steps:
+            st = time.time()
+            acc = model.train(copy.deepcopy(trn_graphs), copy.deepcopy(dev_graphs), lexicon,
+                              num_steps=args.num_steps, bagging_ratio=args.bagging_ratio,
+                              optimizer_params=(('learning_rate', args.learning_rate),))
+            line += ', train = %6.2f sec, dev-acc = %6.4f' % (time.time() - st, acc)
+
+        print(line)
+
+
+if __name__ == '__main__':
+    main()
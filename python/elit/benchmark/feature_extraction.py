@@ -0,0 +1,85 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import copy
+import os
+import random
+import time
+from typing import List
+
+import numpy as np
+
+from elit.component.pos_tagger import POSLexicon, POSModel, POSState
+from elit.component.template.lexicon import load_word2vec
+from elit.component.template.model import FeaturePool
+from elit.component.template.util import read_graphs
+from elit.reader import TSVReader
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+def extraction_time(model: POSModel, states: List[POSState], pool: FeaturePool, repeat: int) -> float:
+    """
+    :return: the mean seconds taken by NLPModel.train_instances over the states.
+    """
+    model.train_instances(states, pool=pool)
+    st = time.time()
+    for _ in range(repeat): model.train_instances(states, pool=pool)
+    return (time.time() - st) / repeat
+
+
+def main():
+    parser = argparse.ArgumentParser('Measure the scaling of process-based feature extraction for POSModel')
+    parser.add_argument('--w2v', type=str, metavar='filepath', required=True,
+                        help='path to the word2vec bin file or the embedding table npy file')
+    parser.add_argument('--trn', type=str, metavar='filepath', default=SAMPLE_TSV, help='path to the training data')
+    parser.add_argument('--workers', type=int, nargs='+', default=(1, 2, 4, 8, 16), help='numbers of processes')
+    parser.add_argument('--chunk_size', type=int, metavar='int', default=1024, help='number of states per task')
+    parser.add_argument('--repeat', type=int, metavar='int', default=5, help='number of extractions to average')
+    parser.add_argument('--copies', type=int, metavar='int', default=1, help='number of copies of the training data')
+    args = parser.parse_args()
+
+    reader = TSVReader(word_index=1, pos_index=3)
+    graphs = [copy.deepcopy(graph) for graph in read_graphs(reader, args.trn) for _ in range(args.copies)]
+    lexicon = POSLexicon(w2v=load_word2vec(args.w2v))
+    model = POSModel(num_label=len(lexicon.pos_zeros), w2v_dim=lexicon.node_dim)
+    states = [POSState(graph, lexicon, save_gold=True) for graph in graphs]
+    for state in states: state.idx_curr = random.randint(1, len(state.graph.nodes) - 1)
+    gold = model.feature_vectors(states)
+    base = None
+
+    # the workers run in parallel only on as many CPUs as the process may use
+    print('%d states, %d CPUs' % (len(states), len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity')
+                                  else os.cpu_count()))
+
+    for workers in args.workers:
+        pool = FeaturePool(model, lexicon, workers, args.chunk_size) if workers > 1 else None
+
+        try:
+            tt = extraction_time(model, states, pool, args.repeat)
+            same = np.array_equal(model.train_instances(states, pool=pool)[0], gold)
+        finally:
+            if pool: pool.close()
+
+        base = base or tt
+        print('%2d workers: %8d instances/sec, speedup = %5.2f, same = %s' %
+              (workers, len(states) / tt, base / tt, same))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,63 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import os
+import time
+
+from elit.reader import TSVReader
+
+__author__ = 'Jinho D. Choi'
+
+
+def timeit(label: str, func, base: float=None) -> float:
+    st = time.time()
+    func()
+    tt = time.time() - st
+    print('%-28s: %8.3f sec, speedup = %5.2f' % (label, tt, (base or tt) / tt))
+    return tt
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare reading a TSV file sequentially against reading it by processes')
+    parser.add_argument('tsv', type=str, metavar='filepath', help='path to the TSV file')
+    parser.add_argument('--workers', type=int, nargs='+', default=(2, 4, 8), help='numbers of processes')
+    args = parser.parse_args()
+
+    reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+    cpus = len(os.sched_getaffinity(0)) if hasattr(os, 'sched_getaffinity') else os.cpu_count()
+    print('%d CPUs' % cpus)
+
+    def parse_graphs():
+        reader.open(args.tsv)
+        for _ in reader: pass
+        reader.close()
+
+    def parse_corpus():
+        reader.open(args.tsv)
+        reader.read_corpus()
+        reader.close()
+
+    base = timeit('graphs, sequential', parse_graphs)
+    for workers in args.workers:
+        timeit('graphs, %d workers' % workers, lambda: sum(1 for _ in reader.iter_parallel(args.tsv, workers)), base)
+
+    base = timeit('corpus, sequential', parse_corpus, base)
+    for workers in args.workers:
+        timeit('corpus, %d workers' % workers, lambda: reader.read_parallel(args.tsv, workers), base)
+
+
+if __name__ == '__main__':
+    main()
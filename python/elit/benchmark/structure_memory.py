@@ -0,0 +1,145 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import gc
+import os
+import tracemalloc
+from typing import Iterator, List
+
+from elit.reader import TSVReader, get_sheads
+from elit.structure import BLANK, ROOT_TAG
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+def repeat_lines(filename: str, num_sentences: int) -> Iterator[str]:
+    """
+    :return: the lines of the file repeated until num_sentences sentences are generated.
+    """
+    with open(filename) as fin: sentences = fin.read().strip().split('\n\n')
+    for i in range(num_sentences):
+        yield from sentences[i % len(sentences)].split('\n')
+        yield ''
+
+
+class BaselineNode:
+    """
+    The layout of NLPNode before it used __slots__: every node has its own __dict__, the four arc lists are
+    allocated eagerly, and the dependency labels are kept in a dictionary keyed by the parent nodes.
+    """
+    def __init__(self, node_id: int, word: str, lemma: str, pos: str, nament: str, feats: dict):
+        self.node_id = node_id
+        self.word = word
+        self.lemma = lemma
+        self.pos = pos
+        self.nament = nament
+        self.feats = feats or {}
+        self.parent = None
+        self.children = []
+        self.secondary_parents = []
+        self.secondary_children = []
+        self.deprels = {}
+
+
+def read_baseline(reader: TSVReader) -> List[List[BaselineNode]]:
+    """
+    :return: the nodes of each sentence read as the reader did with BaselineNode (tokens are split from each line,
+             labels are not interned, and the arcs are added one by one).
+    """
+    graphs = []
+
+    for tsv in iter(reader.next_tsv, []):
+        nodes = [BaselineNode(0, ROOT_TAG, ROOT_TAG, ROOT_TAG, ROOT_TAG, None)]
+        for i, row in enumerate(tsv, 1):
+            f = row[reader.feats_index]
+            feats = dict(kv.split('=', 1) for kv in f.split('|')) if f != BLANK else None
+            nodes.append(BaselineNode(i, row[reader.word_index], row[reader.lemma_index], row[reader.pos_index],
+                                      row[reader.nament_index], feats))
+
+        for node, row in zip(nodes[1:], tsv):
+            parent = nodes[int(row[reader.head_index])]
+            node.parent = parent
+            parent.children.append(node)
+            node.deprels[parent] = row[reader.deprel_index]
+
+            for head_id, label in get_sheads(row[reader.sheads_index]):
+                parent = nodes[head_id]
+                node.secondary_parents.append(parent)
+                parent.secondary_children.append(node)
+                node.deprels[parent] = label
+
+        graphs.append(nodes)
+
+    return graphs
+
+
+def resident_bytes() -> int:
+    """
+    :return: the resident set size of this process (Linux only).
+    """
+    with open('/proc/self/statm') as fin: return int(fin.read().split()[1]) * os.sysconf('SC_PAGE_SIZE')
+
+
+def measure(reader: TSVReader, filename: str, num_sentences: int, layout: str, rss: bool=False) -> float:
+    """
+    :param layout: 'graph' (NLPGraph), 'corpus' (NLPCorpus), or 'baseline' (BaselineNode).
+    :param rss: if True, the growth of the resident set size is measured instead of the traced allocations;
+                tracing needs memory per allocation, which does not fit for millions of sentences.
+    :return: the number of bytes per token allocated to keep all sentences in memory.
+    """
+    gc.collect()
+    if rss: start = resident_bytes()
+    else: tracemalloc.start()
+    reader.ins = repeat_lines(filename, num_sentences)
+
+    if layout == 'corpus':
+        data = reader.read_corpus()
+        num_tokens = data.num_tokens
+    elif layout == 'baseline':
+        data = read_baseline(reader)
+        num_tokens = sum(len(nodes) - 1 for nodes in data)
+    else:
+        data = reader.next_all
+        num_tokens = sum(len(graph) for graph in data)
+
+    gc.collect()
+    if rss:
+        size = resident_bytes() - start
+    else:
+        size = tracemalloc.get_traced_memory()[0]
+        tracemalloc.stop()
+
+    return size / num_tokens
+
+
+def main():
+    parser = argparse.ArgumentParser('Measure the memory footprint of NLPGraph and NLPCorpus')
+    parser.add_argument('--tsv', type=str, metavar='filepath', default=SAMPLE_TSV, help='path to the TSV file')
+    parser.add_argument('--sentences', type=int, metavar='int', default=1000000, help='number of sentences')
+    parser.add_argument('--layout', type=str, default='graph', choices=('graph', 'corpus', 'baseline'),
+                        help='NLPGraph, NLPCorpus, or the NLPNode layout before __slots__')
+    parser.add_argument('--rss', action='store_true', help='measure the resident set size instead of tracing')
+    args = parser.parse_args()
+
+    reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+    size = measure(reader, args.tsv, args.sentences, args.layout, args.rss)
+    print('%s: %.1f bytes/token (%d sentences)' % (args.layout, size, args.sentences))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,86 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import multiprocessing
+import os
+import random
+import shutil
+import tempfile
+import time
+from typing import List, Tuple
+
+import numpy as np
+
+from elit.component.template.lexicon import EmbeddingTable, TABLE_EXT, VOCAB_EXT, VOCAB_EXTS
+
+__author__ = 'Jinho D. Choi'
+
+
+def anonymous_bytes() -> int:
+    """
+    :return: the resident anonymous memory of this process (Linux only); pages mapped from files are not counted.
+    """
+    with open('/proc/self/status') as fin:
+        return next(int(line.split()[1]) << 10 for line in fin if line.startswith('RssAnon:'))
+
+
+def load_and_lookup(filename: str, keys: List[str]) -> Tuple[float, float, int]:
+    """
+    :return: the seconds to load the table, the seconds to look the keys up, and the growth of anonymous memory.
+    """
+    start = anonymous_bytes()
+    st = time.time()
+    table = EmbeddingTable.load(filename)
+    load_time = time.time() - st
+
+    st = time.time()
+    for key in keys: table.index(key)
+    lookup_time = time.time() - st
+    return load_time, lookup_time, anonymous_bytes() - start
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare the text and the memory-mapped vocabularies of EmbeddingTable')
+    parser.add_argument('--keys', type=int, metavar='int', default=2000000, help='number of keys in the table')
+    parser.add_argument('--lookups', type=int, metavar='int', default=100000, help='number of keys to look up')
+    args = parser.parse_args()
+
+    tmpdir = tempfile.mkdtemp()
+    prefix = os.path.join(tmpdir, 'table')
+    filename = prefix + TABLE_EXT
+    keys = ['w%07d_%s' % (i, 'x' * (i % 8)) for i in range(args.keys)]
+    lookups = [random.choice(keys) if i % 2 else 'oov%d' % i for i in range(args.lookups)]
+
+    # each load runs in a new process, so nothing is cached in memory but the page cache
+    context = multiprocessing.get_context('spawn')
+
+    try:
+        EmbeddingTable(np.zeros((len(keys), 1), dtype='float32'), keys).save(filename)
+        with context.Pool(1) as pool: mapped = pool.apply(load_and_lookup, (filename, lookups))
+
+        for ext in VOCAB_EXTS.values(): os.remove(prefix + ext)
+        with open(prefix + VOCAB_EXT, 'w', encoding='utf-8') as fout: fout.write('\n'.join(keys))
+        with context.Pool(1) as pool: text = pool.apply(load_and_lookup, (filename, lookups))
+    finally:
+        shutil.rmtree(tmpdir)
+
+    for label, (load_time, lookup_time, nbytes) in (('text', text), ('mapped', mapped)):
+        print('%-6s: load = %6.3f sec, %d lookups = %6.3f sec, anonymous memory = %7.1f MB' %
+              (label, load_time, len(lookups), lookup_time, nbytes / (1 << 20)))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,52 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import time
+
+from elit.structure import NLPGraph, NLPNode
+
+__author__ = 'Jinho D. Choi'
+
+
+def set_parents(nodes, heads, deprels):
+    graph = NLPGraph(nodes)
+    for node, head_id, deprel in zip(nodes, heads, deprels): node.set_parent(graph.nodes[head_id], deprel)
+    return graph
+
+
+def from_heads(nodes, heads, deprels):
+    return NLPGraph.from_heads(nodes, heads, deprels)
+
+
+def main():
+    parser = argparse.ArgumentParser('Compare per-arc set_parent against NLPGraph.from_heads on flat trees')
+    parser.add_argument('--tokens', type=int, metavar='int', default=500, help='number of tokens per sentence')
+    parser.add_argument('--sentences', type=int, metavar='int', default=1000, help='number of sentences')
+    args = parser.parse_args()
+
+    # flat: every token except the first one is attached to the first one
+    heads = [0] + [1] * (args.tokens - 1)
+    deprels = ['dep'] * args.tokens
+
+    for name, build in (('set_parent', set_parents), ('from_heads', from_heads)):
+        sentences = [[NLPNode(i) for i in range(1, args.tokens + 1)] for _ in range(args.sentences)]
+        st = time.time()
+        for nodes in sentences: build(nodes, heads, deprels)
+        print('%-10s: %8.3f sec' % (name, time.time() - st))
+
+
+if __name__ == '__main__':
+    main()
@@ -13,6 +13,7 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ========================================================================
+import numpy as np
 from fasttext.model import WordVectorModel
 from gensim.models import KeyedVectors
 
@@ -103,7 +104,16 @@ class DEPState(NLPState):
     def terminate(self):
         return self.input >= len(self.graph)
 
-    # ============================== Node ==============================
+    # ============================== Feature ==============================
+
+    def feature_matrix(self, node_ids: np.array) -> np.array:
+        """
+        :param node_ids: the IDs of nodes in the graph, -1 for none (see NLPState.get_nodes).
+        :return: the embeddings of the nodes looked up by their word ids, where the i'th row is of node_ids[i].
+        """
+        word_ids = self.graph.field_ids('word', node_ids, self.lex.vocabs)
+        vocab = self.lex.vocabs['word']
+        return np.hstack([emb.get_ids(word_ids, vocab) for emb in (self.lex.w2v, self.lex.f2v) if emb])
 
 
 class DEPParser(NLPComponent):
@@ -0,0 +1,328 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import argparse
+import io
+import logging
+import os
+import time
+from collections import Counter
+from concurrent.futures import ProcessPoolExecutor
+from typing import BinaryIO, Iterable, Iterator, List, Set, Tuple
+
+import fasttext
+import numpy as np
+from fasttext.model import WordVectorModel
+from gensim.models import KeyedVectors
+
+from elit.component.template.lexicon import DTYPES, TABLE_EXT, EmbeddingTable, NLPLexiconMapper, fasttext_keys, \
+    load_word2vec
+from elit.reader import BackgroundReader, TSVReader, compression, split_ranges
+from elit.structure import NLPVocabulary
+
+__author__ = 'Jinho D. Choi'
+
+
+def read_keys(reader: TSVReader, filenames: List[str]) -> Set[str]:
+    """
+    :param reader: the reader whose word_index points to the key column.
+    :param filenames: the TSV files (possibly compressed).
+    :return: the set of keys in the files, collected without building any graph.
+    """
+    keys = set()
+
+    for filename in filenames:
+        reader.open(filename)
+        while True:
+            tsv = reader.next_tsv()
+            if not tsv: break
+            keys.update(row[reader.word_index] for row in tsv)
+        reader.close()
+        logging.info('Read: %s (%d keys)' % (os.path.basename(filename), len(keys)))
+
+    return keys
+
+
+# ============================== Convert ==============================
+
+def convert(args: argparse.Namespace):
+    """
+    Convert a word2vec binary file to an EmbeddingTable, which NLPEmbedding memory-maps at load time.
+    The matrix is stored in args.dtype, which is float32 unless quantized.
+    """
+    st = time.time()
+    vsm = KeyedVectors.load_word2vec_format(args.w2v, binary=True)
+    logging.info('Loaded: %s (%d keys, %.1f sec)' % (args.w2v, len(vsm.index2word), time.time() - st))
+
+    EmbeddingTable.from_keyed_vectors(vsm).quantize(args.dtype).save(args.output)
+
+    st = time.time()
+    table = EmbeddingTable.load(args.output)
+    logging.info('Saved: %s (%d keys, %s, %.1f -> %.1f MB, mmap load %.3f sec)' %
+                 (args.output, len(table), table.dtype, vsm.syn0.nbytes / 1e6, table.syn0.nbytes / 1e6,
+                  time.time() - st))
+
+
+# ============================== Prune ==============================
+
+def prune(args: argparse.Namespace):
+    """
+    Keep only the embeddings of the word types in the corpora, and precompute fasttext vectors for all of them
+    across processes (see precompute_f2v).
+    """
+    keys = read_keys(TSVReader(word_index=args.word_index), args.tsv)
+    tables = []
+
+    if args.w2v:
+        st = time.time()
+        emb = NLPLexiconMapper(w2v=load_word2vec(args.w2v)).w2v
+        full_time = time.time() - st
+        table = emb.prune(keys)
+        logging.info('w2v: %d -> %d rows, %.1f -> %.1f MB (full lexicon load time %.1f sec)' %
+                     (len(emb.vsm.syn0), len(table), emb.vsm.syn0.nbytes / 1e6, table.syn0.nbytes / 1e6, full_time))
+        tables.append(('w2v', table))
+
+    if args.f2v:
+        st = time.time()
+        table = precompute_f2v(args.f2v, keys, args.workers)
+        logging.info('f2v: %d keys precomputed, %d workers, %.1f MB, %.1f sec' %
+                     (len(table), args.workers, table.syn0.nbytes / 1e6, time.time() - st))
+        tables.append(('f2v', table))
+
+    for name, table in tables:
+        filename = args.output + '.' + name + '.npy'
+        table.quantize(args.dtype).save(filename)
+
+        st = time.time()
+        EmbeddingTable.load(filename, mmap_mode=None)
+        logging.info('%s: saved to %s, load time %.3f sec' % (name, filename, time.time() - st))
+
+
+# ============================== Precompute ==============================
+
+# the fasttext model loaded once in each worker process by init_f2v
+_f2v: WordVectorModel = None
+
+
+def init_f2v(filename: str):
+    global _f2v
+    _f2v = fasttext.load_model(filename)
+
+
+def f2v_vectors(keys: List[str]) -> np.array:
+    """
+    :return: the matrix whose i'th row is the vector of keys[i] computed by the model loaded in init_f2v.
+    """
+    return np.vstack([np.array(_f2v[key], dtype='float32') for key in keys])
+
+
+def precompute_f2v(filename: str, keys: Set[str], workers: int=os.cpu_count(), chunk_size: int=10000) \
+        -> EmbeddingTable:
+    """
+    :param filename: the fasttext bin file, loaded by every worker process.
+    :param keys: the keys whose vectors are computed.
+    :param workers: the number of processes; the keys are computed in this process if 1.
+    :param chunk_size: the number of keys sent to a worker at a time.
+    :return: the table of the keys in the layout of NLPEmbedding.prune, where the root and zero vectors come first.
+    """
+    keys = fasttext_keys(keys)
+    chunks = [keys[i:i + chunk_size] for i in range(0, len(keys), chunk_size)]
+
+    if workers <= 1:
+        init_f2v(filename)
+        matrices = [f2v_vectors(chunk) for chunk in chunks]
+    else:
+        with ProcessPoolExecutor(workers, initializer=init_f2v, initargs=(filename,)) as pool:
+            matrices = list(pool.map(f2v_vectors, chunks))
+
+    return EmbeddingTable(np.vstack(matrices), keys)
+
+
+def precompute(args: argparse.Namespace):
+    """
+    Compute the fasttext vectors of the word types in the corpora across processes, which NLPEmbedding prefers to
+    calling the model.
+    """
+    keys = read_keys(TSVReader(word_index=args.word_index), args.tsv)
+
+    st = time.time()
+    table = precompute_f2v(args.f2v, keys, args.workers).quantize(args.dtype)
+    table.save(args.output)
+    logging.info('Saved: %s (%d keys, %d workers, %.1f MB, %.1f sec)' %
+                 (args.output, len(table), args.workers, table.syn0.nbytes / 1e6, time.time() - st))
+
+
+# ============================== Ambiguity Classes ==============================
+
+# the file extension of the tags that label the columns of an ambiguity class table
+TAGS_EXT = '.tags'
+
+
+def count_tags(lines: Iterable[bytes], word_index: int, pos_index: int) -> Counter:
+    """
+    :param lines: the lines of a TSV file in bytes.
+    :return: the count of each (word, tag) pair in bytes; the pairs are decoded once after merging.
+    """
+    counts = Counter()
+    size = max(word_index, pos_index)
+
+    for line in lines:
+        fields = line.strip().split(b'\t')
+        if len(fields) > size: counts[fields[word_index], fields[pos_index]] += 1
+
+    return counts
+
+
+def read_range(fin: BinaryIO, size: int) -> Iterator[bytes]:
+    """
+    :return: the lines in the next size bytes of the file.
+    """
+    while size > 0:
+        line = fin.readline()
+        if not line: break
+        size -= len(line)
+        yield line
+
+
+def count_range(filename: str, begin: int, end: int, word_index: int, pos_index: int) -> Counter:
+    """
+    :return: the count of each (word, tag) pair in the [begin, end) byte range of the file (see split_ranges).
+    """
+    with open(filename, 'rb') as fin:
+        fin.seek(begin)
+        return count_tags(read_range(fin, end - begin), word_index, pos_index)
+
+
+def count_file(filename: str, word_index: int, pos_index: int, workers: int=os.cpu_count()) -> Counter:
+    """
+    :return: the count of each (word, tag) pair in the file.
+      The file is streamed in byte ranges counted by separate processes, whose counts are merged as they arrive;
+      a compressed file cannot be split, so it is streamed sequentially while being decompressed in background.
+    """
+    opener = compression(filename)
+
+    if opener:
+        with io.BufferedReader(BackgroundReader(opener(filename, 'rb'), name=filename)) as fin:
+            return count_tags(fin, word_index, pos_index)
+
+    ranges = split_ranges(filename, workers * 4)
+    if workers <= 1: return sum((count_range(filename, b, e, word_index, pos_index) for b, e in ranges), Counter())
+    counts = Counter()
+
+    with ProcessPoolExecutor(workers) as pool:
+        n = len(ranges)
+        for c in pool.map(count_range, [filename] * n, *zip(*ranges), [word_index] * n, [pos_index] * n):
+            counts.update(c)
+
+    return counts
+
+
+def ambiguity_classes(counts: Counter, min_count: int=1, cutoff: float=0) -> Tuple[EmbeddingTable, List[str]]:
+    """
+    :param counts: the count of each (word, tag) pair in bytes (see count_tags).
+    :param min_count: words occurring less than this number of times are discarded.
+    :param cutoff: tags whose probabilities given the word are less than this are zeroed out.
+    :return: the table whose row of each word is the distribution of its tags, and the tags labeling the columns.
+    """
+    words, tags = NLPVocabulary(), NLPVocabulary(sorted({tag.decode('utf-8') for _, tag in counts}))
+    rows = np.array([words.add(word) for word, _ in counts], dtype=np.int64)
+    cols = np.array([tags.index(tag.decode('utf-8')) for _, tag in counts], dtype=np.int64)
+
+    matrix = np.zeros((len(words), len(tags)), dtype=np.float32)
+    np.add.at(matrix, (rows, cols), np.fromiter(counts.values(), dtype=np.float32, count=len(counts)))
+    totals = matrix.sum(axis=1)
+    keep = np.flatnonzero(totals >= min_count)
+
+    matrix = matrix[keep] / totals[keep, None]
+    if cutoff > 0: matrix[matrix < cutoff] = 0
+    return EmbeddingTable(matrix, [words.get(i).decode('utf-8') for i in keep.tolist()]), tags.keys
+
+
+def ambiguity(args: argparse.Namespace):
+    """
+    Derive the ambiguity classes of words from the corpora in one streaming pass, which POSLexicon takes as a2v.
+    """
+    st = time.time()
+    counts = Counter()
+
+    for filename in args.tsv:
+        counts.update(count_file(filename, args.word_index, args.pos_index, args.workers))
+        logging.info('Read: %s (%d pairs, %.1f sec)' % (os.path.basename(filename), len(counts), time.time() - st))
+
+    table, tags = ambiguity_classes(counts, args.min_count, args.cutoff)
+    output = args.output if args.output.endswith(TABLE_EXT) else args.output + TABLE_EXT
+    table.save(output)
+    with open(output[:-len(TABLE_EXT)] + TAGS_EXT, 'w', encoding='utf-8') as fout: fout.write('\n'.join(tags))
+    logging.info('Saved: %s (%d words, %d tags, %.1f MB)' % (output, len(table), len(tags), table.syn0.nbytes / 1e6))
+
+
+# ============================== Main ==============================
+
+def parse_args():
+    parser = argparse.ArgumentParser('Build lexica for NLP components')
+    commands = parser.add_subparsers(dest='command')
+    commands.required = True
+
+    args = commands.add_parser('convert', help='convert a word2vec bin file to an embedding table')
+    args.add_argument('--w2v', type=str, metavar='filepath', required=True, help='path to the word2vec bin file')
+    args.add_argument('--output', type=str, metavar='filepath', required=True,
+                      help='path to the embedding table (*.npy)')
+    args.add_argument('--dtype', type=str, choices=DTYPES, default='float32', help='storage type of the table')
+    args.set_defaults(func=convert)
+
+    args = commands.add_parser('prune', help='keep only the embeddings of the words in the corpora')
+    args.add_argument('--tsv', type=str, metavar='filepath', nargs='+', required=True, help='paths to the TSV files')
+    args.add_argument('--word_index', type=int, metavar='int', default=1, help='column index of word forms')
+    args.add_argument('--w2v', type=str, metavar='filepath', help='path to the word2vec bin or npy file')
+    args.add_argument('--f2v', type=str, metavar='filepath', help='path to the fasttext bin file')
+    args.add_argument('--output', type=str, metavar='filepath', required=True,
+                      help='prefix of the pruned tables (*.w2v.npy, *.f2v.npy)')
+    args.add_argument('--workers', type=int, metavar='int', default=os.cpu_count(),
+                      help='number of processes computing the fasttext vectors')
+    args.add_argument('--dtype', type=str, choices=DTYPES, default='float32', help='storage type of the tables')
+    args.set_defaults(func=prune)
+
+    args = commands.add_parser('precompute', help='compute the fasttext vectors of the words in the corpora')
+    args.add_argument('--tsv', type=str, metavar='filepath', nargs='+', required=True, help='paths to the TSV files')
+    args.add_argument('--word_index', type=int, metavar='int', default=1, help='column index of word forms')
+    args.add_argument('--f2v', type=str, metavar='filepath', required=True, help='path to the fasttext bin file')
+    args.add_argument('--output', type=str, metavar='filepath', required=True,
+                      help='path to the embedding table (*.npy)')
+    args.add_argument('--workers', type=int, metavar='int', default=os.cpu_count(), help='number of processes')
+    args.add_argument('--dtype', type=str, choices=DTYPES, default='float32', help='storage type of the table')
+    args.set_defaults(func=precompute)
+
+    args = commands.add_parser('ambiguity', help='derive the ambiguity classes of the words in the corpora')
+    args.add_argument('--tsv', type=str, metavar='filepath', nargs='+', required=True, help='paths to the TSV files')
+    args.add_argument('--word_index', type=int, metavar='int', default=1, help='column index of word forms')
+    args.add_argument('--pos_index', type=int, metavar='int', default=3, help='column index of part-of-speech tags')
+    args.add_argument('--output', type=str, metavar='filepath', required=True,
+                      help='path to the ambiguity class table (*.npy); its tags are saved as *.tags')
+    args.add_argument('--min_count', type=int, metavar='int', default=1, help='minimum count of a word')
+    args.add_argument('--cutoff', type=float, metavar='float', default=0, help='minimum probability of a tag')
+    args.add_argument('--workers', type=int, metavar='int', default=os.cpu_count(), help='number of processes')
+    args.set_defaults(func=ambiguity)
+
+    return parser.parse_args()
+
+
+def main():
+    logging.basicConfig(format='%(message)s', level=logging.INFO)
+    args = parse_args()
+    args.func(args)
+
+
+if __name__ == '__main__':
+    main()
@@ -15,7 +15,8 @@
 # ========================================================================
 import argparse
 import logging
-from typing import Tuple, List
+import threading
+from typing import Any, Dict, Tuple, List, Union
 
 import mxnet as mx
 import numpy as np
@@ -23,30 +24,139 @@ import fasttext
 from fasttext.model import WordVectorModel
 from gensim.models import KeyedVectors
 
-from elit.component.template.lexicon import NLPLexiconMapper, NLPEmbedding
-from elit.component.template.model import NLPModel
+from elit.component.template.lexicon import NLPLexiconMapper, NLPEmbedding, EmbeddingTable, EmbeddingCache, \
+    LEXICA, as_embedding
+from elit.component.template.model import IGNORE_LABEL, NLPModel
 from elit.component.template.state import NLPState
 from elit.component.template.util import argparse_ffnn, argparse_model, argparse_data, read_graphs, create_ffnn, \
     argparse_lexicon, conv_pool
 from elit.reader import TSVReader
-from elit.structure import NLPGraph, NLPNode
+from elit.structure import NLPGraph, NLPNode, NLPVocabulary
 
 __author__ = 'Jinho D. Choi'
 
 
 class POSLexicon(NLPLexiconMapper):
-    def __init__(self, w2v: KeyedVectors=None, f2v: WordVectorModel=None, a2v: KeyedVectors=None,
-                 output_size: int=50):
+    def __init__(self, w2v: Union[KeyedVectors, EmbeddingTable, NLPEmbedding]=None,
+                 f2v: Union[WordVectorModel, NLPEmbedding]=None,
+                 a2v: Union[KeyedVectors, EmbeddingTable, NLPEmbedding]=None, output_size: int=50,
+                 f2v_cache: EmbeddingCache=None, dtype: str=None, f2v_table: EmbeddingTable=None,
+                 static_bytes: int=1 << 28):
         """
         :param w2v: word embeddings from word2vec.
         :param f2v: word embeddings from fasttext.
-        :param a2v: a2v classes.
+        :param a2v: ambiguity classes, the tag distribution of each word (see lexicon_builder ambiguity).
         :param output_size: the number of part-of-speech tags to predict.
+        :param f2v_cache: the cache of f2v embeddings.
+        :param dtype: the storage type of the w2v and a2v matrices (see NLPEmbedding).
+        :param f2v_table: the vectors precomputed from f2v.
+        :param static_bytes: the budget of the cached static features in bytes (see static_features).
         """
-        super().__init__(w2v, f2v)
-        self.a2v: NLPEmbedding = NLPEmbedding(a2v, 'word', 'a2v') if a2v else None
+        super().__init__(w2v, f2v, f2v_cache, dtype, f2v_table)
+        self.a2v: NLPEmbedding = as_embedding(a2v, 'word', dtype=dtype) if a2v else None
         self.pos_zeros = np.zeros((output_size,)).astype('float32')
 
+        # static features: the concatenation of the embeddings below (see static_features)
+        self.embeddings: List[NLPEmbedding] = [emb for emb in (self.w2v, self.f2v, self.a2v) if emb]
+        self.static_dim: int = sum(emb.dim for emb in self.embeddings)
+
+        # the static features of the first word types in vocabs['word'] within static_bytes, where row 0 is for none
+        # and row i+1 is for the word id i; the rows beyond _num_static are spare capacity
+        self.static_bytes: int = static_bytes
+        self._static: np.array = np.zeros((1, self.static_dim), dtype='float32')
+        self._static_vocab: NLPVocabulary = None
+        self._num_static: int = 0
+        self._static_lock = threading.Lock()
+
+    @property
+    def node_dim(self) -> int:
+        """
+        :return: the dimension of the features of a node, the part-of-speech scores followed by the static features.
+        """
+        return len(self.pos_zeros) + self.static_dim
+
+    def arguments(self) -> Dict[str, Any]:
+        kwargs = super().arguments()
+        if self.a2v: kwargs['a2v'] = self.a2v.vsm
+        kwargs['output_size'] = len(self.pos_zeros)
+        kwargs['static_bytes'] = self.static_bytes
+        return kwargs
+
+    @property
+    def static_rows(self) -> int:
+        """
+        :return: the maximum number of word types whose static features are cached.
+        """
+        return self.static_bytes // (4 * self.static_dim) if self.static_dim else 0
+
+    def static_features(self, word_ids: np.array, out: np.array=None) -> np.array:
+        """
+        :param word_ids: the ids in vocabs['word'] (see NLPGraph.field_ids), -1 for none.
+        :param out: if not None, the array of shape = word_ids.shape + (static_dim,) to write the features into.
+        :return: the concatenation of the w2v, f2v, and a2v embeddings of the ids, shape = word_ids.shape + (dim,).
+          The static features never change across training steps, so they are gathered once per word type into a
+          float32 block indexed by word id (see static_block) and taken from it afterwards; word types beyond
+          static_bytes are gathered from the (possibly quantized or shared) embeddings on every call.
+        """
+        if out is None: out = np.empty(word_ids.shape + (self.static_dim,), dtype='float32')
+        if not self.embeddings: return out
+        static = self.static_block()
+        rows = word_ids + 1
+        miss = rows >= len(static)
+
+        if not miss.any():
+            out[...] = static[rows]
+        else:
+            features = static[np.where(miss, 0, rows)]
+            features[miss] = self.gather_features(word_ids[miss])
+            out[...] = features
+
+        return out
+
+    def static_block(self) -> np.array:
+        """
+        :return: the cached static features, where row i+1 is of the word id i, extended to the word types added to
+                 vocabs['word'] since the last call within static_rows.  The block grows by doubling its capacity.
+        """
+        vocab = self.vocabs['word']
+
+        with self._static_lock:
+            if self._static_vocab is not vocab:
+                self._static_vocab, self._num_static = vocab, 0
+
+            size = min(len(vocab), self.static_rows)
+            bidx = self._num_static
+
+            if bidx < size:
+                if len(self._static) <= size:
+                    static = np.empty((min(max(size, 2 * len(self._static)), self.static_rows) + 1, self.static_dim),
+                                      dtype='float32')
+                    static[:bidx + 1] = self._static[:bidx + 1]
+                    self._static = static
+
+                self._static[bidx + 1:size + 1] = self.gather_features(np.arange(bidx, size))
+                self._num_static = size
+
+            return self._static[:self._num_static + 1]
+
+    def gather_features(self, ids: np.array) -> np.array:
+        """
+        :param ids: the ids in vocabs['word'], -1 for none.
+        :return: the static features of the ids gathered from the embeddings, shape = (len(ids), static_dim).
+          Each embedding resolves the ids to its rows once per vocabulary entry (see NLPEmbedding.id_index) and
+          dequantizes only the gathered rows; fasttext vectors out of the precomputed table come from its cache.
+        """
+        out = np.empty((len(ids), self.static_dim), dtype='float32')
+        vocab = self.vocabs['word']
+        bidx = 0
+
+        for emb in self.embeddings:
+            eidx = bidx + emb.dim
+            out[:, bidx:eidx] = emb.get_ids(ids, vocab)
+            bidx = eidx
+
+        return out
+
 
 class POSState(NLPState):
     def __init__(self, graph: NLPGraph, lexicon: POSLexicon, save_gold=False):
@@ -56,6 +166,8 @@ class POSState(NLPState):
         # reset
         self.golds = [node.set_pos(None) for node in self.graph] if save_gold else None
         for node in self.graph: node.pos_scores = lexicon.pos_zeros
+        if self.graph.ids: self.graph.ids['pos'][1:] = -1
+        self.scores: np.array = np.zeros((len(self.graph.nodes), len(lexicon.pos_zeros)), dtype='float32')
         self.idx_curr: int = 1
 
     def reset(self):
@@ -63,6 +175,7 @@ class POSState(NLPState):
             node.pos = None
             node.pos_scores = self.lex.pos_zeros
 
+        self.scores[:] = 0
         self.idx_curr = 1
         self.reset_count += 1
 
@@ -86,7 +199,15 @@ class POSState(NLPState):
 
     def process(self, label: str, scores: np.array=None):
         node: NLPNode = self.graph.nodes[self.idx_curr]
-        if scores is not None: node.pos_scores = scores
+
+        # the scores of the state are the only copy; the node keeps a view of its row
+        if scores is not None:
+            if len(scores) != self.scores.shape[1]:
+                raise ValueError('The scores have %d labels, not %d (see POSLexicon.output_size).' %
+                                 (len(scores), self.scores.shape[1]))
+            self.scores[self.idx_curr] = scores
+            node.pos_scores = self.scores[self.idx_curr]
+
         node.pos = label
         self.idx_curr += 1
 
@@ -103,39 +224,112 @@ class POSState(NLPState):
         if self.lex.a2v: fs.append(self.lex.a2v.get(node))
         return fs
 
+    def feature_matrix(self, node_ids: np.array) -> np.array:
+        """
+        :param node_ids: the IDs of nodes in the graph, -1 for none (see NLPState.get_nodes).
+        :return: the features of the nodes, where the i'th row is the concatenation of features(nodes[i]);
+                 the scores are read from self.scores, and the embeddings are looked up by the word ids of the nodes
+                 (see NLPGraph.field_ids).
+        """
+        word_ids = self.graph.field_ids('word', node_ids, self.lex.vocabs)
+        scores = np.concatenate((self.scores, self.lex.pos_zeros[None, :]))[node_ids]
+        return np.hstack((scores, self.lex.static_features(word_ids)))
+
 
 class POSModel(NLPModel):
     def __init__(self, batch_size=32, num_label: int=50, feature_context: Tuple = (-2, -1, 0, 1, 2),
                  context: mx.context.Context=mx.cpu(), w2v_dim=200,
                  ngram_filter_list=(1, 2, 3), ngram_filter: int=64):
         super().__init__(POSState, batch_size)
-        self.mxmod: mx.module.Module = self.init_mxmod(batch_size=batch_size,
-                                                       num_label=num_label,
-                                                       num_feature=len(feature_context),
-                                                       context=context,
-                                                       w2v_dim=w2v_dim,
-                                                       ngram_filter_list=ngram_filter_list,
-                                                       ngram_filter=ngram_filter)
+        self.mxmod: mx.mod.BucketingModule = self.init_mxmod(batch_size=batch_size,
+                                                             num_label=num_label,
+                                                             num_feature=len(feature_context),
+                                                             context=context,
+                                                             w2v_dim=w2v_dim,
+                                                             ngram_filter_list=ngram_filter_list,
+                                                             ngram_filter=ngram_filter)
         self.feature_context: Tuple[int] = feature_context
+        self.node_dim: int = w2v_dim
 
     # ============================== Feature ==============================
 
+    @property
+    def feature_dim(self) -> int:
+        """
+        :return: the features of each node in the context window (see POSLexicon.node_dim) times the window size.
+        """
+        return len(self.feature_context) * self.node_dim
+
     def x(self, state: POSState) -> np.array:
-        vectors = [feature for window in self.feature_context
-                   for feature in state.features(state.get_node(state.idx_curr, window))]
-        return np.concatenate(vectors, axis=0)
+        node_ids = NLPState.get_nodes([state], [state.idx_curr], self.feature_context)[0]
+        return state.feature_matrix(node_ids).ravel()
+
+    def feature_vectors(self, states: List[POSState]) -> np.array:
+        """
+        :return: the matrix whose i'th row is x(states[i]) (see feature_rows and state_features).
+        """
+        if not states: return np.empty((0, self.feature_dim), dtype='float32')
+        xs = self.feature_rows(states[0].lex, self.feature_inputs(states))
+        self.state_features(states, xs)
+        return xs
+
+    def window_rows(self, states: List[POSState]) -> np.array:
+        """
+        :return: the rows of the context windows of the states in the nodes of all states concatenated, where the
+          row after the last node stands for none, shape = (len(states), len(feature_context)).
+        """
+        sizes = np.array([len(state.graph.nodes) for state in states])
+        idx_curr = np.array([state.idx_curr for state in states])
+        offsets = np.cumsum(sizes) - sizes
+        positions = idx_curr[:, None] + np.array(self.feature_context)
+        return np.where((positions >= 1) & (positions < sizes[:, None]), offsets[:, None] + positions, sizes.sum())
+
+    def feature_inputs(self, states: List[POSState]) -> np.array:
+        """
+        :return: the word ids of the context windows of the states, -1 for none (see window_rows).
+        """
+        lex = states[0].lex
+        ids = np.concatenate([state.graph.get_ids(lex.vocabs)['word'] for state in states] + [[-1]])
+        return ids[self.window_rows(states)]
+
+    def feature_rows(self, lexicon: POSLexicon, inputs: np.array, out: np.array=None) -> np.array:
+        """
+        :param inputs: the return value of feature_inputs.
+        :param out: if not None, the matrix to write the rows into.
+        :return: the matrix whose i'th row is the features of the i'th state in the inputs, but the part-of-speech
+          scores (see state_features).  The static features of all windows are gathered in one call
+          (see POSLexicon.static_features), written into one preallocated matrix.
+        """
+        if out is None: out = np.empty((len(inputs), self.feature_dim), dtype='float32')
+        pos_dim = len(lexicon.pos_zeros)
+        lexicon.static_features(inputs, out.reshape(len(inputs), len(self.feature_context), -1)[:, :, pos_dim:])
+        return out
+
+    def state_features(self, states: List[POSState], out: np.array):
+        """
+        Write the part-of-speech scores of the context windows of the states into the rows from feature_rows.
+        """
+        lex = states[0].lex
+        scores = np.concatenate([state.scores for state in states] + [lex.pos_zeros[None, :]])
+        out.reshape(len(states), len(self.feature_context), -1)[:, :, :len(lex.pos_zeros)] = \
+            scores[self.window_rows(states)]
 
     # ============================== Module ==============================
 
     def init_mxmod(self, batch_size: int, num_label: int, num_feature: int, context: mx.context.Context, w2v_dim: int,
-                   ngram_filter_list: Tuple, ngram_filter: int) -> mx.module.Module:
-        # n-gram convolution
-        input  = mx.sym.Variable('data')
+                   ngram_filter_list: Tuple, ngram_filter: int) -> mx.mod.BucketingModule:
+        """
+        :param batch_size: the default bucket; the network does not depend on the batch size, so every bucket
+          (see NLPModel.buckets) shares the same symbol and parameters.
+        :param w2v_dim: the dimension of the features of each node in the context window (see POSLexicon.node_dim).
+        """
+        # n-gram convolution over the rows of the feature vectors, reshaped to (batch, channel, window, feature)
+        input  = mx.sym.Reshape(data=mx.sym.Variable('data'), shape=(-1, 1, num_feature, w2v_dim))
         pooled = [conv_pool(input, conv_kernel=(filter, w2v_dim), num_filter=ngram_filter, act_type='relu',
                             pool_kernel=(num_feature - filter + 1, 1), pool_stride=(1, 1))
                   for filter in ngram_filter_list]
         concat = mx.sym.Concat(*pooled, dim=1)
-        h_pool = mx.sym.Reshape(data=concat, shape=(batch_size, ngram_filter * len(ngram_filter_list)))
+        h_pool = mx.sym.Reshape(data=concat, shape=(-1, ngram_filter * len(ngram_filter_list)))
       # h_pool = mx.sym.Dropout(data=h_pool, p=dropouts[0]) if dropouts[0] > 0.0 else h_pool
 
         # fully connected
@@ -144,9 +338,10 @@ class POSModel(NLPModel):
         fc = mx.sym.FullyConnected(data=h_pool, weight=fc_weight, bias=fc_bias, num_hidden=num_label)
 
         output = mx.sym.Variable('softmax_label')
-        sm = mx.sym.SoftmaxOutput(data=fc, label=output, name='softmax')
+        sm = mx.sym.SoftmaxOutput(data=fc, label=output, name='softmax', use_ignore=True, ignore_label=IGNORE_LABEL)
 
-        return mx.mod.Module(symbol=sm, context=context)
+        return mx.mod.BucketingModule(lambda bucket_key: (sm, ('data',), ('softmax_label',)),
+                                      default_bucket_key=batch_size, context=context)
 
 
 def parse_args():
@@ -183,14 +378,16 @@ def main():
     dev_graphs = read_graphs(args.tsv, args.dev_data)
 
     # lexicon
-    w2v = KeyedVectors.load_word2vec_format(args.w2v, binary=True) if args.w2v else None
-    f2v = fasttext.load_model(args.f2v) if args.f2v else None
-    a2v = KeyedVectors.load_word2vec_format(args.a2v, binary=True) if args.a2v else None
+    w2v = LEXICA.acquire(args.w2v, dtype=args.w2v_dtype) if args.w2v else None
+    a2v = LEXICA.acquire(args.a2v, dtype=args.w2v_dtype) if args.a2v else None
+    f2v_table = EmbeddingTable.load(args.f2v_table) if args.f2v and args.f2v_table else None
+    f2v = LEXICA.acquire(args.f2v, loader=fasttext.load_model, cache=EmbeddingCache(args.f2v_cache << 20),
+                         table=f2v_table) if args.f2v else None
     lexicon = POSLexicon(w2v=w2v, f2v=f2v, a2v=a2v, output_size=args.output_size)
 
     # model
-    model = POSModel(feature_context=args.feature_context)
-    model.train(trn_graphs, dev_graphs, lexicon, num_steps=args.num_steps
+    model = POSModel(num_label=args.output_size, feature_context=args.feature_context, w2v_dim=lexicon.node_dim)
+    model.train(trn_graphs, dev_graphs, lexicon, num_steps=args.num_steps,
                 bagging_ratio=args.bagging_ratio, optimizer=args.optimizer)
 
 
@@ -13,30 +13,344 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ========================================================================
-from typing import Union
+import hashlib
+import os
+import threading
+import weakref
+import zlib
+from collections import OrderedDict
+from concurrent.futures import Future
+from multiprocessing.shared_memory import SharedMemory
+from typing import Any, Callable, Dict, Iterable, List, Sequence, Tuple, Type, Union
 
 import numpy as np
 from fasttext.model import WordVectorModel
 from gensim.models.keyedvectors import KeyedVectors
 
 from elit import structure
-from elit.structure import NLPNode
+from elit.structure import NLPNode, NLPVocabulary, create_vocabs
 
 __author__ = 'Jinho D. Choi'
 
+# reserved indices for NLPEmbedding.get_batch
+ZERO_INDEX = -1
+ROOT_INDEX = -2
+
+# file extensions of EmbeddingTable: the matrix, its keys (see MappedVocabulary), and the row scales of an int8 matrix
+TABLE_EXT = '.npy'
+VOCAB_EXTS = {'blob': '.keys.npy', 'offsets': '.offsets.npy', 'slots': '.slots.npy'}
+SCALE_EXT = '.scale.npy'
+
+# the keys of tables saved by earlier versions, one per line
+VOCAB_EXT = '.vocab'
+
+# storage types of EmbeddingTable
+DTYPES = ('float32', 'float16', 'int8')
+
+
+def fasttext_keys(keys: Iterable[str]) -> List[str]:
+    """
+    :return: the keys of a table precomputed from fasttext, where the root and zero keys come first.
+    """
+    return [structure.ROOT_TAG, ''] + sorted(set(keys) - {structure.ROOT_TAG, ''})
+
+
+class MappedVocabulary:
+    def __init__(self, blob: np.array, offsets: np.array, slots: np.array):
+        """
+        :param blob: the UTF-8 bytes of all keys concatenated in the order of their ids (uint8).
+        :param offsets: the key of the id i is blob[offsets[i]:offsets[i+1]] (int64).
+        :param slots: an open-addressing hash table of ids, -1 for empty, whose size is a power of 2; the search for
+                      a key starts at the slot of its CRC-32 and probes the following slots (int32).
+          A read-only vocabulary of an EmbeddingTable that consists of three arrays only, so it is memory-mapped at
+          load time instead of being parsed into a dictionary, and its pages are shared by all processes on the host.
+        """
+        self.blob = blob
+        self.offsets = offsets
+        self.slots = slots
+        self._mask = len(slots) - 1
+
+    def __len__(self):
+        return len(self.offsets) - 1
+
+    def __contains__(self, key: str):
+        return self.index(key) >= 0
+
+    @classmethod
+    def build(cls, keys: Iterable[str]) -> 'MappedVocabulary':
+        """
+        :param keys: the keys in the order of their ids; the first occurrence of a duplicate key is found.
+        """
+        data = [key.encode('utf-8') for key in keys]
+        offsets = np.zeros(len(data) + 1, dtype=np.int64)
+        np.cumsum([len(b) for b in data], out=offsets[1:])
+        blob = np.frombuffer(b''.join(data), dtype=np.uint8)
+        slots = np.full(1 << (2 * len(data)).bit_length(), -1, dtype=np.int32)
+        mask = len(slots) - 1
+
+        for i, b in enumerate(data):
+            h = zlib.crc32(b) & mask
+            while slots[h] >= 0 and data[slots[h]] != b: h = (h + 1) & mask
+            if slots[h] < 0: slots[h] = i
+
+        return cls(blob, offsets, slots)
+
+    def index(self, key: str) -> int:
+        """
+        :return: the id of the key if exists; otherwise, -1.
+        """
+        if key is None: return -1
+        b = key.encode('utf-8')
+        h = zlib.crc32(b) & self._mask
+
+        while True:
+            idx = int(self.slots[h])
+            if idx < 0: return -1
+            bidx, eidx = self.offsets[idx:idx + 2].tolist()
+            if eidx - bidx == len(b) and self.blob[bidx:eidx].tobytes() == b: return idx
+            h = (h + 1) & self._mask
+
+    def get(self, index: int) -> Union[str, None]:
+        """
+        :return: the key of the id if exists; otherwise, None.
+        """
+        if index < 0: return None
+        bidx, eidx = self.offsets[index:index + 2].tolist()
+        return self.blob[bidx:eidx].tobytes().decode('utf-8')
+
+    @property
+    def keys(self) -> List[str]:
+        return [self.get(i) for i in range(len(self))]
+
+    @property
+    def arrays(self) -> Dict[str, np.array]:
+        return {'blob': self.blob, 'offsets': self.offsets, 'slots': self.slots}
+
+    def save(self, prefix: str):
+        """
+        :param prefix: the path of the table without TABLE_EXT; the arrays are saved with VOCAB_EXTS.
+        """
+        for name, array in self.arrays.items(): np.save(prefix + VOCAB_EXTS[name], array)
+
+    @classmethod
+    def exists(cls, prefix: str) -> bool:
+        return all(os.path.isfile(prefix + ext) for ext in VOCAB_EXTS.values())
+
+    @classmethod
+    def load(cls, prefix: str, mmap_mode: str='r') -> 'MappedVocabulary':
+        """
+        :param mmap_mode: the mode to memory-map the arrays (see numpy.load); if None, the arrays are read.
+        """
+        return cls(**{name: np.load(prefix + ext, mmap_mode=mmap_mode).view(np.ndarray)
+                      for name, ext in VOCAB_EXTS.items()})
+
+
+class EmbeddingTable:
+    def __init__(self, syn0: np.array, keys: Union[List[str], NLPVocabulary, MappedVocabulary], scale: np.array=None):
+        """
+        :param syn0: the embedding matrix whose i'th row is the embedding of the i'th key.
+        :param keys: the keys of the rows, or their vocabulary.
+        :param scale: the per-row scales of an int8 matrix such that syn0[i] * scale[i] is the i'th embedding.
+          A word2vec-like table that can be saved as .npy files, the matrix and its vocabulary (see MappedVocabulary),
+          and memory-mapped at load time so processes on the same host share their pages.  The matrix is stored in
+          float32, float16, or int8; rows are dequantized to float32 by take().
+        """
+        self.syn0 = syn0
+        self.vocab = keys if isinstance(keys, (NLPVocabulary, MappedVocabulary)) else NLPVocabulary(keys)
+        self.scale = scale
+
+    def __len__(self):
+        return len(self.vocab)
+
+    @property
+    def dtype(self) -> str:
+        return self.syn0.dtype.name
+
+    def take(self, ids: np.array) -> np.array:
+        """
+        :param ids: the row indices.
+        :return: the float32 embeddings of the rows, shape = (len(ids), dim).
+        """
+        emb = np.take(self.syn0, ids, axis=0)
+        if self.scale is not None: return emb.astype(np.float32) * np.take(self.scale, ids)[:, None]
+        return emb.astype(np.float32, copy=False)
+
+    def row(self, idx: int) -> np.array:
+        """
+        :return: the float32 embedding of the row.
+        """
+        emb = self.syn0[idx].astype(np.float32)
+        return emb * self.scale[idx] if self.scale is not None else emb
+
+    def quantize(self, dtype: str, block: int=1 << 16) -> 'EmbeddingTable':
+        """
+        :param dtype: the storage type in DTYPES.
+        :param block: the number of rows converted at a time, bounding the temporary float32 memory.
+        :return: the table storing the embeddings in the type; the vocabulary is shared.
+          int8 rows are scaled by max(|row|) / 127 so that each row uses the full range.
+        """
+        if dtype not in DTYPES: raise ValueError('Unsupported dtype: %s' % dtype)
+        if dtype == self.dtype: return self
+        syn0 = np.empty(self.syn0.shape, dtype=dtype)
+        scale = np.empty(len(syn0), dtype=np.float32) if dtype == 'int8' else None
+
+        for bidx in range(0, len(syn0), block):
+            ids = np.arange(bidx, min(bidx + block, len(syn0)))
+            emb = self.take(ids)
+
+            if scale is None:
+                syn0[ids] = emb
+            else:
+                s = np.abs(emb).max(axis=1) / 127
+                s[s == 0] = 1
+                syn0[ids] = np.rint(emb / s[:, None])
+                scale[ids] = s
+
+        return EmbeddingTable(syn0, self.vocab, scale)
+
+    def index(self, key: str) -> int:
+        """
+        :return: the row index of the key if exists; otherwise, ZERO_INDEX.
+        """
+        idx = self.vocab.index(key)
+        return idx if idx >= 0 else ZERO_INDEX
+
+    @classmethod
+    def from_keyed_vectors(cls, vsm: KeyedVectors) -> 'EmbeddingTable':
+        return cls(vsm.syn0, vsm.index2word)
+
+    @classmethod
+    def exists(cls, filename: str) -> bool:
+        """
+        :return: True if the file is the matrix of a saved table; otherwise, False.
+        """
+        if not filename.endswith(TABLE_EXT) or not os.path.isfile(filename): return False
+        prefix = filename[:-len(TABLE_EXT)]
+        return MappedVocabulary.exists(prefix) or os.path.isfile(prefix + VOCAB_EXT)
+
+    def save(self, filename: str):
+        """
+        :param filename: the path of the matrix ending with TABLE_EXT; the vocabulary is saved next to it.
+        """
+        if not filename.endswith(TABLE_EXT): filename += TABLE_EXT
+        prefix = filename[:-len(TABLE_EXT)]
+        np.save(filename, np.ascontiguousarray(self.syn0))
+        if self.scale is not None: np.save(prefix + SCALE_EXT, self.scale)
+        elif os.path.isfile(prefix + SCALE_EXT): os.remove(prefix + SCALE_EXT)
+        vocab = self.vocab if isinstance(self.vocab, MappedVocabulary) else MappedVocabulary.build(self.vocab.keys)
+        vocab.save(prefix)
+        if os.path.isfile(prefix + VOCAB_EXT): os.remove(prefix + VOCAB_EXT)
+
+    @classmethod
+    def load(cls, filename: str, mmap_mode: str='r') -> 'EmbeddingTable':
+        """
+        :param filename: the path of the matrix ending with TABLE_EXT.
+        :param mmap_mode: the mode to memory-map the matrix and the vocabulary (see numpy.load); if None, they are read.
+          The keys of a table saved in the earlier text format are parsed into an NLPVocabulary instead.
+        """
+        syn0 = np.load(filename, mmap_mode=mmap_mode).view(np.ndarray)
+        prefix = filename[:-len(TABLE_EXT)]
+        scale = np.load(prefix + SCALE_EXT) if os.path.isfile(prefix + SCALE_EXT) else None
+
+        if MappedVocabulary.exists(prefix):
+            keys = MappedVocabulary.load(prefix, mmap_mode)
+        else:
+            with open(prefix + VOCAB_EXT, encoding='utf-8') as fin:
+                keys = fin.read().split('\n')[:len(syn0)]
+
+        return cls(syn0, keys, scale)
+
+
+def load_word2vec(filename: str) -> Union[KeyedVectors, EmbeddingTable]:
+    """
+    :param filename: either the matrix of an EmbeddingTable (*.npy) or a word2vec binary file.
+    :return: the memory-mapped EmbeddingTable if the file is a table; otherwise, the loaded KeyedVectors.
+    """
+    if EmbeddingTable.exists(filename): return EmbeddingTable.load(filename)
+    return KeyedVectors.load_word2vec_format(filename, binary=True)
+
+
+class EmbeddingCache:
+    def __init__(self, max_bytes: int=1 << 28):
+        """
+        :param max_bytes: the budget of the cached embeddings in bytes.
+          A thread-safe LRU cache of embeddings keyed by the key string (e.g., word form); a cache must not be shared
+          by different models.  The least recently used embeddings are evicted once the budget is exceeded.
+        """
+        self.max_bytes: int = max_bytes
+        self.nbytes: int = 0
+        self.hits: int = 0
+        self.misses: int = 0
+        self.evictions: int = 0
+        self._cache: OrderedDict = OrderedDict()
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._cache)
+
+    def get(self, key: str, compute: Callable[[str], np.array]) -> np.array:
+        """
+        :param key: the key of the embedding.
+        :param compute: computes the embedding of the key on a miss; called without holding the lock.
+        :return: the read-only embedding of the key.
+        """
+        with self._lock:
+            emb = self._cache.get(key, None)
+            if emb is not None:
+                self._cache.move_to_end(key)
+                self.hits += 1
+                return emb
+
+        emb = compute(key)
+        emb.flags.writeable = False
+
+        with self._lock:
+            self.misses += 1
+            if key in self._cache: return self._cache[key]
+            self._cache[key] = emb
+            self.nbytes += emb.nbytes
+
+            while self.nbytes > self.max_bytes and len(self._cache) > 1:
+                _, evicted = self._cache.popitem(last=False)
+                self.nbytes -= evicted.nbytes
+                self.evictions += 1
+
+        return emb
+
+    def clear(self):
+        with self._lock:
+            self._cache.clear()
+            self.nbytes = 0
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        return {'size': len(self._cache), 'bytes': self.nbytes, 'hits': self.hits, 'misses': self.misses,
+                'evictions': self.evictions}
+
 
 class NLPEmbedding:
-    def __init__(self, vsm: Union[KeyedVectors, WordVectorModel], key_field: str, emb_field: str):
+    def __init__(self, vsm: Union[KeyedVectors, EmbeddingTable, WordVectorModel], key_field: str,
+                 cache: EmbeddingCache=None, dtype: str=None, table: EmbeddingTable=None):
         """
-        :param vsm: the vector space model in either the form of Word2Vec or FastText.
+        :param vsm: the vector space model in the form of Word2Vec, EmbeddingTable, or FastText.
         :param key_field: the field in NLPNode (e.g., word, pos) used as the key to retrieve the embedding from vsm.
-        :param emb_field: where the embedding with respect to the key is saved in NLPNode.
+        :param cache: the cache of embeddings computed by FastText; if None, a cache with the default budget is used.
+        :param dtype: the storage type of the word2vec matrix in DTYPES; if None, the matrix is kept as it is.
+          Quantized rows are dequantized to float32 when retrieved.
+        :param table: the vectors precomputed from the fasttext model (see lexicon_builder precompute);
+          the table is preferred and the model is called only for keys not in the table.
         """
+        if dtype and isinstance(vsm, KeyedVectors): vsm = EmbeddingTable.from_keyed_vectors(vsm)
+        if dtype and isinstance(vsm, EmbeddingTable): vsm = vsm.quantize(dtype)
         self.vsm = vsm
         self.key_field = key_field
-        self.emb_field = emb_field
+        self.cache = None
+        self.table = None
+        # vocabulary -> the row of each id in the vocabulary followed by ZERO_INDEX, which id -1 reaches without
+        # branching; an embedding shared by several lexica keeps one array per vocabulary, dropped with it
+        self._id_rows: weakref.WeakKeyDictionary = weakref.WeakKeyDictionary()
 
-        if isinstance(vsm, KeyedVectors):
+        if isinstance(vsm, (KeyedVectors, EmbeddingTable)):
             vector_size = vsm.syn0.shape[1]
 
             # root
@@ -46,9 +360,18 @@ class NLPEmbedding:
 
             # zero
             self.zero = np.zeros((vector_size,)).astype('float32')
+
+            # tables pruned from fasttext keep its root and zero vectors (see prune)
+            if isinstance(vsm, EmbeddingTable):
+                if structure.ROOT_TAG in vsm.vocab: self.root = vsm.row(vsm.index(structure.ROOT_TAG))
+                if '' in vsm.vocab: self.zero = vsm.row(vsm.index(''))
         elif isinstance(vsm, WordVectorModel):
             self.root = np.array(vsm[structure.ROOT_TAG]).astype('float32')
             self.zero = np.array(vsm['']).astype('float32')
+            self.cache = cache or EmbeddingCache()
+            self.table = table
+
+        self.dim = len(self.zero)
 
     def get(self, node: NLPNode) -> np.array:
         """
@@ -56,26 +379,401 @@ class NLPEmbedding:
         """
         if node is None: return self.zero
         if node.node_id == 0: return self.root
-        if hasattr(node, self.emb_field): return getattr(node, self.emb_field)
 
-        f = getattr(node, self.key_field)
-        emb = None
+        if isinstance(self.vsm, WordVectorModel):
+            key = getattr(node, self.key_field)
+            idx = self.table.index(key) if self.table else ZERO_INDEX
+            return self.table.row(idx) if idx != ZERO_INDEX else self.cache.get(key, self._compute)
+
+        idx = self.index(node)
+        if idx == ZERO_INDEX: return self.zero
+        return self.vsm.row(idx) if isinstance(self.vsm, EmbeddingTable) else self.vsm.syn0[idx]
+
+    def _compute(self, key: str) -> np.array:
+        return np.array(self.vsm[key]).astype('float32')
+
+    def index(self, node: NLPNode) -> int:
+        """
+        :return: the row index of the node in syn0 with respect to the key_field;
+                 ROOT_INDEX if the node is the root, ZERO_INDEX if the node is None or its key is unknown.
+        """
+        if node is None: return ZERO_INDEX
+        if node.node_id == 0: return ROOT_INDEX
+        return self.key_index(getattr(node, self.key_field))
+
+    def key_index(self, key: str) -> int:
+        """
+        :return: the row index of the key in syn0 (in the precomputed table for fasttext) if exists;
+                 otherwise, ZERO_INDEX.
+        """
+        if isinstance(self.vsm, EmbeddingTable): return self.vsm.index(key)
+        if isinstance(self.vsm, WordVectorModel): return self.table.index(key) if self.table else ZERO_INDEX
+        vocab = self.vsm.vocab.get(key, None)
+        return ZERO_INDEX if vocab is None else vocab.index
+
+    def id_index(self, ids: np.array, vocab: NLPVocabulary) -> np.array:
+        """
+        :param ids: the ids of the key_field in the vocabulary (see NLPGraph.field_ids), -1 for none.
+        :param vocab: the vocabulary of the key_field (see NLPLexiconMapper.vocabs).
+        :return: the row index of each id as index() returns for its node; the id of ROOT_TAG gives ROOT_INDEX.
+          The rows of the ids are resolved once per vocabulary entry and kept in an array indexed by id, so no
+          string is looked up after the graphs are encoded.
+        """
+        rows = self._id_rows.get(vocab, None)
+        if rows is None: rows = np.full(1, ZERO_INDEX, dtype=np.int32)
+        size = len(rows) - 1
+
+        if size < len(vocab):
+            keys = vocab.keys[size:len(vocab)]
+            added = np.fromiter(map(self.key_index, keys), dtype=np.int32, count=len(keys))
+            rows = np.concatenate((rows[:size], added, rows[size:]))
+            rows[0] = ROOT_INDEX
+            self._id_rows[vocab] = rows
+
+        return rows[ids]
+
+    def get_ids(self, ids: np.array, vocab: NLPVocabulary) -> np.array:
+        """
+        :param ids: the ids of the key_field in the vocabulary (see NLPGraph.field_ids), -1 for none.
+        :param vocab: the vocabulary of the key_field (see NLPLexiconMapper.vocabs).
+        :return: the embeddings of the ids, shape = (len(ids), dim).
+          For fasttext, the ids out of the precomputed table are decoded to compute their vectors.
+        """
+        rows = self.id_index(ids, vocab)
+        if not isinstance(self.vsm, WordVectorModel): return self.get_batch(rows)
+
+        emb = self.table.take(np.maximum(rows, 0)) if self.table else np.empty((len(ids), self.dim), dtype='float32')
+        keys = vocab.keys
+
+        for i in np.flatnonzero(rows < 0).tolist():
+            if rows[i] == ROOT_INDEX: emb[i] = self.root
+            elif ids[i] < 0: emb[i] = self.zero
+            else: emb[i] = self.cache.get(keys[ids[i]], self._compute)
+
+        return emb
+
+    def prune(self, keys: Iterable[str]) -> EmbeddingTable:
+        """
+        :param keys: the keys to be kept (e.g., the word types in the training and serving corpora).
+        :return: the table consisting of the embeddings of the keys.
+          For word2vec, keys not in the model are dropped and the rows keep their original order.
+          For fasttext, the vectors of all keys are precomputed, including keys out of its vocabulary,
+          and the root and zero vectors are saved as the first two rows.
+        """
+        if isinstance(self.vsm, WordVectorModel):
+            keys = fasttext_keys(keys)
+            return EmbeddingTable(np.vstack([self._compute(key) for key in keys]), keys)
+
+        rows = sorted(idx for idx in map(self.key_index, set(keys)) if idx != ZERO_INDEX)
+        if isinstance(self.vsm, EmbeddingTable):
+            scale = self.vsm.scale[rows] if self.vsm.scale is not None else None
+            return EmbeddingTable(self.vsm.syn0[rows], [self.vsm.vocab.get(idx) for idx in rows], scale)
+
+        return EmbeddingTable(self.vsm.syn0[rows], [self.vsm.index2word[idx] for idx in rows])
+
+    def get_batch(self, nodes_or_ids: Union[Sequence[NLPNode], np.array]) -> np.array:
+        """
+        :param nodes_or_ids: nodes (None allowed) or their row indices from index().
+        :return: the embeddings of the nodes with respect to the key_field, shape = (len(nodes_or_ids), dim).
+          For word2vec, the indices are looked up once and all rows are gathered by a single np.take on syn0;
+          quantized rows are dequantized together after the gather.
+          Row indices are not available for fasttext, which takes nodes only; with a precomputed table,
+          the rows of the nodes found in the table are gathered at once and the rest are computed by the model.
+        """
+        if isinstance(self.vsm, WordVectorModel):
+            if isinstance(nodes_or_ids, np.ndarray): raise TypeError('fasttext embeddings are looked up by nodes')
+            if not len(nodes_or_ids): return np.empty((0, self.dim), dtype='float32')
+            if not self.table: return np.vstack([self.get(node) for node in nodes_or_ids])
+
+            ids = np.fromiter((self.table.index(getattr(node, self.key_field)) if node and node.node_id else ZERO_INDEX
+                               for node in nodes_or_ids), dtype=np.int64, count=len(nodes_or_ids))
+            emb = self.table.take(np.maximum(ids, 0))
+            for i in np.flatnonzero(ids == ZERO_INDEX): emb[i] = self.get(nodes_or_ids[i])
+            return emb
 
-        if isinstance(self.vsm, KeyedVectors):
-            vocab = self.vsm.vocab.get(f, None)
-            emb = self.zero if vocab is None else self.vsm.syn0[vocab.index]
-        elif isinstance(self.vsm, WordVectorModel):
-            emb = np.array(self.vsm[f]).astype('float32')
+        if isinstance(nodes_or_ids, np.ndarray):
+            ids = nodes_or_ids
+        else:
+            ids = np.fromiter((self.index(node) for node in nodes_or_ids), dtype=np.int64, count=len(nodes_or_ids))
+
+        rows = np.maximum(ids, 0)
+        emb = self.vsm.take(rows) if isinstance(self.vsm, EmbeddingTable) else np.take(self.vsm.syn0, rows, axis=0)
+
+        if (rows != ids).any():
+            emb[ids == ZERO_INDEX] = self.zero
+            emb[ids == ROOT_INDEX] = self.root
 
-        setattr(node, self.emb_field, emb)
         return emb
 
 
+def as_embedding(vsm: Union[KeyedVectors, EmbeddingTable, WordVectorModel, NLPEmbedding], key_field: str,
+                 **kwargs) -> NLPEmbedding:
+    """
+    :param kwargs: the optional arguments of NLPEmbedding.
+    :return: vsm if it is already an embedding (e.g., acquired from LexiconRegistry); otherwise, the embedding of vsm.
+    """
+    return vsm if isinstance(vsm, NLPEmbedding) else NLPEmbedding(vsm, key_field, **kwargs)
+
+
 class NLPLexiconMapper:
-    def __init__(self, w2v: KeyedVectors=None, f2v: WordVectorModel=None):
+    def __init__(self, w2v: Union[KeyedVectors, EmbeddingTable, NLPEmbedding]=None,
+                 f2v: Union[WordVectorModel, NLPEmbedding]=None, f2v_cache: EmbeddingCache=None, dtype: str=None,
+                 f2v_table: EmbeddingTable=None):
+        """
+        :param w2v: load_word2vec('*.bin' or '*.npy'), or its embedding shared through LexiconRegistry.
+        :param f2v: f2v.load_model('*.bin'), or its embedding shared through LexiconRegistry.
+        :param f2v_cache: the cache of f2v embeddings.
+        :param dtype: the storage type of the word2vec matrices in DTYPES (see NLPEmbedding).
+        :param f2v_table: the vectors precomputed from f2v, preferred to calling f2v.
+          The last three arguments are ignored for shared embeddings, which are configured when acquired.
+          Graphs are encoded by the vocabularies of this lexicon (see NLPGraph.get_ids), which live as long as it.
+        """
+        self.dtype = dtype
+        self.vocabs: Dict[str, NLPVocabulary] = create_vocabs()
+        self.w2v: NLPEmbedding = as_embedding(w2v, 'word', dtype=dtype) if w2v else None
+        self.f2v: NLPEmbedding = as_embedding(f2v, 'word', cache=f2v_cache, table=f2v_table) if f2v else None
+
+    def arguments(self) -> Dict[str, Any]:
+        """
+        :return: the arguments with which the type of this lexicon builds a lexicon with the same embeddings.
+        """
+        kwargs = {}
+        if self.w2v: kwargs['w2v'] = self.w2v.vsm
+        if self.f2v: kwargs['f2v'] = self.f2v.vsm
+        return kwargs
+
+    def factory(self) -> 'LexiconFactory':
+        """
+        :return: the factory of lexica with the same embeddings as this lexicon, shared with other processes
+                 (see LexiconFactory); the vocabularies are not included.
+        """
+        return LexiconFactory(type(self), **self.arguments())
+
+
+# ============================== Shared Memory ==============================
+
+class SharedTable:
+    def __init__(self, table: EmbeddingTable):
         """
-        :param w2v: KeyedVectors.load_word2vec_format('*.bin').
-        :param f2v: f2v.load_model('*.bin').
+        :param table: the table whose matrix, row scales, and vocabulary (see MappedVocabulary) are copied to shared
+                      memory once.
+          A picklable handle of the table, which any process on the same host can attach() to without copying or
+          parsing anything; only the names and shapes of the arrays are pickled.  The process that creates the
+          handle owns the shared memory and must unlink() it when all processes are done.
         """
-        self.w2v: NLPEmbedding = NLPEmbedding(w2v, 'word', 'w2v') if w2v else None
-        self.f2v: NLPEmbedding = NLPEmbedding(f2v, 'word', 'f2v') if f2v else None
+        vocab = table.vocab if isinstance(table.vocab, MappedVocabulary) else MappedVocabulary.build(table.vocab.keys)
+        self._owned: List[SharedMemory] = []
+        self.arrays: Dict[str, Tuple[str, Tuple[int, ...], str]] = {'syn0': self._publish(table.syn0)}
+        if table.scale is not None: self.arrays['scale'] = self._publish(table.scale)
+        for name, array in vocab.arrays.items(): self.arrays[name] = self._publish(array)
+
+    def __getstate__(self):
+        return {'arrays': self.arrays, '_owned': []}
+
+    @property
+    def nbytes(self) -> int:
+        return sum(int(np.prod(shape)) * np.dtype(dtype).itemsize for _, shape, dtype in self.arrays.values())
+
+    def _publish(self, array: np.array) -> Tuple[str, Tuple[int, ...], str]:
+        shm = SharedMemory(create=True, size=max(array.nbytes, 1))
+        np.ndarray(array.shape, dtype=array.dtype, buffer=shm.buf)[...] = array
+        self._owned.append(shm)
+        return shm.name, array.shape, array.dtype.str
+
+    def attach(self) -> EmbeddingTable:
+        """
+        :return: the read-only table whose matrix and vocabulary are mapped from the shared memory.
+        """
+        shms, arrays = [], {}
+
+        for key, (name, shape, dtype) in self.arrays.items():
+            shm = SharedMemory(name=name)
+            array = np.ndarray(shape, dtype=dtype, buffer=shm.buf)
+            array.flags.writeable = False
+            shms.append(shm)
+            arrays[key] = array
+
+        vocab = MappedVocabulary(arrays['blob'], arrays['offsets'], arrays['slots'])
+        table = EmbeddingTable(arrays['syn0'], vocab, arrays.get('scale', None))
+        table._shms = shms  # the mappings live as long as the table
+        return table
+
+    def unlink(self):
+        for shm in self._owned:
+            shm.close()
+            shm.unlink()
+
+        self._owned = []
+
+
+class LexiconFactory:
+    def __init__(self, lexicon_type: Type[NLPLexiconMapper], **kwargs):
+        """
+        :param lexicon_type: the type of lexica to create (e.g., POSLexicon).
+        :param kwargs: the arguments of the lexicon type; word2vec models and embedding tables (e.g., w2v, a2v,
+                       f2v_table, or an f2v table pruned from fasttext) are published to shared memory.
+          A picklable factory that is created once per host and passed to worker processes, where create() builds
+          a lexicon whose matrices are attached zero-copy, so the memory of the matrices does not grow with the
+          number of workers.  Tables are shared as they are; quantize them beforehand (see EmbeddingTable.quantize)
+          since a dtype different from the table's makes every worker keep its own quantized copy.
+          Fasttext models cannot be shared; precompute their vectors instead (see lexicon_builder precompute).
+        """
+        self.lexicon_type = lexicon_type
+        self.kwargs: Dict[str, Any] = {}
+
+        try:
+            for key, value in kwargs.items():
+                if isinstance(value, KeyedVectors): value = EmbeddingTable.from_keyed_vectors(value)
+                if isinstance(value, EmbeddingTable): value = SharedTable(value)
+                elif isinstance(value, WordVectorModel): raise ValueError('fasttext models cannot be shared: ' + key)
+                self.kwargs[key] = value
+        except Exception:
+            self.unlink()
+            raise
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.unlink()
+
+    @property
+    def nbytes(self) -> int:
+        """
+        :return: the bytes of the matrices in shared memory, which are counted once per host.
+        """
+        return sum(value.nbytes for value in self.kwargs.values() if isinstance(value, SharedTable))
+
+    def create(self) -> NLPLexiconMapper:
+        """
+        :return: a lexicon whose embedding tables are attached to the shared memory.
+        """
+        return self.lexicon_type(**{key: value.attach() if isinstance(value, SharedTable) else value
+                                    for key, value in self.kwargs.items()})
+
+    def unlink(self):
+        """
+        Release the shared memory; called by the owner once all lexica created by this factory are done.
+        """
+        for value in self.kwargs.values():
+            if isinstance(value, SharedTable): value.unlink()
+
+
+# ============================== Registry ==============================
+
+def file_checksum(filename: str, block: int=1 << 20) -> str:
+    """
+    :return: the checksum of the size and the first and last blocks of the file, which tells different models apart
+             without reading multi-gigabyte files in full.
+    """
+    size = os.path.getsize(filename)
+    sha1 = hashlib.sha1(str(size).encode())
+
+    with open(filename, 'rb') as fin:
+        sha1.update(fin.read(block))
+        if size > block:
+            fin.seek(max(block, size - block))
+            sha1.update(fin.read(block))
+
+    return sha1.hexdigest()
+
+
+def embedding_nbytes(emb: NLPEmbedding, filename: str) -> int:
+    """
+    :return: the bytes of the matrices of the embedding; the size of the file for fasttext, whose model is opaque.
+    """
+    vsm = emb.vsm
+    if isinstance(vsm, WordVectorModel): return os.path.getsize(filename)
+    nbytes = vsm.syn0.nbytes
+    if isinstance(vsm, EmbeddingTable) and vsm.scale is not None: nbytes += vsm.scale.nbytes
+    return nbytes
+
+
+class LexiconRegistry:
+    def __init__(self):
+        """
+        Reference-counted embeddings keyed by the path and checksum of their model files and by their loaders, so that
+        components in one process (e.g., the tagger and the parser in a pipeline) share one NLPEmbedding per model
+        instead of loading their own copies.  Each acquire() must be paired with a release(); a model is dropped with
+        its last reference.  Loaders are told apart by identity, so pass the same function to share a model.
+        """
+        self.saved: int = 0
+        self._entries: Dict[Tuple, List] = {}
+        self._keys: Dict[int, Tuple] = {}
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return len(self._entries)
+
+    def acquire(self, filename: str, key_field: str='word', dtype: str=None,
+                loader: Callable[[str], Any]=load_word2vec, **kwargs) -> NLPEmbedding:
+        """
+        :param filename: the path to the model file.
+        :param key_field: the field in NLPNode used as the key (see NLPEmbedding).
+        :param dtype: the storage type of the matrix (see NLPEmbedding).
+        :param loader: loads the model from the file (e.g., load_word2vec, fasttext.load_model).
+        :param kwargs: the other arguments of NLPEmbedding (e.g., cache, table), used only when the model is loaded.
+        :return: the embedding of the model, loaded on the first acquisition and shared afterwards.
+        """
+        key = (os.path.realpath(filename), file_checksum(filename), key_field, dtype, loader)
+
+        # the lock guards the entries only; a model is loaded outside of it and published through the future of its
+        # entry, so loading one model blocks neither the loads of other models nor the acquisitions of loaded ones
+        with self._lock:
+            entry = self._entries.get(key, None)
+            owner = entry is None
+            if owner: entry = self._entries[key] = [Future(), 0, 0]
+            entry[1] += 1
+
+        future = entry[0]
+        if not owner:
+            emb = future.result()
+            with self._lock: self.saved += entry[2]
+            return emb
+
+        try:
+            emb = NLPEmbedding(loader(filename), key_field, dtype=dtype, **kwargs)
+            nbytes = embedding_nbytes(emb, filename)
+        except BaseException as e:
+            # the acquisitions waiting for the model fail as well; the next acquisition loads it again
+            with self._lock: del self._entries[key]
+            future.set_exception(e)
+            raise
+
+        with self._lock:
+            entry[2] = nbytes
+            self._keys[id(emb)] = key
+
+        future.set_result(emb)
+        return emb
+
+    def release(self, emb: NLPEmbedding):
+        """
+        :param emb: the embedding returned by acquire(); it is dropped from the registry with its last reference.
+        """
+        with self._lock:
+            key = self._keys.get(id(emb), None)
+            if key is None: raise ValueError('The embedding is not acquired from this registry.')
+            entry = self._entries[key]
+            entry[1] -= 1
+
+            if entry[1] == 0:
+                del self._entries[key]
+                del self._keys[id(emb)]
+
+    @property
+    def stats(self) -> Dict[str, int]:
+        """
+        :return: the number of models and references, the bytes held by the models, the bytes currently saved by
+                 sharing (a model referenced k times saves k-1 copies), and the bytes saved over all acquisitions.
+        """
+        with self._lock:
+            entries = list(self._entries.values())
+
+        return {'models': len(entries), 'references': sum(entry[1] for entry in entries),
+                'bytes': sum(entry[2] for entry in entries),
+                'shared_bytes': sum(entry[2] * (entry[1] - 1) for entry in entries), 'saved_bytes': self.saved}
+
+
+# the registry shared by all components in this process
+LEXICA = LexiconRegistry()
@@ -13,25 +13,170 @@
 # See the License for the specific language governing permissions and
 # limitations under the License.
 # ========================================================================
+import copy
 import logging
+import math
+import multiprocessing
+import queue
+import threading
 import time
 from abc import ABCMeta, abstractmethod
 from concurrent.futures import Future
+from concurrent.futures import ProcessPoolExecutor
 from concurrent.futures import ThreadPoolExecutor
 from concurrent.futures import wait
+from multiprocessing.shared_memory import SharedMemory
 from random import shuffle
-from typing import Dict, List, Tuple, Union, Callable
+from typing import Any, Dict, List, Tuple, Union, Callable
 
 import mxnet as mx
 import numpy as np
-from itertools import islice
 
-from elit.component.template.lexicon import NLPLexiconMapper
+from elit.component.template.lexicon import LexiconFactory, NLPLexiconMapper
 from elit.component.template.state import NLPState
-from elit.structure import NLPGraph
+from elit.structure import NLPGraph, NLPVocabulary
 
 __author__ = 'Jinho D. Choi'
 
+# the label of padded rows, ignored by the loss (see SoftmaxOutput(use_ignore=True))
+IGNORE_LABEL = -1
+
+
+def batch_buckets(batch_size: int, min_size: int=8) -> Tuple[int]:
+    """
+    :return: the batch sizes of the executors, halved from batch_size down to min_size (e.g., 8, 16, 32, 64, 128).
+      A mini-batch is padded up to the smallest bucket that fits it, so at most half of any batch is padding.
+    """
+    buckets = [batch_size]
+    while buckets[-1] // 2 >= min_size: buckets.append(buckets[-1] // 2)
+    return tuple(reversed(buckets))
+
+
+class BucketIter(mx.io.DataIter):
+    """
+    Iterates mini-batches of the largest bucket; the remainder is padded with zero rows labeled IGNORE_LABEL up to
+    the smallest bucket that fits it, so every batch matches the shape of an executor that has been bound already.
+    The number of padded rows is given by DataBatch.pad, which BaseModule.predict strips from the outputs.
+    """
+    def __init__(self, data: np.array, label: np.array=None, buckets: Tuple[int]=(32,),
+                 data_name: str='data', label_name: str='softmax_label'):
+        super().__init__(max(buckets))
+        self.data = np.asarray(data, dtype='float32')
+        self.label = np.full(len(data), IGNORE_LABEL, dtype='float32') if label is None \
+            else np.asarray(label, dtype='float32')
+        self.buckets = sorted(buckets)
+        self.default_bucket_key = self.batch_size
+        self.data_name = data_name
+        self.label_name = label_name
+        self.cursor = 0
+
+    def data_desc(self, bucket_key: int) -> List[mx.io.DataDesc]:
+        return [mx.io.DataDesc(self.data_name, (bucket_key,) + self.data.shape[1:])]
+
+    def label_desc(self, bucket_key: int) -> List[mx.io.DataDesc]:
+        return [mx.io.DataDesc(self.label_name, (bucket_key,))]
+
+    @property
+    def provide_data(self) -> List[mx.io.DataDesc]:
+        return self.data_desc(self.default_bucket_key)
+
+    @property
+    def provide_label(self) -> List[mx.io.DataDesc]:
+        return self.label_desc(self.default_bucket_key)
+
+    def reset(self):
+        self.cursor = 0
+
+    def next(self) -> mx.io.DataBatch:
+        if self.cursor >= len(self.data): raise StopIteration
+        bidx = self.cursor
+        eidx = min(bidx + self.batch_size, len(self.data))
+        size = eidx - bidx
+        key = next(bucket for bucket in self.buckets if bucket >= size)
+        self.cursor = eidx
+
+        data, label = self.data[bidx:eidx], self.label[bidx:eidx]
+        if size < key:
+            data = np.concatenate((data, np.zeros((key - size,) + data.shape[1:], dtype='float32')))
+            label = np.concatenate((label, np.full(key - size, IGNORE_LABEL, dtype='float32')))
+
+        return mx.io.DataBatch(data=[mx.nd.array(data)], label=[mx.nd.array(label)], pad=key - size,
+                               bucket_key=key, provide_data=self.data_desc(key), provide_label=self.label_desc(key))
+
+
+class PrefetchIter(mx.io.DataIter):
+    """
+    :param batches: the iterator whose mini-batches are prefetched (e.g., BucketIter).
+    :param max_batches: the maximum number of mini-batches prepared ahead of the consumer; 2 for double buffering.
+      Prepares the mini-batches in a background thread that fills a bounded buffer, so padding and copying the next
+      batch into NDArrays overlaps with the forward and backward passes of the current one.  Unlike
+      mx.io.PrefetchingIter, the bucket keys and shapes of the batches are kept (see BucketIter).
+    """
+    def __init__(self, batches: mx.io.DataIter, max_batches: int=2):
+        super().__init__(batches.batch_size)
+        self.batches = batches
+        self.default_bucket_key = getattr(batches, 'default_bucket_key', batches.batch_size)
+        self._max_batches = max_batches
+        self._start()
+
+    @property
+    def provide_data(self) -> List[mx.io.DataDesc]:
+        return self.batches.provide_data
+
+    @property
+    def provide_label(self) -> List[mx.io.DataDesc]:
+        return self.batches.provide_label
+
+    def _start(self):
+        self._queue = queue.Queue(self._max_batches)
+        self._stop = threading.Event()
+        self._done = False
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            for batch in self.batches:
+                if not self._put(batch): return
+            self._put(None)
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item) -> bool:
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return True
+            except queue.Full:
+                pass
+        return False
+
+    def reset(self):
+        self.close()
+        self.batches.reset()
+        self._start()
+
+    def next(self) -> mx.io.DataBatch:
+        if self._done: raise StopIteration
+        item = self._queue.get()
+        if isinstance(item, Exception): raise item
+        if item is None:
+            self._done = True
+            raise StopIteration
+        return item
+
+    def close(self):
+        """
+        Stop the background thread; the batches prepared but not consumed are dropped.
+        """
+        self._stop.set()
+        while self._thread.is_alive():
+            try:
+                self._queue.get(timeout=0.01)
+            except queue.Empty:
+                pass
+        self._thread.join()
+
 
 class NLPModel(metaclass=ABCMeta):
     def __init__(self, state: Callable[[NLPGraph, NLPLexiconMapper, bool], NLPState], batch_size: int):
@@ -43,6 +188,7 @@ class NLPModel(metaclass=ABCMeta):
         self.mxmod = None
         self.state = state
         self.batch_size: int = batch_size
+        self.buckets: Tuple[int] = batch_buckets(batch_size)
 
     # ============================== Label ==============================
 
@@ -52,7 +198,7 @@ class NLPModel(metaclass=ABCMeta):
         """
         return self.index_map.get(label, -1)
 
-    def get_label(self, index: Union[int, np.int]) -> str:
+    def get_label(self, index: Union[int, np.integer]) -> str:
         """
         :param index: the index of the label to be returned.
         :return: the index'th label.
@@ -82,14 +228,59 @@ class NLPModel(metaclass=ABCMeta):
         """ :return: the feature vector for the current state. """
 
     def feature_vectors(self, states: List[NLPState]) -> np.array:
+        """
+        :return: the matrix whose i'th row is x(states[i]); subclasses may override this to build rows in batches.
+        """
         xs = [self.x(state) for state in states]
         return np.vstack(xs)
 
-    def train_instances(self, states: List[NLPState], num_threads: int=1) -> Tuple[np.array, np.array]:
+    @property
+    def feature_dim(self) -> int:
+        """
+        :return: the number of columns of the matrix from feature_vectors; required by FeaturePool, which allocates
+                 the output before any row is built.
+        """
+        raise NotImplementedError
+
+    @abstractmethod
+    def feature_inputs(self, states: List[NLPState]) -> Any:
+        """
+        :return: the compact, picklable inputs from which feature_rows builds the rows of the states in another
+                 process (see FeaturePool).
+        """
+
+    @abstractmethod
+    def feature_rows(self, lexicon: NLPLexiconMapper, inputs: Any, out: np.array=None) -> np.array:
+        """
+        :param inputs: the return value of feature_inputs.
+        :param out: if not None, the matrix to write the rows into.
+        :return: the same matrix as feature_vectors for the states that the inputs are made from, except for the
+                 part written by state_features.
+        """
+
+    def state_features(self, states: List[NLPState], out: np.array):
+        """
+        :param out: the rows of the states from feature_rows.
+          Write the features that change as the states are processed (e.g., predicted scores) into the rows;
+          these are not sent to other processes, but gathered in this process while the rest is built there.
+        """
+        pass
+
+    def train_instances(self, states: List[NLPState], num_threads: int=1, pool: 'FeaturePool'=None) \
+            -> Tuple[np.array, np.array]:
+        """
+        :param num_threads: the number of threads to extract features with.
+        :param pool: if not None, the features are extracted by the processes in this pool instead.
+        """
+        if pool is not None:
+            xs = pool.feature_vectors(states)
+            return xs, np.array([self.add_label(state.gold) for state in states])
+
         def instances(thread_id=0, batch_size=len(states)):
             bidx = thread_id * batch_size
             eidx = min((thread_id + 1) * batch_size, len(states))
-            return zip(*[(self.x(state), state.gold) for state in islice(states, bidx, eidx)])
+            batch = states[bidx:eidx]
+            return self.feature_vectors(batch), [state.gold for state in batch]
 
         def xys(future: Future):
             xs, ys = future.result()
@@ -97,24 +288,47 @@ class NLPModel(metaclass=ABCMeta):
 
         if num_threads == 1:
             xs, ys = instances()
-            return np.vstack(xs), np.array([self.add_label(y) for y in ys])
+            return xs, np.array([self.add_label(y) for y in ys])
         else:
             pool = ThreadPoolExecutor(num_threads)
-            size = np.math.ceil(len(states) / num_threads)
+            size = math.ceil(len(states) / num_threads)
             futures = [pool.submit(instances, i, size) for i in range(num_threads)]
             while wait(futures)[1]: pass
             xxs, yys = zip(*[xys(future) for future in futures])
             return np.vstack(xxs), np.hstack(yys)
 
+    def next_bag(self, states: List[NLPState], bag_size: int, pool: 'FeaturePool'=None) \
+            -> Tuple[List[NLPState], np.array, List[str]]:
+        """
+        :param states: the training states, shuffled and sorted in place.
+        :param pool: if not None, the features are extracted by the processes in this pool.
+        :return: the bag of the least reset states in a random order, their feature matrix, and their gold labels.
+          Called in the background by train; it reads the states but updates none of them, and leaves the labels
+          unmapped since the label map is updated by the training thread only.
+        """
+        shuffle(states)
+        states.sort(key=lambda x: x.reset_count)
+        bag = states[:bag_size]
+        xs = pool.feature_vectors(bag) if pool else self.feature_vectors(bag)
+        return bag, xs, [state.gold for state in bag]
+
     # ============================== Module ==============================
 
-    def bind(self, data: np.array, label: np.array=None, batch_size=32, for_training: bool=True, force_rebind=True) \
+    def bind(self, data: np.array, label: np.array=None, for_training: bool=True, prefetch: bool=False) \
             -> mx.io.DataIter:
-        batches: mx.io.NDArrayIter = self.data_iter(data, label, batch_size)
-        label_shapes = None if label is None else batches.provide_label
-        self.mxmod.bind(data_shapes=batches.provide_data, label_shapes=label_shapes, for_training=for_training,
-                        force_rebind=force_rebind)
-        return batches
+        """
+        :param prefetch: if True, the mini-batches are prepared in a background thread (see PrefetchIter).
+        :return: the iterator of mini-batches over the data, whose sizes are drawn from self.buckets.
+          The module is bound to the largest bucket once; executors for the smaller buckets are bound by the module
+          the first time each bucket is seen and reused afterwards (see mx.mod.BucketingModule).  A module bound for
+          training also predicts, so it is rebound only when it is asked to train after being bound for prediction
+          (e.g., evaluate before train), which keeps its parameters.
+        """
+        batches = BucketIter(data, label, self.buckets)
+        if not self.mxmod.binded or (for_training and not self.mxmod.for_training):
+            self.mxmod.bind(data_shapes=batches.provide_data, label_shapes=batches.provide_label,
+                            for_training=for_training, force_rebind=self.mxmod.binded)
+        return PrefetchIter(batches) if prefetch else batches
 
     def fit(self, batches: mx.io.DataIter, num_epoch: int=1) -> np.array:
         for epoch in range(num_epoch):
@@ -143,52 +357,80 @@ class NLPModel(metaclass=ABCMeta):
               allow_missing: bool=False, force_init: bool=False,
               kvstore: Union[str, mx.kvstore.KVStore] = 'local',
               optimizer: Union[str, mx.optimizer.Optimizer] = 'sgd',
-              optimizer_params=(('learning_rate', 0.01),)):
+              optimizer_params=(('learning_rate', 0.01),), workers: int=1) -> float:
+        """
+        :param workers: if greater than 1, the training instances are extracted by this number of processes
+          (see FeaturePool).
+        :return: the best evaluation score on the development graphs.
+          Training is pipelined: the bag of step t+1 is drawn and its features are extracted in a background thread
+          (see next_bag) while the development graphs are evaluated for step t, and the mini-batches of each step
+          are prepared ahead of the forward and backward passes (see PrefetchIter).  What stays serialized in this
+          thread: the parameter updates of fit, which the evaluation of the same step must see in full; the state
+          updates of step t (process and reset), which the bag of step t+1 reads (scores, idx_curr, reset_count),
+          so it is drawn only after them; and the label map (add_label), which evaluation reads.  The background
+          thread touches the training states only between those updates and never touches the development states.
+        """
         trn_states: List[NLPState] = [self.state(graph, lexicon, save_gold=True) for graph in trn_graphs]
         dev_states: List[NLPState] = [self.state(graph, lexicon, save_gold=True) for graph in dev_graphs]
         bag_size = int(len(trn_states) * bagging_ratio)
 
 
         best_eval = 0
-
-        for step in range(1, num_steps+1):
-            st = time.time()
-            shuffle(trn_states)
-            trn_states.sort(key=lambda x: x.reset_count)
-            xs, ys = self.train_instances(trn_states[:bag_size])
-            batches = self.bind(xs, ys, batch_size=self.batch_size)
-
-            if step == 1:
-                self.mxmod.init_params(
-                    initializer=initializer, arg_params=arg_params, aux_params=aux_params,
-                    allow_missing=allow_missing, force_init=force_init)
-                self.mxmod.init_optimizer(
-                    kvstore=kvstore, optimizer=optimizer, optimizer_params=optimizer_params)
-
-            predictions = self.fit(batches)
-            correct = 0
-
-            for state, y, yhats in zip(trn_states, ys, predictions):
-                yh = np.argmax(yhats if len(yhats) == self.num_label else yhats[:self.num_label])
-                state.process(self.get_label(yh), yhats)
-                if y == yh: correct += 1
-                if state.terminate: state.reset()
-
-            trn_acc = correct / len(ys)
-            dev_eval = self.evaluate(dev_states, batch_size=self.batch_size)
-            tt = time.time() - st
-            logging.info('%6d: trn-acc = %6.4f, dev-eval = %6.4f, time = %d' % (step, trn_acc, dev_eval, tt))
-            best_eval = max(dev_eval, best_eval)
+        pool = None
+
+        if workers > 1:
+            # the workers take a copy of the vocabularies, so all graphs are encoded before they start
+            for graph in trn_graphs + dev_graphs: graph.get_ids(lexicon.vocabs)
+            pool = FeaturePool(self, lexicon, workers)
+
+        producer = ThreadPoolExecutor(1)
+
+        try:
+            bag = producer.submit(self.next_bag, trn_states, bag_size, pool)
+
+            for step in range(1, num_steps+1):
+                st = time.time()
+                bag_states, xs, golds = bag.result()
+                ys = np.array([self.add_label(y) for y in golds])
+                batches = self.bind(xs, ys, prefetch=True)
+
+                if step == 1:
+                    self.mxmod.init_params(
+                        initializer=initializer, arg_params=arg_params, aux_params=aux_params,
+                        allow_missing=allow_missing, force_init=force_init)
+                    self.mxmod.init_optimizer(
+                        kvstore=kvstore, optimizer=optimizer, optimizer_params=optimizer_params)
+
+                predictions = self.fit(batches)
+                correct = 0
+
+                for state, y, yhats in zip(bag_states, ys, predictions):
+                    yh = np.argmax(yhats if len(yhats) == self.num_label else yhats[:self.num_label])
+                    state.process(self.get_label(yh), yhats)
+                    if y == yh: correct += 1
+                    if state.terminate: state.reset()
+
+                # the training states are up to date, so the next bag is drawn while the model is evaluated
+                if step < num_steps: bag = producer.submit(self.next_bag, trn_states, bag_size, pool)
+                trn_acc = correct / len(ys)
+                dev_eval = self.evaluate(dev_states)
+                tt = time.time() - st
+                logging.info('%6d: trn-acc = %6.4f, dev-eval = %6.4f, time = %d' % (step, trn_acc, dev_eval, tt))
+                best_eval = max(dev_eval, best_eval)
+        finally:
+            producer.shutdown()
+            if pool: pool.close()
 
         logging.info('best: %6.4f' % best_eval)
+        return best_eval
 
-    def evaluate(self, states: List[NLPState], batch_size=128):
+    def evaluate(self, states: List[NLPState]):
         for state in states: state.reset()
         backup = states
 
         while states:
             xs = self.feature_vectors(states)
-            batches: mx.io.NDArrayIter = self.bind(xs, batch_size=batch_size, for_training=False)
+            batches = self.bind(xs, for_training=False)
             predictions = self.predict(batches)
 
             for state, yhats in zip(states, predictions):
@@ -205,9 +447,117 @@ class NLPModel(metaclass=ABCMeta):
 
         return acc
 
-    # ============================== Helper ==============================
 
-    @classmethod
-    def data_iter(cls, data: np.array, label: np.array=None, batch_size=32) -> mx.io.DataIter:
-        batch_size = len(data) if len(data) < batch_size else batch_size
-        return mx.io.NDArrayIter(data=data, label=label, batch_size=batch_size, shuffle=False)
+# ============================== Feature Pool ==============================
+
+# the model and the lexicon of the workers (see FeaturePool)
+_FEATURES: Tuple[NLPModel, NLPLexiconMapper] = None
+
+
+def _init_features(model: NLPModel, factory: LexiconFactory, vocabs: Dict[str, NLPVocabulary]):
+    global _FEATURES
+    lexicon = factory.create()
+    lexicon.vocabs = vocabs
+    _FEATURES = model, lexicon
+
+
+def _feature_rows(inputs: Any, name: str, shape: Tuple[int, int], bidx: int, eidx: int):
+    model, lexicon = _FEATURES
+    shm = SharedMemory(name=name)
+    out = np.ndarray(shape, dtype='float32', buffer=shm.buf)
+    model.feature_rows(lexicon, inputs, out[bidx:eidx])
+    del out
+    shm.close()
+
+
+def mp_context() -> multiprocessing.context.BaseContext:
+    """
+    :return: the forkserver context if the platform supports it; otherwise, the spawn context.
+      Neither forks the training process, whose threads (e.g., the producer of train, mxnet engines) may hold locks.
+    """
+    return multiprocessing.get_context('forkserver' if 'forkserver' in multiprocessing.get_all_start_methods()
+                                       else 'spawn')
+
+
+class FeaturePool:
+    def __init__(self, model: NLPModel, lexicon: NLPLexiconMapper, workers: int, chunk_size: int=1024):
+        """
+        :param model: the model whose feature_dim, feature_inputs, feature_rows, and state_features are called.
+        :param lexicon: the lexicon that the states of the model are created with; its embeddings must be shareable
+                        (see LexiconFactory).
+        :param workers: the number of processes.
+        :param chunk_size: the number of states per task.
+          The workers are started by mp_context() and build their lexica from tables published to shared memory
+          once (see NLPLexiconMapper.factory), so a task carries only the compact inputs of a chunk of states
+          (see NLPModel.feature_inputs) and the name of one shared output buffer, into which the workers write their
+          rows, while this process writes the state features (see NLPModel.state_features).  The ids in the inputs
+          refer to the vocabularies of the lexicon, which the workers copy when they start; they are restarted
+          whenever a vocabulary has grown since (see NLPModel.train, which encodes all graphs up front).
+        """
+        self.model = copy.copy(model)
+        self.model.mxmod = None
+        self.lexicon = lexicon
+        self.factory: LexiconFactory = lexicon.factory()
+        self.workers = workers
+        self.chunk_size = chunk_size
+        self._executor: ProcessPoolExecutor = None
+        self._vocab_sizes: Dict[str, int] = None
+        self._shm: SharedMemory = None
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def _pool(self) -> ProcessPoolExecutor:
+        sizes = {field: len(vocab) for field, vocab in self.lexicon.vocabs.items()}
+
+        if self._executor is None or self._vocab_sizes != sizes:
+            if self._executor: self._executor.shutdown()
+            self._executor = ProcessPoolExecutor(self.workers, mp_context=mp_context(), initializer=_init_features,
+                                                 initargs=(self.model, self.factory, self.lexicon.vocabs))
+            self._vocab_sizes = sizes
+
+        return self._executor
+
+    def _buffer(self, nbytes: int) -> SharedMemory:
+        if self._shm is None or self._shm.size < nbytes:
+            size = max(nbytes, 2 * self._shm.size) if self._shm else max(nbytes, 1)
+            self._unlink()
+            self._shm = SharedMemory(create=True, size=size)
+
+        return self._shm
+
+    def feature_vectors(self, states: List[NLPState]) -> np.array:
+        """
+        :return: the same matrix as NLPModel.feature_vectors(states), whose chunks are built by the workers.
+        """
+        if not states: return self.model.feature_vectors(states)
+        chunks = [(bidx, min(bidx + self.chunk_size, len(states))) for bidx in range(0, len(states), self.chunk_size)]
+        inputs = [self.model.feature_inputs(states[bidx:eidx]) for bidx, eidx in chunks]
+        shape = (len(states), self.model.feature_dim)
+        shm = self._buffer(4 * shape[0] * shape[1])
+        out = np.ndarray(shape, dtype='float32', buffer=shm.buf)
+
+        # the inputs have been encoded, so the vocabularies of the workers are up to date
+        pool = self._pool()
+        futures = [pool.submit(_feature_rows, chunk, shm.name, shape, bidx, eidx)
+                   for chunk, (bidx, eidx) in zip(inputs, chunks)]
+        self.model.state_features(states, out)
+        for future in futures: future.result()
+        xs = out.copy()
+        del out
+        return xs
+
+    def _unlink(self):
+        if self._shm:
+            self._shm.close()
+            self._shm.unlink()
+            self._shm = None
+
+    def close(self):
+        if self._executor: self._executor.shutdown()
+        self._executor = None
+        self._unlink()
+        self.factory.unlink()
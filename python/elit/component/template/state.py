@@ -15,14 +15,40 @@
 # ========================================================================
 from abc import ABCMeta
 from abc import abstractmethod
-from typing import Union, List
+from operator import attrgetter, methodcaller
+from typing import Callable, Dict, Union, List, Sequence
 
 import numpy as np
 
-from elit.structure import NLPGraph, NLPNode, Relation
+from elit.structure import NLPGraph, NLPNode, Relation, RelationIndex
 
 __author__ = 'Jinho D. Choi'
 
+# relation -> function returning the node with the relation to the given node
+RELATION_RESOLVERS: Dict[Relation, Callable[[NLPNode], Union[NLPNode, None]]] = {
+    # 1st order
+    Relation.PARENT:                    attrgetter('parent'),
+    Relation.LEFTMOST_CHILD:            methodcaller('get_leftmost_child'),
+    Relation.RIGHTMOST_CHILD:           methodcaller('get_rightmost_child'),
+    Relation.LEFT_NEAREST_CHILD:        methodcaller('get_left_nearest_child'),
+    Relation.RIGHT_NEAREST_CHILD:       methodcaller('get_right_nearest_child'),
+    Relation.LEFTMOST_SIBLING:          methodcaller('get_leftmost_sibling'),
+    Relation.RIGHTMOST_SIBLING:         methodcaller('get_rightmost_sibling'),
+    Relation.LEFT_NEAREST_SIBLING:      methodcaller('get_left_nearest_sibling'),
+    Relation.RIGHT_NEAREST_SIBLING:     methodcaller('get_right_nearest_sibling'),
+
+    # 2nd order
+    Relation.GRANDPARENT:               attrgetter('grandparent'),
+    Relation.SND_LEFTMOST_CHILD:        methodcaller('get_leftmost_child', 1),
+    Relation.SND_RIGHTMOST_CHILD:       methodcaller('get_rightmost_child', 1),
+    Relation.SND_LEFT_NEAREST_CHILD:    methodcaller('get_left_nearest_child', 1),
+    Relation.SND_RIGHT_NEAREST_CHILD:   methodcaller('get_right_nearest_child', 1),
+    Relation.SND_LEFTMOST_SIBLING:      methodcaller('get_leftmost_sibling', 1),
+    Relation.SND_RIGHTMOST_SIBLING:     methodcaller('get_rightmost_sibling', 1),
+    Relation.SND_LEFT_NEAREST_SIBLING:  methodcaller('get_left_nearest_sibling', 1),
+    Relation.SND_RIGHT_NEAREST_SIBLING: methodcaller('get_right_nearest_sibling', 1),
+}
+
 
 class NLPState(metaclass=ABCMeta):
     def __init__(self, graph: NLPGraph):
@@ -83,51 +109,52 @@ class NLPState(metaclass=ABCMeta):
         """
         index += window
         begin = 0 if root else 1
-        node: NLPNode = self.graph.nodes[index] if begin <= index < len(self.graph) else None
+        node: NLPNode = self.graph.nodes[index] if begin <= index < len(self.graph.nodes) else None
 
         if node and relation:
-            # 1st order
-            if relation == Relation.PARENT:
-                return node.parent
-            if relation == Relation.LEFTMOST_CHILD:
-                return node.get_leftmost_child()
-            if relation == Relation.RIGHTMOST_CHILD:
-                return node.get_rightmost_child()
-            if relation == Relation.LEFT_NEAREST_CHILD:
-                return node.get_left_nearest_child()
-            if relation == Relation.RIGHT_NEAREST_CHILD:
-                return node.get_right_nearest_child()
-            if relation == Relation.LEFTMOST_SIBLING:
-                return node.get_leftmost_sibling()
-            if relation == Relation.RIGHTMOST_SIBLING:
-                return node.get_rightmost_sibling()
-            if relation == Relation.LEFT_NEAREST_SIBLING:
-                return node.get_left_nearest_sibling()
-            if relation == Relation.RIGHT_NEAREST_SIBLING:
-                return node.get_right_nearest_sibling()
-
-            # 2nd order
-            if relation == Relation.GRANDPARENT:
-                return node.grandparent
-            if relation == Relation.SND_LEFTMOST_CHILD:
-                return node.get_leftmost_child(1)
-            if relation == Relation.SND_RIGHTMOST_CHILD:
-                return node.get_rightmost_child(1)
-            if relation == Relation.SND_LEFT_NEAREST_CHILD:
-                return node.get_left_nearest_child(1)
-            if relation == Relation.SND_RIGHT_NEAREST_CHILD:
-                return node.get_right_nearest_child(1)
-            if relation == Relation.SND_LEFTMOST_SIBLING:
-                return node.get_leftmost_sibling(1)
-            if relation == Relation.SND_RIGHTMOST_SIBLING:
-                return node.get_rightmost_sibling(1)
-            if relation == Relation.SND_LEFT_NEAREST_SIBLING:
-                return node.get_left_nearest_sibling(1)
-            if relation == Relation.SND_RIGHT_NEAREST_SIBLING:
-                return node.get_right_nearest_sibling(1)
+            relation_index = self.graph.relation_index
+            if relation_index is not None: return relation_index.get(node, relation)
+            return RELATION_RESOLVERS[relation](node)
 
         return node
 
+    @staticmethod
+    def get_nodes(states: List['NLPState'], indices: Sequence[int], windows: Sequence[int],
+                  relations: Sequence[Relation]=None, root: bool=False) -> np.array:
+        """
+        :param states: the states to resolve the template for.
+        :param indices: the index of the anchor node of each state.
+        :param windows: the context window of each feature in the template.
+        :param relations: the relation of each feature in the template (None for no relation).
+        :param root: if True, the root (nodes[0]) is returned when the condition is met; otherwise, -1.
+        :return: the IDs of the relation(index+window)'th nodes, shape = (len(states), len(windows)); -1 if not exist.
+          The windows are resolved for all states at once; relations are resolved per state through the relation
+          index of each graph if exists, otherwise through RELATION_RESOLVERS.
+        """
+        positions = np.asarray(indices, dtype=np.int32)[:, None] + np.asarray(windows, dtype=np.int32)[None, :]
+        sizes = np.array([len(state.graph.nodes) for state in states], dtype=np.int32)[:, None]
+        ids = np.where((positions >= (0 if root else 1)) & (positions < sizes), positions, -1).astype(np.int32)
+        if not relations: return ids
+
+        cols = [j for j, relation in enumerate(relations) if relation is not None]
+        if not cols: return ids
+        rows = np.array([RelationIndex.ROWS[relations[j]] for j in cols])
+        resolvers = [RELATION_RESOLVERS[relations[j]] for j in cols]
+
+        for i, state in enumerate(states):
+            anchors = ids[i, cols]
+            index = state.graph.relation_index
+
+            if index is not None:
+                ids[i, cols] = np.where(anchors >= 0, index.table[rows, anchors], -1)
+            else:
+                nodes = state.graph.nodes
+                for j, resolve, anchor in zip(cols, resolvers, anchors.tolist()):
+                    node = resolve(nodes[anchor]) if anchor >= 0 else None
+                    ids[i, j] = node.node_id if node else -1
+
+        return ids
+
     def is_first(self, node: NLPNode) -> bool:
         """
         :param node: the node to be compared
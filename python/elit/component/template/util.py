@@ -20,6 +20,7 @@ from typing import List, Tuple, Callable
 
 import mxnet as mx
 
+from elit.component.template.lexicon import DTYPES
 from elit.reader import TSVReader
 from elit.structure import NLPGraph
 
@@ -53,11 +54,25 @@ def conv_pool(net: mx.sym.Variable, conv_kernel: Tuple[int, int], num_filter: in
 
 # ============================== Reader ==============================
 
-def read_graphs(reader: TSVReader, filename: str) -> List[NLPGraph]:
+def read_graphs(reader: TSVReader, filename: str, workers: int=1, cache: bool=False) -> List[NLPGraph]:
+    """
+    :param workers: if greater than 1, the file is parsed by this number of processes (see TSVReader.iter_parallel).
+    :param cache: if True, the file is loaded from its binary corpus cache, which is written next to the file on the
+                  first use (see TSVReader.read_cached).  The graphs are still created from the cache, so this pays
+                  off only when the file is read many times; components that can work on columns should read an
+                  NLPCorpus instead.
+    """
     logging.info('Reading: '+os.path.basename(filename))
-    reader.open(filename)
-    graphs = reader.next_all
-    reader.close()
+
+    if cache:
+        graphs = list(reader.read_cached(filename, workers).graphs())
+    elif workers > 1:
+        graphs = list(reader.iter_parallel(filename, workers))
+    else:
+        reader.open(filename)
+        graphs = reader.next_all
+        reader.close()
+
     logging.info('- %s graphs' % len(graphs))
     return graphs
 
@@ -87,8 +102,15 @@ def argparse_data(parser: argparse.ArgumentParser, tsv: Callable[[Tuple[int]], T
 def argparse_lexicon(parser: argparse.ArgumentParser):
     args = parser.add_argument_group('Lexicon')
 
-    args.add_argument('--w2v', type=str, metavar='filepath', help='path to the word2vec bin file')
+    args.add_argument('--w2v', type=str, metavar='filepath',
+                      help='path to the word2vec bin file or the embedding table npy file')
     args.add_argument('--f2v', type=str, metavar='filepath', help='path to the fasttext bin file')
+    args.add_argument('--f2v_cache', type=int, metavar='int', default=256,
+                      help='budget of the fasttext embedding cache in MB')
+    args.add_argument('--f2v_table', type=str, metavar='filepath',
+                      help='path to the fasttext vectors precomputed by lexicon_builder precompute (*.npy)')
+    args.add_argument('--w2v_dtype', type=str, choices=DTYPES,
+                      help='storage type of the word2vec matrices; quantized rows are dequantized in batches')
 
     return args
 
@@ -14,7 +14,22 @@
 # limitations under the License.
 # ========================================================================
 import re
+import bz2
+import gzip
+import hashlib
 import io
+import logging
+import lzma
+import mmap
+import os
+import queue
+import threading
+from array import array
+from concurrent.futures import ProcessPoolExecutor
+from typing import Callable, Iterator
+
+import numpy as np
+
 from elit.structure import *
 
 __author__ = 'Jinho D. Choi'
@@ -25,6 +40,24 @@ _FEATS_KV = re.compile(DELIM_FEAT_KV)
 _ARC      = re.compile(DELIM_ARC)
 _ARC_KV   = re.compile(DELIM_ARC_KV)
 
+# magic numbers of compressed files
+_COMPRESSIONS = ((b'\x1f\x8b', gzip.open), (b'\xfd7zXZ\x00', lzma.open), (b'BZh', bz2.open))
+
+# directory of the binary corpus cache: filename + '.' + hash of the reader configuration + CACHE_EXT
+CACHE_EXT = '.npc'
+
+# sidecar file of sentence offsets: [file size, file mtime (ns), number of sentences] + [begin, end) per sentence
+INDEX_EXT = '.idx'
+
+
+def get_sheads(f: str) -> List[Tuple[int, str]]:
+    """
+    :param f: secondary heads in the TSV format (e.g., '3:obj;5:obj').
+    :return: (head ID, dependency label) pairs.
+    """
+    if f == BLANK: return []
+    return [(int(arc[0]), arc[1]) for arc in map(_ARC_KV.split, _ARC.split(f))]
+
 
 class TSVReader:
     """
@@ -48,6 +81,11 @@ class TSVReader:
         self.sheads_index: int = sheads_index
         self.nament_index: int = nament_index
         self.ins: io.TextIOWrapper = None
+        self.filename: str = None
+
+        # random access
+        self._index: np.ndarray = None
+        self._mmap: mmap.mmap = None
 
     def __next__(self):
         graph = self.next
@@ -71,15 +109,226 @@ class TSVReader:
                          sheads_index=reader.sheads_index,
                          nament_index=reader.nament_index)
 
-    def open(self, filename: str):
-        self.ins = open(filename)
+    def open(self, filename: str, background: bool=True):
+        """
+        :param filename: the TSV file, which can be compressed by gzip, xz, or bzip2 (detected by its magic number).
+        :param background: if True, a compressed file is decompressed by a background thread so inflating overlaps
+                           with parsing; otherwise, it is decompressed on demand.
+        """
+        opener = compression(filename)
+
+        if opener is None:
+            self.ins = open(filename, encoding='utf-8')
+        else:
+            raw = opener(filename, 'rb')
+            if background: raw = io.BufferedReader(BackgroundReader(raw, name=filename))
+            self.ins = io.TextIOWrapper(raw, encoding='utf-8')
+
+        self.filename = filename
+        self._index = None
+        self._mmap = None
         return self.ins
 
     def close(self):
+        if self._mmap: self._mmap.close()
         self.ins.close()
 
+    # ============================== Cache ==============================
+
+    def cache_path(self, filename: str) -> str:
+        """
+        :return: the directory of the binary corpus cache for the file with respect to the column configuration.
+        """
+        config = (self.word_index, self.lemma_index, self.pos_index, self.feats_index, self.head_index,
+                  self.deprel_index, self.sheads_index, self.nament_index)
+        return filename + '.' + hashlib.sha1(repr(config).encode()).hexdigest()[:12] + CACHE_EXT
+
+    def read_cached(self, filename: str, workers: int=1) -> NLPCorpus:
+        """
+        :param filename: the TSV file.
+        :param workers: the number of processes parsing the file when the cache is missing (see read_parallel).
+        :return: the corpus of the file, memory-mapped from its binary cache if the cache agrees with the size and
+                 mtime of the file and with NLPCorpus.VERSION; otherwise, the file is parsed and the cache is
+                 (re)written.
+        """
+        path = self.cache_path(filename)
+        stat = os.stat(filename)
+        meta = NLPCorpus.read_meta(path)
+
+        if meta and meta.get('version') == NLPCorpus.VERSION and meta.get('size') == stat.st_size and \
+                meta.get('mtime_ns') == stat.st_mtime_ns:
+            return NLPCorpus.load(path)
+
+        corpus = self.read_parallel(filename, workers)
+        logging.info('Writing the corpus cache: %s' % path)
+
+        try:
+            corpus.save(path, meta={'size': stat.st_size, 'mtime_ns': stat.st_mtime_ns})
+        except OSError as e:
+            logging.warning('Cannot write the corpus cache %s: %s' % (path, e))
+
+        return corpus
+
+    # ============================== Random Access ==============================
+
+    @classmethod
+    def build_index(cls, filename: str) -> np.ndarray:
+        """
+        :param filename: the TSV file.
+        :return: the [begin, end) byte offsets of each sentence in the file, shape = (number of sentences, 2).
+          The offsets are also written to the sidecar file (filename + INDEX_EXT) with the size and mtime of the file.
+        """
+        if compression(filename): raise ValueError('Cannot index a compressed file: ' + filename)
+        offsets = array('q')
+        begin = end = -1
+        position = 0
+
+        with open(filename, 'rb') as fin:
+            for line in fin:
+                if line.strip():
+                    if begin < 0: begin = position
+                    end = position + len(line)
+                elif begin >= 0:
+                    offsets.extend((begin, end))
+                    begin = -1
+                position += len(line)
+
+        if begin >= 0: offsets.extend((begin, end))
+
+        stat = os.stat(filename)
+        header = np.array([stat.st_size, stat.st_mtime_ns, len(offsets) // 2], dtype=np.int64)
+        with open(filename + INDEX_EXT, 'wb') as fout:
+            header.tofile(fout)
+            np.frombuffer(offsets, dtype=np.int64).tofile(fout)
+
+        return np.frombuffer(offsets, dtype=np.int64).reshape(-1, 2)
+
+    @classmethod
+    def load_index(cls, filename: str) -> Union[np.ndarray, None]:
+        """
+        :param filename: the TSV file.
+        :return: the memory-mapped sentence offsets from the sidecar file if exists and agrees with the size and mtime
+                 of the file; otherwise, None.
+        """
+        index_file = filename + INDEX_EXT
+        if not os.path.isfile(index_file): return None
+
+        stat = os.stat(filename)
+        header = np.fromfile(index_file, dtype=np.int64, count=3)
+        if len(header) < 3 or header[0] != stat.st_size or header[1] != stat.st_mtime_ns: return None
+        if header[2] == 0: return np.empty((0, 2), dtype=np.int64)
+        return np.memmap(index_file, dtype=np.int64, mode='r', offset=header.nbytes, shape=(int(header[2]), 2))
+
+    def get(self, index: int) -> NLPGraph:
+        """
+        :return: the index'th graph in the opened file; the input stream used by next is not affected.
+        """
+        offsets = self.indexed()
+        return self.parse_bytes(self._mmap[offsets[index, 0]:offsets[index, 1]])[0]
+
+    def slice(self, begin: int, end: int) -> List[NLPGraph]:
+        """
+        :return: the graphs in [begin, end) of the opened file; the input stream used by next is not affected.
+        """
+        offsets = self.indexed()[begin:end]
+        return self.parse_bytes(self._mmap[offsets[0, 0]:offsets[-1, 1]]) if len(offsets) else []
+
+    def indexed(self) -> np.ndarray:
+        """
+        :return: the sentence offsets of the opened file, which is memory-mapped on the first call.
+          The sidecar index is loaded if valid; otherwise, it is rebuilt.
+        """
+        if self._index is None:
+            filename = self.filename
+            if compression(filename): raise ValueError('Random access is not supported for compressed files')
+            self._index = TSVReader.load_index(filename)
+            if self._index is None: self._index = TSVReader.build_index(filename)
+            # an empty file cannot be mapped, but it has no sentence to read either
+            if len(self._index): self._mmap = mmap.mmap(self.ins.fileno(), 0, access=mmap.ACCESS_READ)
+
+        return self._index
+
+    def parse_bytes(self, data: bytes) -> List[NLPGraph]:
+        """
+        :param data: consecutive sentences in the TSV format.
+        :return: the graphs in the data.
+        """
+        reader = TSVReader.create_reader(self)
+        reader.ins = iter(data.decode('utf-8').splitlines())
+        return reader.next_all
+
+    # ============================== Sequential Access ==============================
+
     @property
     def next(self):
+        tsv = self.next_tsv()
+        return self.tsv_to_graph(tsv) if tsv else None
+
+    @property
+    def next_all(self):
+        return [graph for graph in self]
+
+    def iter_parallel(self, filename: str, workers: int=os.cpu_count()) -> Iterator[NLPGraph]:
+        """
+        :param filename: the TSV file to be read; this does not affect the input stream of this reader.
+        :param workers: the number of processes parsing the file.
+        :return: the graphs in the file in their original order.
+          The file is split into byte ranges at blank lines and each range is parsed by a separate process into a
+          columnar chunk (see parse_range), which is pickled as a few arrays instead of a graph of Python objects.
+          The graphs of a chunk are built only as they are consumed (see NLPCorpus.graphs); use read_parallel to
+          skip them altogether.  A compressed file cannot be split, so it is read sequentially.
+        """
+        if workers <= 1 or compression(filename):
+            reader = TSVReader.create_reader(self)
+            reader.open(filename)
+
+            try:
+                for graph in reader: yield graph
+            finally:
+                reader.close()
+            return
+
+        for corpus in self.iter_chunks(filename, workers): yield from corpus.graphs()
+
+    def read_parallel(self, filename: str, workers: int=os.cpu_count()) -> NLPCorpus:
+        """
+        :param filename: the TSV file to be read; this does not affect the input stream of this reader.
+        :param workers: the number of processes parsing the file.
+        :return: the corpus of the file, whose chunks are parsed by separate processes (see iter_parallel) and
+                 merged column by column (see NLPCorpus.extend).
+        """
+        if workers <= 1 or compression(filename):
+            reader = TSVReader.create_reader(self)
+            reader.open(filename)
+
+            try:
+                return reader.read_corpus()
+            finally:
+                reader.close()
+
+        corpus = NLPCorpus()
+        for chunk in self.iter_chunks(filename, workers): corpus.extend(chunk)
+        return corpus
+
+    def iter_chunks(self, filename: str, workers: int) -> Iterator[NLPCorpus]:
+        """
+        :param filename: the uncompressed TSV file.
+        :return: the corpora of the byte ranges of the file in order (see split_ranges and parse_range).
+        """
+        ranges = split_ranges(filename, workers * 4)
+        config = TSVReader.create_reader(self)
+
+        if len(ranges) <= 1:
+            for begin, end in ranges: yield parse_range(config, filename, begin, end)
+            return
+
+        with ProcessPoolExecutor(workers) as pool:
+            yield from pool.map(parse_range, *zip(*[(config, filename, b, e) for b, e in ranges]))
+
+    def next_tsv(self) -> List[List[str]]:
+        """
+        :return: the rows of the next sentence, where each row is split into fields; an empty list if no more.
+        """
         tsv = []
 
         for line in self.ins:
@@ -87,11 +336,21 @@ class TSVReader:
             if line:  tsv.append(_TAB.split(line))
             elif tsv: break
 
-        return self.tsv_to_graph(tsv) if tsv else None
+        return tsv
 
-    @property
-    def next_all(self):
-        return [graph for graph in self]
+    def read_corpus(self, corpus: NLPCorpus=None) -> NLPCorpus:
+        """
+        :param corpus: the corpus to be filled; if None, a new corpus is created.
+        :return: the corpus filled with the rest of the input stream, without creating any NLPNode.
+        """
+        if corpus is None: corpus = NLPCorpus()
+
+        while True:
+            tsv = self.next_tsv()
+            if not tsv: break
+            self.tsv_to_corpus(tsv, corpus)
+
+        return corpus
 
     def tsv_to_graph(self, tsv: List[List[str]]):
         """
@@ -117,15 +376,154 @@ class TSVReader:
             feats = get_feats(row) if row else None
             return NLPNode(node_id=node_id, word=word, lemma=lemma, pos=pos, nament=nament, feats=feats)
 
-        g = NLPGraph([init_node(i) for i in range(len(tsv))])
+        nodes = [init_node(i) for i in range(len(tsv))]
+
+        if self.head_index < 0:
+            graph = NLPGraph(nodes)
+        else:
+            heads = [int(row[self.head_index]) for row in tsv]
+            deprels = [row[self.deprel_index] for row in tsv] if self.deprel_index >= 0 else None
+            sheads = [get_sheads(row[self.sheads_index]) for row in tsv] if self.sheads_index >= 0 else None
+            graph = NLPGraph.from_heads(nodes, heads, deprels, sheads)
+
+        return graph
 
-        if self.head_index >= 0:
-            for i, n in enumerate(g):
-                t = tsv[i]
-                n.set_parent(g.nodes[int(t[self.head_index])], t[self.deprel_index])
+    def tsv_to_corpus(self, tsv: List[List[str]], corpus: NLPCorpus):
+        """
+        :param tsv: each row represents a token, each column represents a field.
+        :param corpus: the corpus where the sentence is appended to.
+        """
+        def get_fields(index: int) -> Union[List[str], None]:
+            return [row[index] for row in tsv] if index >= 0 else None
 
-                if self.sheads_index >= 0 and t[self.sheads_index] != BLANK:
-                    for arc in map(_ARC_KV.split, _ARC.split(t[self.sheads_index])):
-                        n.add_secondary_parent(g.nodes[int(arc[0])], arc[1])
+        feats = [None if f == BLANK else f for f in get_fields(self.feats_index)] if self.feats_index >= 0 else None
+        heads = [int(row[self.head_index]) for row in tsv] if self.head_index >= 0 else None
+        deprels = get_fields(self.deprel_index) if self.head_index >= 0 else None
+        sheads = [get_sheads(row[self.sheads_index]) for row in tsv] \
+            if self.head_index >= 0 and self.sheads_index >= 0 else None
 
-        return g
+        corpus.append(words=get_fields(self.word_index),
+                      lemmas=get_fields(self.lemma_index),
+                      poses=get_fields(self.pos_index),
+                      feats=feats,
+                      naments=get_fields(self.nament_index),
+                      heads=heads,
+                      deprels=deprels,
+                      sheads=sheads)
+
+
+def split_ranges(filename: str, num_ranges: int) -> List[Tuple[int, int]]:
+    """
+    :param filename: the TSV file.
+    :param num_ranges: the maximum number of ranges.
+    :return: [begin, end) byte ranges of the file, where each range starts at the beginning of a sentence.
+    """
+    size = os.path.getsize(filename)
+    bounds = [0]
+
+    with open(filename, 'rb') as fin:
+        for k in range(1, num_ranges):
+            offset = size * k // num_ranges
+            if offset <= bounds[-1]: continue
+            fin.seek(offset)
+            fin.readline()      # skip the partial line
+
+            for line in iter(fin.readline, b''):
+                if not line.strip(): break
+
+            offset = fin.tell()
+            if bounds[-1] < offset < size: bounds.append(offset)
+
+    bounds.append(size)
+    return [(bounds[i], bounds[i + 1]) for i in range(len(bounds) - 1)]
+
+
+def parse_range(reader: TSVReader, filename: str, begin: int, end: int) -> NLPCorpus:
+    """
+    :param reader: the reader providing the configuration.
+    :return: the corpus of the sentences in the [begin, end) byte range of the file.
+    """
+    with open(filename, 'rb') as fin:
+        fin.seek(begin)
+        data = fin.read(end - begin)
+
+    reader = TSVReader.create_reader(reader)
+    reader.ins = iter(data.decode('utf-8').splitlines())
+    return reader.read_corpus()
+
+
+def compression(filename: str) -> Union[Callable, None]:
+    """
+    :return: the function opening the file (e.g., gzip.open) if it is compressed; otherwise, None.
+    """
+    with open(filename, 'rb') as fin: magic = fin.read(6)
+    return next((opener for prefix, opener in _COMPRESSIONS if magic.startswith(prefix)), None)
+
+
+class BackgroundReader(io.RawIOBase):
+    """
+    :param fileobj: the binary stream to read from (e.g., gzip.open(filename, 'rb')).
+    :param name: the name of the stream.
+    :param chunk_size: the number of bytes read by the background thread at a time.
+    :param max_chunks: the maximum number of chunks buffered ahead of the consumer.
+      Reads the stream in a background thread that fills a bounded buffer, so decompression overlaps with parsing.
+    """
+    def __init__(self, fileobj: io.IOBase, name: str=None, chunk_size: int=1 << 20, max_chunks: int=16):
+        super().__init__()
+        self.name = name
+        self._fileobj = fileobj
+        self._chunk_size = chunk_size
+        self._queue = queue.Queue(max_chunks)
+        self._chunk = memoryview(b'')
+        self._stop = threading.Event()
+        self._eof = False
+        self._error: Exception = None
+        self._thread = threading.Thread(target=self._produce, daemon=True)
+        self._thread.start()
+
+    def _produce(self):
+        try:
+            while not self._stop.is_set():
+                chunk = self._fileobj.read(self._chunk_size)
+                self._put(chunk)
+                if not chunk: break
+        except Exception as e:
+            self._put(e)
+
+    def _put(self, item):
+        while not self._stop.is_set():
+            try:
+                self._queue.put(item, timeout=0.1)
+                return
+            except queue.Full:
+                pass
+
+    def readable(self):
+        return True
+
+    def readinto(self, b) -> int:
+        if not self._chunk:
+            # the background thread has exited after an error, so the error is raised again by every later read
+            if self._error: raise self._error
+            if self._eof: return 0
+            item = self._queue.get()
+
+            if isinstance(item, Exception):
+                self._error = item
+                raise item
+            if not item:
+                self._eof = True
+                return 0
+            self._chunk = memoryview(item)
+
+        size = min(len(b), len(self._chunk))
+        b[:size] = self._chunk[:size]
+        self._chunk = self._chunk[size:]
+        return size
+
+    def close(self):
+        if not self.closed:
+            self._stop.set()
+            self._thread.join()
+            self._fileobj.close()
+        super().close()
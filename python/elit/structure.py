@@ -14,11 +14,23 @@
 # limitations under the License.
 # ========================================================================
 import functools
+import json
+import os
+import shutil
+import tempfile
+import threading
 from enum import Enum
 from typing import Dict
+from typing import Iterable
+from typing import Iterator
 from typing import List
+from typing import Tuple
 from typing import Union
 from itertools import islice
+from sys import intern
+
+import numpy as np
+
 from elit.util.bisect import bisect_left
 from elit.util.bisect import bisect_right
 from elit.util.bisect import bisect_index
@@ -38,6 +50,83 @@ DELIM_ARC     = ';'
 DELIM_ARC_KV  = ':'
 
 
+class NLPVocabulary:
+    """
+    :param keys: the initial keys, indexed in order.
+      A bidirectional map between strings and contiguous integer ids; None is always mapped to -1.
+    """
+    def __init__(self, keys: List[str]=None):
+        self.index_map: Dict[str, int] = {}
+        self.keys: List[str] = []
+        if keys:
+            for key in keys: self.add(key)
+
+    def __len__(self):
+        return len(self.keys)
+
+    def __contains__(self, key: str):
+        return key in self.index_map
+
+    def index(self, key: str) -> int:
+        """
+        :return: the id of the key if exists; otherwise, -1.
+        """
+        return self.index_map.get(key, -1)
+
+    def get(self, index: int) -> Union[str, None]:
+        """
+        :return: the key of the id if exists; otherwise, None.
+        """
+        return self.keys[index] if index >= 0 else None
+
+    def add(self, key: str) -> int:
+        """
+        :return: the id of the key.
+          Add the key to this vocabulary if not exist already.
+        """
+        if key is None: return -1
+        idx = self.index_map.get(key, -1)
+        if idx < 0:
+            idx = len(self.keys)
+            self.index_map[key] = idx
+            self.keys.append(key)
+        return idx
+
+    def __getstate__(self):
+        return self.keys
+
+    def __setstate__(self, keys: List[str]):
+        # only the keys are pickled; the map is rebuilt in C rather than unpickled key by key
+        self.keys = keys
+        self.index_map = dict(zip(keys, range(len(keys))))
+
+
+# fields encoded into ids by NLPGraph.encode
+ENCODED_FIELDS = ('word', 'lemma', 'pos')
+_ENCODE_LOCK = threading.Lock()
+
+
+def create_vocabs() -> Dict[str, NLPVocabulary]:
+    """
+    :return: a new vocabulary for each field in ENCODED_FIELDS, where ROOT_TAG is always 0.
+      The vocabularies are owned by whoever looks features up by id (e.g., NLPLexiconMapper.vocabs), so they are
+      dropped with their owner instead of growing with every graph read by the process.
+    """
+    return {field: NLPVocabulary([ROOT_TAG]) for field in ENCODED_FIELDS}
+
+
+def encode_keys(vocab: NLPVocabulary, keys: Iterable[str]) -> np.ndarray:
+    """
+    :param vocab: the vocabulary; new keys are added to it.
+    :param keys: the keys to be encoded.
+    :return: the ids of the keys in the vocabulary (-1 for None).
+    """
+    with _ENCODE_LOCK: return np.array([vocab.add(key) for key in keys], dtype=np.int32)
+
+# placeholder for the children and secondary lists of a node that has no such arc yet
+_EMPTY = ()
+
+
 @functools.total_ordering
 class NLPNode:
     """
@@ -48,22 +137,37 @@ class NLPNode:
     :param nament: named entity tag.
     :param feats: extra features.
     """
+    __slots__ = ('node_id', 'word', 'lemma', 'pos', 'nament', 'feats', 'parent', 'children',
+                 'secondary_parents', 'secondary_children', '_deprel', '_sdeprels', 'relation_index', 'pos_scores')
+
     def __init__(self, node_id: int=-1, word: str=None, lemma: str=None, pos: str=None, nament: str=None,
                  feats: Dict[str, str]=None):
         # fields
         self.node_id: int = node_id
         self.word: str = word
         self.lemma: str = lemma
-        self.pos: str = pos
-        self.nament: str = nament
+        self.pos: str = intern(pos) if pos else pos
+        self.nament: str = intern(nament) if nament else nament
         self.feats: Dict[str, str] = feats or {}
 
-        # dependencies
+        # dependencies: lists are allocated when the first arc is added
         self.parent: NLPNode = None
-        self.children: List[NLPNode] = []
-        self.secondary_parents: List[NLPNode] = []
-        self.secondary_children: List[NLPNode] = []
-        self.deprels: Dict[NLPNode, str] = {}
+        self.children: List[NLPNode] = _EMPTY
+        self.secondary_parents: List[NLPNode] = _EMPTY
+        self.secondary_children: List[NLPNode] = _EMPTY
+
+        # interned labels to the parent and to each secondary parent (aligned with secondary_parents); interning
+        # shares one string per label without a global registry, so the labels are freed with the last node using them.
+        # A slot costs one pointer whether it refers to a shared string or to a label id, so ids would save nothing
+        # per node while tying every node to a vocabulary; NLPCorpus codes the labels by its deprel vocabulary instead.
+        self._deprel: str = None
+        self._sdeprels: List[str] = _EMPTY
+
+        # set by NLPGraph.build_relation_index
+        self.relation_index: RelationIndex = None
+
+        # part-of-speech scores predicted for this node (see POSState)
+        self.pos_scores: np.ndarray = None
 
     def __hash__(self):
         return hash(id(self))
@@ -92,7 +196,7 @@ class NLPNode:
         :param pos: the part-of-speech tag to be assigned to this node.
         :return: the previous part-of-speech tag if exists; otherwise, None.
         """
-        self.pos, prev = pos, self.pos
+        self.pos, prev = intern(pos) if pos else pos, self.pos
         return prev
 
     @classmethod
@@ -106,20 +210,38 @@ class NLPNode:
         """
         return self.parent.parent if self.parent else None
 
+    @property
+    def deprels(self) -> Dict['NLPNode', str]:
+        """
+        :return: the dependency labels to the PARENT and the secondary parents.
+        """
+        d = {p: l for p, l in zip(self.secondary_parents, self._sdeprels) if l}
+        if self.parent and self._deprel: d[self.parent] = self._deprel
+        return d
+
     def get_dependency_label(self, node: 'NLPNode'=None) -> str:
         """
         :param node: the parent of this node.
         :return: the dependency label between this node and the PARENT node if exists; otherwise, None.
         """
         if node is None: node = self.parent
-        return self.deprels.get(node, None) if node else None
+        if node is None: return None
+        if node is self.parent: return self._deprel
+        idx = bisect_index(self.secondary_parents, node)
+        return self._sdeprels[idx] if idx >= 0 else None
 
     def set_dependency_label(self, node: 'NLPNode', label: str):
         """
-        :param node: the PARENT of this node.
+        :param node: the PARENT or a secondary parent of this node.
         :param label: the dependency relation to the PARENT.
         """
-        if label: self.deprels[node] = label
+        if not label: return
+
+        if node is self.parent:
+            self._deprel = intern(label)
+        else:
+            idx = bisect_index(self.secondary_parents, node)
+            if idx >= 0: self._sdeprels[idx] = intern(label)
 
     def set_parent(self, node: 'NLPNode', label: str=None) -> 'NLPNode':
         """
@@ -129,18 +251,18 @@ class NLPNode:
         """
         # handle the previous PARENT
         prev_parent = self.parent
-
-        if prev_parent:
-            bisect_remove(prev_parent.children, self)
-            del self.deprels[prev_parent]
+        if prev_parent: bisect_remove(prev_parent.children, self)
 
         # set the current PARENT
         self.parent = node
+        self._deprel = None
 
         if node:
+            if node.children is _EMPTY: node.children = []
             insort_right(node.children, self)
             self.set_dependency_label(node, label)
 
+        if self.relation_index is not None: self.relation_index.update_arc(self, prev_parent)
         return prev_parent
 
     def child_of(self, node: 'NLPNode') -> bool:
@@ -155,9 +277,13 @@ class NLPNode:
         :param node: the node to be added as a secondary PARENT.
         :param label: the dependency relation to the PARENT.
         """
-        insort_right(self.secondary_parents, node)
+        if self.secondary_parents is _EMPTY: self.secondary_parents, self._sdeprels = [], []
+        if node.secondary_children is _EMPTY: node.secondary_children = []
+
+        idx = bisect_right(self.secondary_parents, node)
+        self.secondary_parents.insert(idx, node)
+        self._sdeprels.insert(idx, intern(label) if label else None)
         insort_right(node.secondary_children, self)
-        self.set_dependency_label(node, label)
 
     def remove_secondary_parent(self, node: 'NLPNode') -> bool:
         """
@@ -167,7 +293,7 @@ class NLPNode:
         idx = bisect_index(self.secondary_parents, node)
         if idx >= 0:
             del self.secondary_parents[idx]
-            self.deprels.pop(node, None)
+            del self._sdeprels[idx]
             return True
         return False
 
@@ -223,7 +349,7 @@ class NLPNode:
         :return: the rightmost primary sibling whose token position is on the right-hand side of this node if exists;
                  otherwise, None.
         """
-        idx = len(self.children) - 1 - order
+        idx = len(self.parent.children) - 1 - order if self.parent else -1
         return self.parent.children[idx] \
             if self.parent and 0 <= idx < len(self.parent.children) and self.parent.children[idx] > self else None
 
@@ -245,7 +371,7 @@ class NLPNode:
                  if exists; otherwise, None.
         """
         if self.parent:
-            idx = bisect_right(self.parent.children, self) + 1 + order
+            idx = bisect_right(self.parent.children, self) + order
             return self.parent.children[idx] if 0 <= idx < len(self.parent.children) else None
         return None
 
@@ -259,6 +385,82 @@ class NLPGraph:
     def __init__(self, nodes: List[NLPNode]=None):
         self.nodes = [NLPNode.root()]
         if nodes: self.nodes.extend(nodes)
+        self.relation_index: RelationIndex = None
+        self.ids: Dict[str, np.ndarray] = None
+        self.vocabs: Dict[str, NLPVocabulary] = None
+
+    def build_relation_index(self) -> 'RelationIndex':
+        """
+        :return: the relation index of this graph, which is kept up-to-date by NLPNode.set_parent from now on.
+        """
+        self.relation_index = RelationIndex(self)
+        return self.relation_index
+
+    def encode(self, vocabs: Dict[str, NLPVocabulary]) -> Dict[str, np.ndarray]:
+        """
+        :param vocabs: the vocabulary of each field in ENCODED_FIELDS (see create_vocabs).
+        :return: the id array of each field, where the i'th id is of nodes[i].
+          Features are looked up by these ids instead of the strings of the nodes, which are kept for output only.
+          The ids are not updated when the fields change (e.g., by tagging); call this method again to refresh them.
+        """
+        self.ids = {field: encode_keys(vocabs[field], [getattr(node, field) for node in self.nodes])
+                    for field in ENCODED_FIELDS}
+        self.vocabs = vocabs
+        return self.ids
+
+    def get_ids(self, vocabs: Dict[str, NLPVocabulary]) -> Dict[str, np.ndarray]:
+        """
+        :return: the id array of each field in the vocabularies; the graph is encoded first if it has not been
+                 encoded by the vocabularies, so graphs are encoded only when a model asks for their ids.
+        """
+        return self.ids if self.vocabs is vocabs else self.encode(vocabs)
+
+    def field_ids(self, field: str, node_ids: np.ndarray, vocabs: Dict[str, NLPVocabulary]) -> np.ndarray:
+        """
+        :param field: one of ENCODED_FIELDS.
+        :param node_ids: the IDs of nodes in this graph, -1 for none (see NLPState.get_nodes).
+        :param vocabs: the vocabularies of the ids (see get_ids).
+        :return: the ids of the field of the nodes, -1 for none.
+        """
+        ids = self.get_ids(vocabs)[field]
+        return np.where(node_ids >= 0, ids[node_ids], -1)
+
+    @classmethod
+    def from_heads(cls, nodes: List[NLPNode], heads: List[int], deprels: List[str]=None,
+                   secondary_arcs: List[List[Tuple[int, str]]]=None) -> 'NLPGraph':
+        """
+        :param nodes: NLP nodes without arcs, whose IDs are 1, 2, ... in order.
+        :param heads: the primary head ID of each node (-1 if none).
+        :param deprels: the primary dependency label of each node.
+        :param secondary_arcs: (secondary head ID, dependency label) pairs of each node.
+        :return: the graph whose arcs are built in one linear pass; since the nodes are visited in order,
+                 every children list is appended already sorted instead of bisected per arc.
+        """
+        g = cls(nodes)
+        gnodes = g.nodes
+
+        for i, node in enumerate(nodes):
+            head_id = heads[i]
+            if head_id < 0: continue
+            parent = gnodes[head_id]
+            node.parent = parent
+            if parent.children is _EMPTY: parent.children = [node]
+            else: parent.children.append(node)
+            label = deprels[i] if deprels else None
+            if label: node._deprel = intern(label)
+
+        if secondary_arcs:
+            for node, arcs in zip(nodes, secondary_arcs):
+                if not arcs: continue
+                if len(arcs) > 1: arcs = sorted(arcs, key=lambda arc: arc[0])
+                node.secondary_parents = [gnodes[head_id] for head_id, _ in arcs]
+                node._sdeprels = [intern(label) if label else None for _, label in arcs]
+
+                for parent in node.secondary_parents:
+                    if parent.secondary_children is _EMPTY: parent.secondary_children = [node]
+                    else: parent.secondary_children.append(node)
+
+        return g
 
     def __next__(self):
         try: return next(self._iter)
@@ -274,6 +476,30 @@ class NLPGraph:
     def __len__(self):
         return len(self.nodes) - 1
 
+    def __getstate__(self):
+        """
+        Graphs are pickled as flat rows instead of linked nodes so deep trees do not hit the recursion limit and
+        can be transferred cheaply between processes.  The ids are not pickled since their vocabularies belong to
+        the process; they are encoded again when a model asks for them.
+        """
+        def row(node: NLPNode):
+            head_id = node.parent.node_id if node.parent else -1
+            sheads = [(p.node_id, node.get_dependency_label(p)) for p in node.secondary_parents]
+            return node.node_id, node.word, node.lemma, node.pos, node.nament, node.feats, head_id, \
+                node.get_dependency_label(), sheads
+
+        return [row(node) for node in self]
+
+    def __setstate__(self, state):
+        nodes = [NLPNode(node_id, word, lemma, pos, nament, feats)
+                 for node_id, word, lemma, pos, nament, feats, _, _, _ in state]
+        g = NLPGraph.from_heads(nodes, [row[6] for row in state], [row[7] for row in state],
+                                [row[8] for row in state])
+        self.nodes = g.nodes
+        self.relation_index = None
+        self.ids = None
+        self.vocabs = None
+
 
 class Relation(Enum):
     PARENT                    = 'p'
@@ -294,4 +520,425 @@ class Relation(Enum):
     SND_LEFTMOST_SIBLING      = 'lms2'
     SND_RIGHTMOST_SIBLING     = 'rms2'
     SND_LEFT_NEAREST_SIBLING  = 'lns2'
-    SND_RIGHT_NEAREST_SIBLING = 'rns2'
\ No newline at end of file
+    SND_RIGHT_NEAREST_SIBLING = 'rns2'
+
+
+class RelationIndex:
+    """
+    :param graph: the graph to be indexed.
+      The node ID of every relation (see Relation) of every node in the graph, built in one pass.
+      The index is updated incrementally when NLPNode.set_parent changes the tree; secondary arcs are not involved in
+      any relation so add_secondary_parent does not affect the index.
+    """
+    RELATIONS = tuple(Relation)
+    ROWS = {relation: i for i, relation in enumerate(RELATIONS)}
+
+    def __init__(self, graph: NLPGraph):
+        self.graph: NLPGraph = graph
+        self.table: np.ndarray = np.full((len(RelationIndex.RELATIONS), len(graph.nodes)), -1, dtype=np.int32)
+
+        for node in graph.nodes:
+            node.relation_index = self
+            self._update(node)
+
+    def get(self, node: NLPNode, relation: Relation) -> Union[NLPNode, None]:
+        """
+        :return: the node with the relation to the specific node if exists; otherwise, None.
+        """
+        idx = self.table[RelationIndex.ROWS[relation], node.node_id]
+        return self.graph.nodes[idx] if idx >= 0 else None
+
+    def update_arc(self, node: NLPNode, prev_parent: NLPNode=None):
+        """
+        :param node: the node whose PARENT has been changed.
+        :param prev_parent: the previous PARENT of the node.
+          Update the relations of the node, its previous and current parents, their children (siblings),
+          and the children of the node (grandparent).
+        """
+        nodes = {node}
+        nodes.update(node.children)
+
+        for parent in (prev_parent, node.parent):
+            if parent is not None:
+                nodes.add(parent)
+                nodes.update(parent.children)
+
+        for n in nodes: self._update(n)
+
+    def _update(self, node: NLPNode):
+        node_id = node.node_id
+        if not 0 <= node_id < len(self.graph.nodes) or self.graph.nodes[node_id] is not node: return
+
+        def nid(nodes: List[NLPNode], idx: int, cond: bool) -> int:
+            return nodes[idx].node_id if cond else -1
+
+        parent = node.parent
+        c = node.children
+        p = bisect_left(c, node)
+        s = parent.children if parent else _EMPTY
+        q = bisect_left(s, node) if parent else 0
+        row = []
+
+        for k, ancestor in ((0, parent), (1, parent.parent if parent else None)):
+            row.append(ancestor.node_id if ancestor else -1)
+            row.append(nid(c, k, k < p))
+            row.append(nid(c, len(c) - 1 - k, len(c) - 1 - k >= p))
+            row.append(nid(c, p - 1 - k, p - 1 - k >= 0))
+            row.append(nid(c, p + k, p + k < len(c)))
+            row.append(nid(s, k, k < q))
+            row.append(nid(s, len(s) - 1 - k, len(s) - 1 - k > q))
+            row.append(nid(s, q - 1 - k, q - 1 - k >= 0))
+            row.append(nid(s, q + 1 + k, q + 1 + k < len(s)))
+
+        self.table[:, node_id] = row
+
+
+def _reserve(array: np.ndarray, size: int) -> np.ndarray:
+    """
+    :return: the array if its capacity is at least the size; otherwise, a copy with doubled capacity.
+    """
+    if size <= len(array): return array
+    grown = np.empty(max(size, 2 * len(array), 1024), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _replace_dir(src: str, dst: str):
+    """
+    Move the directory src to dst, replacing dst if exists.
+    """
+    try:
+        os.replace(src, dst)
+        return
+    except OSError:
+        if not os.path.isdir(dst): raise
+
+    # a non-empty directory cannot be replaced, so it is moved aside first
+    parent, name = os.path.split(dst)
+    old = tempfile.mkdtemp(prefix=name + '.', suffix='.old', dir=parent)
+
+    try:
+        os.replace(dst, old)
+    except FileNotFoundError:
+        pass    # moved aside by another saver
+
+    try:
+        os.replace(src, dst)
+    except OSError:
+        if not os.path.isdir(dst): raise    # otherwise, another saver has just put its copy in place
+    finally:
+        shutil.rmtree(old, ignore_errors=True)
+
+
+class NLPCorpus:
+    """
+    A columnar store of graphs, where each field is integer-coded by its own vocabulary and every column is a NumPy
+    array over all tokens in the corpus.  Graphs are materialized only when they are requested (see graph, graphs),
+    so memory is proportional to the number of tokens rather than the number of Python objects.  A materialized graph
+    is a copy: changes to its nodes are not written back to the columns (see append_graph to store a graph).
+
+    Columns (one entry per token, -1 denotes None):
+      word, lemma, pos, feats, nament, deprel: ids in the vocabulary of the same field.
+      head: the node ID of the primary head within its sentence.
+    Sentences: the tokens of the i'th sentence are in [offsets[i], offsets[i+1]).
+    Secondary arcs (CSR): the arcs of the j'th token are in [sarc_offsets[j], sarc_offsets[j+1]) of sarc_heads and
+      sarc_deprels, where the dependency labels are coded by the deprel vocabulary.
+    """
+    FIELDS = ('word', 'lemma', 'pos', 'feats', 'nament', 'deprel')
+    # the version of the saved format (see save); bump it whenever the files change
+    VERSION = 1
+
+    def __init__(self):
+        self.vocabs: Dict[str, NLPVocabulary] = {field: NLPVocabulary() for field in NLPCorpus.FIELDS}
+        self._columns: Dict[str, np.ndarray] = {field: np.empty(0, dtype=np.int32)
+                                                for field in NLPCorpus.FIELDS + ('head',)}
+        self._offsets: np.ndarray = np.zeros(1, dtype=np.int64)
+        self._sarc_offsets: np.ndarray = np.zeros(1, dtype=np.int64)
+        self._sarc_heads: np.ndarray = np.empty(0, dtype=np.int32)
+        self._sarc_deprels: np.ndarray = np.empty(0, dtype=np.int32)
+        self.num_sentences: int = 0
+        self.num_tokens: int = 0
+        self.num_sarcs: int = 0
+
+    def __len__(self):
+        return self.num_sentences
+
+    def graph(self, index: int) -> NLPGraph:
+        """
+        :return: a new graph copied from the index'th sentence; every call creates new nodes.
+        """
+        bidx, eidx = self.span(index)
+        return self._graph(bidx, eidx)
+
+    def graphs(self, begin: int=0, end: int=None) -> Iterator[NLPGraph]:
+        """
+        :return: new graphs copied from the sentences in [begin, end); end = None for the rest of the corpus.
+        """
+        if end is None: end = self.num_sentences
+        for i in range(begin, end): yield self.graph(i)
+
+    def span(self, index: int) -> Tuple[int, int]:
+        """
+        :return: the [begin, end) token indices of the index'th sentence in the columns.
+        """
+        if index < 0: index += self.num_sentences
+        if not 0 <= index < self.num_sentences: raise IndexError('sentence index out of range: %d' % index)
+        return int(self._offsets[index]), int(self._offsets[index + 1])
+
+    def sentence(self, index: int, field: str) -> np.ndarray:
+        """
+        :param field: one of FIELDS or 'head'.
+        :return: the ids of the field in the index'th sentence; a view of the column, so nothing is copied.
+        """
+        bidx, eidx = self.span(index)
+        return self._columns[field][bidx:eidx]
+
+    # ============================== Columns ==============================
+
+    def column(self, field: str) -> np.ndarray:
+        """
+        :param field: one of FIELDS or 'head'.
+        :return: the column of the field over all tokens.
+        """
+        return self._columns[field][:self.num_tokens]
+
+    @property
+    def offsets(self) -> np.ndarray:
+        return self._offsets[:self.num_sentences + 1]
+
+    @property
+    def sarc_offsets(self) -> np.ndarray:
+        return self._sarc_offsets[:self.num_tokens + 1]
+
+    @property
+    def sarc_heads(self) -> np.ndarray:
+        return self._sarc_heads[:self.num_sarcs]
+
+    @property
+    def sarc_deprels(self) -> np.ndarray:
+        return self._sarc_deprels[:self.num_sarcs]
+
+    # ============================== Append ==============================
+
+    def append(self, words: List[str]=None, lemmas: List[str]=None, poses: List[str]=None, feats: List[str]=None,
+               naments: List[str]=None, heads: List[int]=None, deprels: List[str]=None,
+               sheads: List[List[Tuple[int, str]]]=None):
+        """
+        :param words: word forms.
+        :param lemmas: lemmas.
+        :param poses: part-of-speech tags.
+        :param feats: extra features in the TSV format (e.g., 'k1=v1|k2=v2').
+        :param naments: named entity tags.
+        :param heads: primary head IDs.
+        :param deprels: primary dependency labels.
+        :param sheads: (secondary head ID, dependency label) pairs of each token.
+          Append a sentence to this corpus; all given lists must have the same length, a missing list is filled with -1.
+        """
+        lists = [v for v in (words, lemmas, poses, feats, naments, heads, deprels, sheads) if v is not None]
+        if not lists: raise ValueError('At least one field must be given.')
+        size = len(lists[0])
+        bidx = self.num_tokens
+        eidx = bidx + size
+
+        for field, values in zip(NLPCorpus.FIELDS, (words, lemmas, poses, feats, naments, deprels)):
+            column = self._columns[field] = _reserve(self._columns[field], eidx)
+            vocab = self.vocabs[field]
+            column[bidx:eidx] = [vocab.add(value) for value in values] if values is not None else -1
+
+        column = self._columns['head'] = _reserve(self._columns['head'], eidx)
+        column[bidx:eidx] = heads if heads is not None else -1
+
+        self._sarc_offsets = _reserve(self._sarc_offsets, eidx + 1)
+        if sheads is not None:
+            vocab = self.vocabs['deprel']
+            for i, arcs in enumerate(sheads, bidx):
+                self._append_sarcs(arcs, vocab)
+                self._sarc_offsets[i + 1] = self.num_sarcs
+        else:
+            self._sarc_offsets[bidx + 1:eidx + 1] = self.num_sarcs
+
+        self._offsets = _reserve(self._offsets, self.num_sentences + 2)
+        self._offsets[self.num_sentences + 1] = eidx
+        self.num_sentences += 1
+        self.num_tokens = eidx
+
+    def append_graph(self, graph: NLPGraph):
+        """
+        :param graph: the graph to be encoded and appended to this corpus.
+        """
+        def feats(node: NLPNode) -> Union[str, None]:
+            return DELIM_FEAT.join(DELIM_FEAT_KV.join(kv) for kv in node.feats.items()) if node.feats else None
+
+        nodes = graph.nodes[1:]
+        self.append(words=[node.word for node in nodes],
+                    lemmas=[node.lemma for node in nodes],
+                    poses=[node.pos for node in nodes],
+                    feats=[feats(node) for node in nodes],
+                    naments=[node.nament for node in nodes],
+                    heads=[node.parent.node_id if node.parent else -1 for node in nodes],
+                    deprels=[node.get_dependency_label() for node in nodes],
+                    sheads=[[(p.node_id, node.get_dependency_label(p)) for p in node.secondary_parents]
+                            for node in nodes])
+
+    def extend(self, corpus: 'NLPCorpus'):
+        """
+        :param corpus: the corpus whose sentences are appended to this corpus.
+          The ids of the other corpus are mapped to the vocabularies of this corpus once per key, and every column is
+          copied by a single gather, so no graph or per-token string is created.
+        """
+        bidx = self.num_tokens
+        eidx = bidx + corpus.num_tokens
+        maps = {}
+
+        for field in NLPCorpus.FIELDS:
+            vocab = self.vocabs[field]
+            # the trailing -1 keeps None as -1 when indexed by -1
+            ids = maps[field] = np.array([vocab.add(key) for key in corpus.vocabs[field].keys] + [-1], dtype=np.int32)
+            column = self._columns[field] = _reserve(self._columns[field], eidx)
+            column[bidx:eidx] = ids[corpus.column(field)]
+
+        column = self._columns['head'] = _reserve(self._columns['head'], eidx)
+        column[bidx:eidx] = corpus.column('head')
+
+        size = self.num_sarcs + corpus.num_sarcs
+        self._sarc_heads = _reserve(self._sarc_heads, size)
+        self._sarc_deprels = _reserve(self._sarc_deprels, size)
+        self._sarc_heads[self.num_sarcs:size] = corpus.sarc_heads
+        self._sarc_deprels[self.num_sarcs:size] = maps['deprel'][corpus.sarc_deprels]
+        self._sarc_offsets = _reserve(self._sarc_offsets, eidx + 1)
+        self._sarc_offsets[bidx + 1:eidx + 1] = corpus.sarc_offsets[1:] + self.num_sarcs
+
+        count = self.num_sentences + corpus.num_sentences
+        self._offsets = _reserve(self._offsets, count + 1)
+        self._offsets[self.num_sentences + 1:count + 1] = corpus.offsets[1:] + bidx
+        self.num_sentences = count
+        self.num_tokens = eidx
+        self.num_sarcs = size
+
+    def _append_sarcs(self, arcs: List[Tuple[int, str]], vocab: NLPVocabulary):
+        if not arcs: return
+        size = self.num_sarcs + len(arcs)
+        self._sarc_heads = _reserve(self._sarc_heads, size)
+        self._sarc_deprels = _reserve(self._sarc_deprels, size)
+        self._sarc_heads[self.num_sarcs:size] = [arc[0] for arc in arcs]
+        self._sarc_deprels[self.num_sarcs:size] = [vocab.add(arc[1]) for arc in arcs]
+        self.num_sarcs = size
+
+    # ============================== Serialization ==============================
+
+    def __getstate__(self):
+        # the spare capacity of the columns is not pickled
+        state = self.__dict__.copy()
+        state['_columns'] = {field: self.column(field) for field in self._columns}
+        for name in ('offsets', 'sarc_offsets', 'sarc_heads', 'sarc_deprels'): state['_' + name] = getattr(self, name)
+        return state
+
+    def save(self, path: str, meta: Dict=None):
+        """
+        :param path: the directory where the corpus is saved.
+        :param meta: extra information saved with the corpus (see read_meta).
+          Each column is saved as a .npy file, each vocabulary as a text file with one key per line, and meta.json
+          with VERSION.  The files are written to a temporary directory next to the path, which then replaces the
+          path by renaming, so processes that have memory-mapped the previous corpus keep reading its (unlinked)
+          files, an interrupted save leaves the path untouched, and concurrent savers never mix their files.
+        """
+        path = os.path.abspath(path)
+        parent, name = os.path.split(path)
+        tmp = tempfile.mkdtemp(prefix=name + '.', suffix='.tmp', dir=parent)
+
+        try:
+            os.chmod(tmp, 0o755)
+            self._save(tmp, meta)
+            _replace_dir(tmp, path)
+        finally:
+            shutil.rmtree(tmp, ignore_errors=True)
+
+    def _save(self, path: str, meta: Dict=None):
+        for field in NLPCorpus.FIELDS + ('head',):
+            np.save(os.path.join(path, field + '.npy'), self.column(field))
+            if field in self.vocabs:
+                with open(os.path.join(path, field + '.txt'), 'w', encoding='utf-8') as fout:
+                    fout.write('\n'.join(self.vocabs[field].keys))
+
+        for name in ('offsets', 'sarc_offsets', 'sarc_heads', 'sarc_deprels'):
+            np.save(os.path.join(path, name + '.npy'), getattr(self, name))
+
+        meta = dict(meta or {})
+        meta.update(version=NLPCorpus.VERSION, num_sentences=self.num_sentences, num_tokens=self.num_tokens,
+                    num_sarcs=self.num_sarcs, vocab_sizes={field: len(vocab) for field, vocab in self.vocabs.items()})
+        with open(os.path.join(path, 'meta.json'), 'w') as fout: json.dump(meta, fout)
+
+    @classmethod
+    def read_meta(cls, path: str) -> Union[Dict, None]:
+        """
+        :return: the meta information of the corpus saved in the directory if exists; otherwise, None.
+        """
+        meta_file = os.path.join(path, 'meta.json')
+        if not os.path.isfile(meta_file): return None
+        with open(meta_file) as fin: return json.load(fin)
+
+    @classmethod
+    def load(cls, path: str, mmap_mode: str='r') -> 'NLPCorpus':
+        """
+        :param path: the directory where the corpus is saved.
+        :param mmap_mode: the mode to memory-map the columns (see numpy.load); if None, the columns are read.
+        :return: the loaded corpus.
+        """
+        def load(name: str) -> np.ndarray:
+            # a plain view avoids the per-slice overhead of numpy.memmap while sharing the same buffer
+            return np.load(os.path.join(path, name + '.npy'), mmap_mode=mmap_mode).view(np.ndarray)
+
+        def keys(field: str) -> List[str]:
+            if meta['vocab_sizes'][field] == 0: return []
+            with open(os.path.join(path, field + '.txt'), encoding='utf-8') as fin: return fin.read().split('\n')
+
+        meta = cls.read_meta(path)
+        if meta is None: raise IOError('No corpus is saved in ' + path)
+        if meta.get('version') != cls.VERSION: raise IOError('Unsupported corpus version in ' + path)
+        corpus = cls()
+
+        for field in NLPCorpus.FIELDS:
+            vocab = corpus.vocabs[field]
+            vocab.keys = keys(field)
+            vocab.index_map = {key: i for i, key in enumerate(vocab.keys)}
+
+        for field in NLPCorpus.FIELDS + ('head',): corpus._columns[field] = load(field)
+        corpus._offsets = load('offsets')
+        corpus._sarc_offsets = load('sarc_offsets')
+        corpus._sarc_heads = load('sarc_heads')
+        corpus._sarc_deprels = load('sarc_deprels')
+        corpus.num_sentences = meta['num_sentences']
+        corpus.num_tokens = meta['num_tokens']
+        corpus.num_sarcs = meta['num_sarcs']
+        return corpus
+
+    # ============================== Graph ==============================
+
+    def _graph(self, bidx: int, eidx: int) -> NLPGraph:
+        """
+        :return: the graph consisting of the tokens in [bidx, eidx).
+        """
+        def values(field: str) -> List[str]:
+            keys = self.vocabs[field].keys
+            return [keys[i] if i >= 0 else None for i in self._columns[field][bidx:eidx].tolist()]
+
+        def feats(f: str) -> Union[Dict[str, str], None]:
+            return dict(kv.split(DELIM_FEAT_KV, 1) for kv in f.split(DELIM_FEAT)) if f else None
+
+        words, lemmas, poses, fs, naments, deprels = (values(field) for field in NLPCorpus.FIELDS)
+        nodes = [NLPNode(node_id=i, word=words[i-1], lemma=lemmas[i-1], pos=poses[i-1], nament=naments[i-1],
+                         feats=feats(fs[i-1])) for i in range(1, eidx - bidx + 1)]
+
+        heads = self._columns['head'][bidx:eidx].tolist()
+        sarc_offsets = self._sarc_offsets[bidx:eidx + 1].tolist()
+        sarc_heads = self._sarc_heads[sarc_offsets[0]:sarc_offsets[-1]].tolist()
+        sarc_deprels = self._sarc_deprels[sarc_offsets[0]:sarc_offsets[-1]].tolist()
+        labels = self.vocabs['deprel'].keys
+        sarcs = None
+
+        if sarc_heads:
+            sarcs = [[(sarc_heads[j], labels[sarc_deprels[j]])
+                      for j in range(sarc_offsets[i] - sarc_offsets[0], sarc_offsets[i + 1] - sarc_offsets[0])]
+                     for i in range(eidx - bidx)]
+
+        return NLPGraph.from_heads(nodes, heads, deprels, sarcs)
@@ -0,0 +1,243 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import json
+import os
+import shutil
+import tempfile
+import pickle
+import unittest
+
+import numpy as np
+
+from elit.reader import TSVReader
+from elit.structure import ENCODED_FIELDS, NLPCorpus, NLPGraph, NLPNode, ROOT_TAG, Relation, create_vocabs
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+def read_sample(reader: TSVReader):
+    reader.open(SAMPLE_TSV)
+    graphs = reader.next_all
+    reader.close()
+    return graphs
+
+
+class NLPCorpusTest(unittest.TestCase):
+    def setUp(self):
+        self.reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+        self.graphs = read_sample(self.reader)
+        self.reader.open(SAMPLE_TSV)
+        self.corpus = self.reader.read_corpus()
+        self.reader.close()
+
+    def test_columns(self):
+        self.assertEqual(len(self.corpus), 2)
+        self.assertEqual(self.corpus.num_tokens, 18)
+        self.assertEqual(self.corpus.offsets.tolist(), [0, 7, 18])
+        self.assertEqual(self.corpus.column('head')[:7].tolist(), [2, 0, 4, 2, 6, 4, 4])
+        self.assertEqual(self.corpus.vocabs['word'].get(self.corpus.column('word')[0]), 'John')
+        self.assertEqual(self.corpus.sarc_heads.tolist(), [4, 5, 7, 3, 5, 3, 5])
+
+    def test_graphs(self):
+        for gold, graph in zip(self.graphs, self.corpus.graphs()):
+            self.assertEqual(str(gold), str(graph))
+
+        self.assertEqual(str(self.corpus.graph(-1)), str(self.graphs[-1]))
+        self.assertEqual([str(g) for g in self.corpus.graphs(1)], [str(self.graphs[1])])
+        self.assertRaises(IndexError, self.corpus.graph, 2)
+
+        graph = self.corpus.graph(0)
+        graph.nodes[1].word = 'Mary'
+        self.assertEqual(self.corpus.graph(0).nodes[1].word, 'John')
+
+    def test_sentence(self):
+        heads = self.corpus.sentence(0, 'head')
+        self.assertEqual(heads.tolist(), [2, 0, 4, 2, 6, 4, 4])
+        self.assertTrue(np.shares_memory(heads, self.corpus.column('head')))
+        self.assertEqual(self.corpus.span(-1), (7, 18))
+
+    def test_append_graph(self):
+        corpus = NLPCorpus()
+        for graph in self.graphs: corpus.append_graph(graph)
+        for gold, graph in zip(self.graphs, corpus.graphs()):
+            self.assertEqual(str(gold), str(graph))
+
+    def test_extend(self):
+        # the vocabularies of the two corpora differ, so the ids are remapped
+        other = NLPCorpus()
+        for graph in reversed(self.graphs): other.append_graph(graph)
+        corpus = NLPCorpus()
+        corpus.extend(self.corpus)
+        corpus.extend(other)
+        corpus.extend(NLPCorpus())
+
+        self.assertEqual(len(corpus), 4)
+        self.assertEqual(corpus.num_sarcs, 2 * self.corpus.num_sarcs)
+        golds = self.graphs + list(reversed(self.graphs))
+        self.assertEqual([str(g) for g in corpus.graphs()], [str(g) for g in golds])
+
+    def test_pickle(self):
+        corpus = pickle.loads(pickle.dumps(self.corpus))
+        self.assertEqual([str(g) for g in corpus.graphs()], [str(g) for g in self.graphs])
+        self.assertEqual(len(corpus.column('word')), corpus.num_tokens)
+        self.assertEqual(len(corpus._columns['word']), corpus.num_tokens)
+
+        vocab = pickle.loads(pickle.dumps(self.corpus.vocabs['word']))
+        self.assertEqual(vocab.keys, self.corpus.vocabs['word'].keys)
+        self.assertEqual(vocab.index('came'), self.corpus.vocabs['word'].index('came'))
+        self.assertEqual(vocab.add('new'), len(self.corpus.vocabs['word']))
+
+    def test_ids(self):
+        vocabs = create_vocabs()
+
+        def decode(graph: NLPGraph, field: str):
+            return [vocabs[field].get(i) for i in graph.get_ids(vocabs)[field].tolist()]
+
+        for gold, graph in zip(self.graphs, self.corpus.graphs()):
+            self.assertIsNone(gold.ids)
+            for g in (gold, graph, pickle.loads(pickle.dumps(gold))):
+                for field in ENCODED_FIELDS:
+                    self.assertEqual(decode(g, field), [getattr(node, field) for node in gold.nodes])
+
+        graph = self.graphs[0]
+        ids = graph.get_ids(vocabs)
+        self.assertIs(graph.get_ids(vocabs), ids)
+        self.assertEqual(ids['word'][0], 0)
+        self.assertEqual(vocabs['word'].get(0), ROOT_TAG)
+        ids = graph.field_ids('word', np.array([-1, 0, 2]), vocabs)
+        self.assertEqual([vocabs['word'].get(i) for i in ids.tolist()], [None, ROOT_TAG, 'came'])
+
+        # the vocabularies of another owner are independent
+        others = create_vocabs()
+        self.assertEqual(len(others['word']), 1)
+        self.assertEqual(graph.field_ids('word', np.array([2]), others).tolist(), [2])
+        self.assertEqual(others['word'].keys, [ROOT_TAG, 'John', 'came', 'to', 'visit', 'Emory', 'University',
+                                               'yesterday'])
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            self.corpus.save(tmpdir, meta={'key': 'value'})
+            self.assertEqual(NLPCorpus.read_meta(tmpdir)['key'], 'value')
+            corpus = NLPCorpus.load(tmpdir)
+            self.assertEqual(len(corpus), len(self.corpus))
+            for gold, graph in zip(self.graphs, corpus.graphs()): self.assertEqual(str(gold), str(graph))
+
+            # a corpus mapped from the directory is intact after the directory is replaced
+            other = NLPCorpus()
+            other.append_graph(self.graphs[1])
+            other.save(tmpdir)
+            self.assertEqual(len(NLPCorpus.load(tmpdir)), 1)
+            for gold, graph in zip(self.graphs, corpus.graphs()): self.assertEqual(str(gold), str(graph))
+            self.assertFalse([f for f in os.listdir(os.path.dirname(tmpdir))
+                              if f.startswith(os.path.basename(tmpdir) + '.')])
+
+            # a corpus saved in another format is not loaded
+            meta = NLPCorpus.read_meta(tmpdir)
+            meta['version'] = NLPCorpus.VERSION + 1
+            with open(os.path.join(tmpdir, 'meta.json'), 'w') as fout: json.dump(meta, fout)
+            self.assertRaises(IOError, NLPCorpus.load, tmpdir)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_read_cached(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'sample.tsv')
+            shutil.copy(SAMPLE_TSV, filename)
+            path = self.reader.cache_path(filename)
+            self.assertNotEqual(path, TSVReader(1, 3).cache_path(filename))
+
+            for i in range(2):
+                corpus = self.reader.read_cached(filename)
+                self.assertTrue(os.path.isdir(path))
+                for gold, graph in zip(self.graphs, corpus.graphs()): self.assertEqual(str(gold), str(graph))
+
+            # a cache of another version is rewritten
+            meta = NLPCorpus.read_meta(path)
+            meta['version'] = 0
+            with open(os.path.join(path, 'meta.json'), 'w') as fout: json.dump(meta, fout)
+            corpus = self.reader.read_cached(filename, workers=2)
+            self.assertEqual(NLPCorpus.read_meta(path)['version'], NLPCorpus.VERSION)
+            for gold, graph in zip(self.graphs, corpus.graphs()): self.assertEqual(str(gold), str(graph))
+            self.assertEqual(sorted(os.listdir(tmpdir)), sorted(['sample.tsv', os.path.basename(path)]))
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class NLPGraphTest(unittest.TestCase):
+    def test_from_heads(self):
+        heads = [2, 0, 2, 2, 6, 4]
+        deprels = ['nsbj', 'root', 'obj', 'conj', 'det', 'obj']
+        sarcs = [[], [], [(4, 'obj'), (2, 'x')], [], [], []]
+
+        graph = NLPGraph.from_heads([NLPNode(i) for i in range(1, 7)], heads, deprels, sarcs)
+        gold = NLPGraph([NLPNode(i) for i in range(1, 7)])
+        for node, head, deprel, arcs in zip(gold.nodes[1:], heads, deprels, sarcs):
+            node.set_parent(gold.nodes[head], deprel)
+            for head_id, label in arcs: node.add_secondary_parent(gold.nodes[head_id], label)
+
+        self.assertEqual(str(graph), str(gold))
+        for node, g in zip(graph.nodes, gold.nodes):
+            self.assertEqual([n.node_id for n in node.children], [n.node_id for n in g.children])
+            self.assertEqual([n.node_id for n in node.secondary_children], [n.node_id for n in g.secondary_children])
+
+        self.assertEqual(graph.nodes[3].deprels, {graph.nodes[2]: 'obj', graph.nodes[4]: 'obj'})
+        self.assertIs(graph.nodes[3].get_dependency_label(graph.nodes[4]), gold.nodes[6].get_dependency_label())
+
+    def test_slots(self):
+        node = NLPNode(1)
+        self.assertFalse(hasattr(node, '__dict__'))
+        self.assertIsNone(node.pos_scores)
+        node.pos_scores = np.zeros(3)
+        self.assertRaises(AttributeError, setattr, node, 'undeclared', 0)
+
+    def test_relation_index(self):
+        def check(graph: NLPGraph):
+            index = graph.relation_index
+            for node in graph.nodes:
+                for order in (0, 1):
+                    suffix = '' if order == 0 else '2'
+                    for relation, method in (('lmc', node.get_leftmost_child), ('rmc', node.get_rightmost_child),
+                                             ('lnc', node.get_left_nearest_child),
+                                             ('rnc', node.get_right_nearest_child),
+                                             ('lms', node.get_leftmost_sibling), ('rms', node.get_rightmost_sibling),
+                                             ('lns', node.get_left_nearest_sibling),
+                                             ('rns', node.get_right_nearest_sibling)):
+                        self.assertIs(index.get(node, Relation(relation + suffix)), method(order))
+
+                self.assertIs(index.get(node, Relation.PARENT), node.parent)
+                self.assertIs(index.get(node, Relation.GRANDPARENT), node.grandparent)
+
+        heads = [3, 3, 0, 3, 3, 5, 5, 5, 3, 9]
+        graph = NLPGraph.from_heads([NLPNode(i) for i in range(1, 11)], heads, ['dep'] * 10)
+        graph.build_relation_index()
+        check(graph)
+
+        nodes = graph.nodes
+        self.assertIs(nodes[5].get_right_nearest_sibling(), nodes[9])
+        self.assertIs(nodes[1].get_rightmost_sibling(), nodes[9])
+
+        nodes[6].set_parent(nodes[1], 'dep')
+        nodes[10].set_parent(nodes[7], 'dep')
+        nodes[4].set_parent(nodes[8], 'dep')
+        check(graph)
+
+
+if __name__ == '__main__':
+    unittest.main()
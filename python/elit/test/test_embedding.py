@@ -0,0 +1,317 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import os
+import pickle
+import shutil
+import tempfile
+import unittest
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+
+import numpy as np
+from fasttext.model import WordVectorModel
+
+from elit.component.template.lexicon import EmbeddingCache, EmbeddingTable, LexiconFactory, LexiconRegistry, \
+    MappedVocabulary, load_word2vec, NLPEmbedding, NLPLexiconMapper, VOCAB_EXT, VOCAB_EXTS, ZERO_INDEX, ROOT_INDEX
+from elit.structure import NLPGraph, NLPNode, ROOT_TAG, create_vocabs
+
+__author__ = 'Jinho D. Choi'
+
+
+class EmbeddingCacheTest(unittest.TestCase):
+    def test_lru(self):
+        cache = EmbeddingCache(max_bytes=3 * 16)
+        compute = lambda key: np.full(4, len(key), dtype='float32')
+
+        for key in ('a', 'bb', 'ccc', 'a', 'dddd'): cache.get(key, compute)
+        self.assertEqual(cache.stats, {'size': 3, 'bytes': 48, 'hits': 1, 'misses': 4, 'evictions': 1})
+        self.assertEqual(cache.get('a', compute).tolist(), [1, 1, 1, 1])
+        self.assertEqual(cache.hits, 2)
+
+        cache.get('bb', compute)
+        self.assertEqual(cache.misses, 5)
+        self.assertRaises(ValueError, cache.get('a', compute).__setitem__, 0, 0)
+
+
+class MappedVocabularyTest(unittest.TestCase):
+    def test_index(self):
+        keys = [ROOT_TAG, '', 'a', 'é', '東京', 'a b'] + ['k%d' % i for i in range(1000)]
+        vocab = MappedVocabulary.build(keys + ['a'])
+        self.assertEqual(len(vocab), len(keys) + 1)
+        self.assertGreaterEqual(len(vocab.slots), 2 * len(vocab))
+
+        for i, key in enumerate(keys):
+            self.assertEqual(vocab.index(key), i)
+            self.assertEqual(vocab.get(i), key)
+
+        self.assertEqual(vocab.get(len(keys)), 'a')
+        self.assertEqual(vocab.keys, keys + ['a'])
+        self.assertIn('東京', vocab)
+        self.assertNotIn('東', vocab)
+        self.assertEqual([vocab.index(key) for key in ('b', 'k1000', None)], [-1, -1, -1])
+        self.assertIsNone(vocab.get(-1))
+
+        empty = MappedVocabulary.build([])
+        self.assertEqual((len(empty), empty.index('a'), empty.keys), (0, -1, []))
+
+
+class EmbeddingTableTest(unittest.TestCase):
+    def setUp(self):
+        self.table = EmbeddingTable(np.arange(12, dtype='float32').reshape(4, 3), ['a', 'b', 'c', 'd'])
+
+    def test_save_load(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'table.npy')
+            self.table.save(filename)
+            self.assertTrue(EmbeddingTable.exists(filename))
+            table = EmbeddingTable.load(filename)
+            self.assertIsInstance(table.vocab, MappedVocabulary)
+            self.assertFalse(table.vocab.slots.flags.writeable)
+            self.assertEqual(table.vocab.keys, ['a', 'b', 'c', 'd'])
+            self.assertEqual(table.syn0.tolist(), self.table.syn0.tolist())
+            self.assertEqual(table.index('c'), 2)
+            self.assertEqual(table.index('x'), ZERO_INDEX)
+
+            # a loaded table is saved again as it is
+            table.quantize('int8').save(os.path.join(tmpdir, 'int8.npy'))
+            self.assertEqual(EmbeddingTable.load(os.path.join(tmpdir, 'int8.npy')).vocab.keys, ['a', 'b', 'c', 'd'])
+
+            # the keys of tables saved in the text format
+            for ext in VOCAB_EXTS.values(): os.remove(os.path.join(tmpdir, 'table' + ext))
+            with open(os.path.join(tmpdir, 'table' + VOCAB_EXT), 'w') as fout: fout.write('a\nb\nc\nd\n')
+            self.assertTrue(EmbeddingTable.exists(filename))
+            table = EmbeddingTable.load(filename)
+            self.assertEqual(table.vocab.keys, ['a', 'b', 'c', 'd'])
+            self.assertEqual(table.index('c'), 2)
+            self.table.save(filename)
+            self.assertFalse(os.path.isfile(os.path.join(tmpdir, 'table' + VOCAB_EXT)))
+            self.assertEqual(table.index('e'), ZERO_INDEX)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_get_batch(self):
+        emb = NLPEmbedding(self.table, 'word')
+        graph = NLPGraph([NLPNode(1, 'b'), NLPNode(2, 'x'), NLPNode(3, 'd')])
+        nodes = [None, graph.nodes[0], graph.nodes[1], graph.nodes[2], graph.nodes[3]]
+
+        self.assertEqual([emb.index(node) for node in nodes], [ZERO_INDEX, ROOT_INDEX, 1, ZERO_INDEX, 3])
+        batch = emb.get_batch(nodes)
+        self.assertEqual(batch.shape, (5, 3))
+        for row, node in zip(batch, nodes): self.assertEqual(row.tolist(), emb.get(node).tolist())
+
+    def test_get_ids(self):
+        emb = NLPEmbedding(self.table, 'word')
+        vocabs = create_vocabs()
+        vocab = vocabs['word']
+        graph = NLPGraph([NLPNode(1, 'b'), NLPNode(2, 'x'), NLPNode(3, 'd')])
+        node_ids = np.array([-1, 0, 1, 2, 3])
+        nodes = [None] + graph.nodes
+        word_ids = graph.field_ids('word', node_ids, vocabs)
+
+        self.assertEqual(emb.id_index(word_ids, vocab).tolist(), [emb.index(n) for n in nodes])
+        self.assertEqual(emb.get_ids(word_ids, vocab).tolist(), emb.get_batch(nodes).tolist())
+
+        graph = NLPGraph([NLPNode(1, 'c'), NLPNode(2, 'new')])
+        self.assertEqual(emb.id_index(graph.field_ids('word', np.array([1, 2]), vocabs), vocab).tolist(),
+                         [2, ZERO_INDEX])
+
+        # a shared embedding resolves the ids of each vocabulary separately and drops them with the vocabulary
+        others = create_vocabs()
+        ids = NLPGraph([NLPNode(1, 'c'), NLPNode(2, 'new')]).field_ids('word', np.array([1, 2]), others)
+        self.assertEqual(emb.id_index(ids, others['word']).tolist(), [2, ZERO_INDEX])
+        self.assertEqual(len(emb._id_rows), 2)
+        del others
+        self.assertEqual(len(emb._id_rows), 1)
+
+    def test_prune(self):
+        emb = NLPEmbedding(self.table, 'word')
+        table = emb.prune(['d', 'x', 'b', 'b'])
+        self.assertEqual(table.vocab.keys, ['b', 'd'])
+        self.assertEqual(table.syn0.tolist(), self.table.syn0[[1, 3]].tolist())
+
+    def test_quantize(self):
+        graph = NLPGraph([NLPNode(1, 'b'), NLPNode(2, 'x'), NLPNode(3, 'd')])
+        nodes = [None] + graph.nodes
+        base = NLPEmbedding(self.table, 'word').get_batch(nodes)
+
+        for dtype, tol in (('float32', 0), ('float16', 1e-2), ('int8', 11 / 127)):
+            emb = NLPEmbedding(self.table, 'word', dtype=dtype)
+            self.assertEqual(emb.vsm.dtype, dtype)
+            batch = emb.get_batch(nodes)
+            self.assertEqual(batch.dtype, np.float32)
+            self.assertLessEqual(np.abs(batch - base).max(), tol)
+            for row, node in zip(batch, nodes): self.assertEqual(row.tolist(), emb.get(node).tolist())
+
+        table = self.table.quantize('int8')
+        self.assertEqual(table.syn0[1].tolist(), [76, 102, 127])
+        self.assertEqual(NLPEmbedding(table, 'word').prune(['d']).scale.tolist(), table.scale[[3]].tolist())
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'table.npy')
+            table.save(filename)
+            loaded = EmbeddingTable.load(filename)
+            self.assertEqual(loaded.take(np.arange(4)).tolist(), table.take(np.arange(4)).tolist())
+            self.table.save(filename)
+            self.assertIsNone(EmbeddingTable.load(filename).scale)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+class FastTextTableTest(unittest.TestCase):
+    class Model(WordVectorModel):
+        def __init__(self):
+            self.calls = []
+
+        def __getitem__(self, key):
+            self.calls.append(key)
+            return [float(len(key))] * 3
+
+    def test_fallback(self):
+        model = self.Model()
+        table = NLPEmbedding(model, 'word').prune(['bb', 'ccc'])
+        self.assertEqual(table.vocab.keys, [ROOT_TAG, '', 'bb', 'ccc'])
+
+        emb = NLPEmbedding(model, 'word', table=EmbeddingTable(table.syn0 + 1, table.vocab))
+        model.calls.clear()
+        graph = NLPGraph([NLPNode(1, 'bb'), NLPNode(2, 'dddd'), NLPNode(3, 'ccc')])
+        nodes = [None] + graph.nodes
+
+        batch = emb.get_batch(nodes)
+        self.assertEqual(batch[:, 0].tolist(), [0, len(ROOT_TAG), 3, 4, 4])
+        for row, node in zip(batch, nodes): self.assertEqual(row.tolist(), emb.get(node).tolist())
+        self.assertEqual(model.calls, ['dddd'])
+
+        model.calls.clear()
+        vocabs = create_vocabs()
+        batch = emb.get_ids(graph.field_ids('word', np.arange(-1, 4), vocabs), vocabs['word'])
+        self.assertEqual(batch.tolist(), emb.get_batch(nodes).tolist())
+        self.assertEqual(model.calls, [])
+
+
+def embed(factory: LexiconFactory, word: str):
+    lexicon = factory.create()
+    return lexicon.w2v.get(NLPNode(1, word)).tolist(), lexicon.w2v.vsm.syn0.flags.writeable
+
+
+class LexiconFactoryTest(unittest.TestCase):
+    def test_shared(self):
+        table = EmbeddingTable(np.arange(12, dtype='float32').reshape(4, 3), ['a', 'b', 'c', 'd'])
+
+        for dtype in ('float32', 'int8'):
+            with LexiconFactory(NLPLexiconMapper, w2v=table.quantize(dtype), dtype=dtype) as factory:
+                vocab = MappedVocabulary.build(table.vocab.keys)
+                self.assertEqual(factory.nbytes, table.quantize(dtype).syn0.nbytes + (16 if dtype == 'int8' else 0) +
+                                 sum(array.nbytes for array in vocab.arrays.values()))
+
+                # the keys are shared, not pickled (no short string 'c' in the pickle)
+                self.assertNotIn(b'\x8c\x01c', pickle.dumps(factory))
+                gold = NLPLexiconMapper(w2v=table, dtype=dtype).w2v.get(NLPNode(1, 'c')).tolist()
+                self.assertEqual(embed(factory, 'c'), (gold, False))
+
+                with ProcessPoolExecutor(2) as pool:
+                    self.assertEqual(list(pool.map(embed, [factory] * 2, ['c', 'x'])), [(gold, False), ([0] * 3, False)])
+
+
+class LexiconRegistryTest(unittest.TestCase):
+    def test_shared(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            table = EmbeddingTable(np.arange(12, dtype='float32').reshape(4, 3), ['a', 'b', 'c', 'd'])
+            filename = os.path.join(tmpdir, 'w2v.npy')
+            table.save(filename)
+
+            registry = LexiconRegistry()
+            w2v = registry.acquire(filename)
+            pos, dep = NLPLexiconMapper(w2v=w2v), NLPLexiconMapper(w2v=registry.acquire(filename))
+            self.assertIs(pos.w2v, dep.w2v)
+            self.assertIsNot(registry.acquire(filename, dtype='int8'), w2v)
+            self.assertEqual(registry.stats, {'models': 2, 'references': 3, 'bytes': 48 + 12 + 16,
+                                              'shared_bytes': 48, 'saved_bytes': 48})
+
+            registry.release(w2v)
+            registry.release(w2v)
+            self.assertEqual(registry.stats['models'], 1)
+            self.assertRaises(ValueError, registry.release, w2v)
+
+            w2v = registry.acquire(filename)
+            EmbeddingTable(table.syn0 + 1, table.vocab).save(filename)
+            self.assertIsNot(registry.acquire(filename), w2v)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_loaders(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'w2v.npy')
+            EmbeddingTable(np.arange(12, dtype='float32').reshape(4, 3), ['a', 'b', 'c', 'd']).save(filename)
+            registry = LexiconRegistry()
+
+            # distinct loaders, lambdas included, never share a model
+            scaled = registry.acquire(filename, loader=lambda f: EmbeddingTable(load_word2vec(f).syn0 * 2, list('abcd')))
+            shifted = registry.acquire(filename, loader=lambda f: EmbeddingTable(load_word2vec(f).syn0 + 1, list('abcd')))
+            self.assertEqual(registry.stats['models'], 2)
+            self.assertEqual(scaled.get(NLPNode(1, 'b')).tolist(), [6, 8, 10])
+            self.assertEqual(shifted.get(NLPNode(1, 'b')).tolist(), [4, 5, 6])
+
+            # a failed load reaches its caller, and the next acquisition loads the model again
+            def failing(f): raise IOError('corrupt model')
+            self.assertRaises(IOError, registry.acquire, filename, loader=failing)
+            self.assertEqual(registry.stats['models'], 2)
+            self.assertIs(registry.acquire(filename, loader=load_word2vec), registry.acquire(filename))
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_concurrent(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filenames = [os.path.join(tmpdir, name) for name in ('slow.npy', 'fast.npy')]
+            for filename in filenames: EmbeddingTable(np.ones((2, 3), dtype='float32'), ['a', 'b']).save(filename)
+
+            registry = LexiconRegistry()
+            started, finish = threading.Event(), threading.Event()
+            loads = []
+
+            def slow(f):
+                loads.append(f)
+                started.set()
+                finish.wait(10)
+                return load_word2vec(f)
+
+            with ThreadPoolExecutor(4) as executor:
+                futures = [executor.submit(registry.acquire, filenames[0], loader=slow)]
+                started.wait(10)
+                futures += [executor.submit(registry.acquire, filenames[0], loader=slow) for _ in range(2)]
+
+                # the slow load blocks neither another model nor the statistics
+                self.assertIsNotNone(registry.acquire(filenames[1]))
+                self.assertEqual(registry.stats['models'], 2)
+                self.assertFalse(any(future.done() for future in futures))
+
+                finish.set()
+                embs = [future.result(10) for future in futures]
+
+            self.assertEqual(len(loads), 1)
+            self.assertIs(embs[0], embs[1])
+            self.assertIs(embs[0], embs[2])
+            self.assertEqual(registry.stats['saved_bytes'], 2 * 24)
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,65 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import gzip
+import os
+import shutil
+import tempfile
+import unittest
+
+from elit.component.lexicon_builder import ambiguity_classes, count_file
+from elit.component.template.lexicon import NLPEmbedding, ZERO_INDEX
+from elit.structure import NLPGraph, NLPNode
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+class AmbiguityClassTest(unittest.TestCase):
+    def test_count(self):
+        counts = count_file(SAMPLE_TSV, 1, 3, workers=1)
+        self.assertEqual(sum(counts.values()), 18)
+        self.assertEqual(count_file(SAMPLE_TSV, 1, 3, workers=2), counts)
+
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'sample.tsv.gz')
+            with open(SAMPLE_TSV, 'rb') as fin, gzip.open(filename, 'wb') as fout: fout.write(fin.read())
+            self.assertEqual(count_file(filename, 1, 3), counts)
+        finally:
+            shutil.rmtree(tmpdir)
+
+    def test_table(self):
+        counts = count_file(SAMPLE_TSV, 1, 3, workers=1)
+        counts[b'came', b'VBN'] += 3
+        table, tags = ambiguity_classes(counts)
+        self.assertEqual(table.syn0.shape, (len(table), len(tags)))
+        self.assertAlmostEqual(float(table.syn0.sum()), len(table), places=4)
+
+        a2v = NLPEmbedding(table, 'word')
+        graph = NLPGraph([NLPNode(1, 'came'), NLPNode(2, 'unseen')])
+        self.assertEqual(a2v.index(graph.nodes[2]), ZERO_INDEX)
+        came = dict(zip(tags, a2v.get(graph.nodes[1]).tolist()))
+        self.assertEqual((came['VBD'], came['VBN']), (0.25, 0.75))
+
+        table, tags = ambiguity_classes(counts, min_count=2, cutoff=0.5)
+        self.assertEqual(dict(zip(tags, table.syn0[table.index('came')].tolist()))['VBD'], 0)
+        self.assertIn('John', table.vocab)
+        self.assertNotIn('yesterday', table.vocab)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,202 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import copy
+import os
+import unittest
+from typing import List
+from unittest import mock
+
+import mxnet as mx
+import numpy as np
+from fasttext.model import WordVectorModel
+
+from elit.component.pos_tagger import POSLexicon, POSModel, POSState
+from elit.component.template.lexicon import EmbeddingTable
+from elit.component.template.model import FeaturePool
+from elit.reader import TSVReader
+from elit.structure import NLPGraph, NLPNode
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+class POSLexiconTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.w2v = EmbeddingTable(rng.uniform(-1, 1, (4, 3)).astype('float32'), ['a', 'b', 'c', 'd'])
+        self.a2v = EmbeddingTable(rng.uniform(0, 1, (3, 2)).astype('float32'), ['b', 'c', 'e'])
+
+    def test_static_features(self):
+        # the budget of 4 * 5 * 2 bytes caches the root and the first word type; the others are gathered every time
+        for dtype, static_bytes in ((None, 1 << 28), ('float16', 1 << 28), ('int8', 1 << 28), ('int8', 40)):
+            lex = POSLexicon(w2v=self.w2v, a2v=self.a2v, output_size=2, dtype=dtype, static_bytes=static_bytes)
+            self.assertEqual(lex.static_dim, 5)
+            self.assertEqual(lex.w2v.vsm.dtype, dtype or 'float32')
+
+            graph = NLPGraph([NLPNode(1, 'b'), NLPNode(2, 'e'), NLPNode(3, 'x')])
+            node_ids = np.array([[-1, 0], [1, 2], [3, 1]])
+            word_ids = graph.field_ids('word', node_ids.ravel(), lex.vocabs).reshape(node_ids.shape)
+            nodes = [graph.nodes[i] if i >= 0 else None for i in node_ids.ravel().tolist()]
+            gold = np.hstack((lex.w2v.get_batch(nodes), lex.a2v.get_batch(nodes))).reshape(3, 2, 5)
+
+            self.assertEqual(lex.static_features(word_ids).tolist(), gold.tolist())
+            out = np.zeros((3, 2, 7), dtype='float32')
+            lex.static_features(word_ids, out[:, :, 2:])
+            self.assertEqual(out[:, :, 2:].tolist(), gold.tolist())
+            self.assertFalse(out[:, :, :2].any())
+            self.assertEqual(len(lex.static_block()) - 1, min(len(lex.vocabs['word']), lex.static_rows))
+
+            # the block is extended to the word types added since
+            graph = NLPGraph([NLPNode(1, 'c'), NLPNode(2, 'd')])
+            word_ids = graph.field_ids('word', np.array([1, 2]), lex.vocabs)
+            gold = np.hstack((lex.w2v.get_batch(graph.nodes[1:]), lex.a2v.get_batch(graph.nodes[1:])))
+            self.assertEqual(lex.static_features(word_ids).tolist(), gold.tolist())
+            self.assertEqual(len(lex.static_block()) - 1, min(len(lex.vocabs['word']), lex.static_rows))
+
+
+def sample_graphs(copies: int=1) -> List[NLPGraph]:
+    """
+    :return: the sample graphs, each copied the number of times.
+    """
+    reader = TSVReader(word_index=1, pos_index=3)
+    reader.open(SAMPLE_TSV)
+    graphs = [copy.deepcopy(graph) for graph in reader.next_all for _ in range(copies)]
+    reader.close()
+    return graphs
+
+
+def sample_states(lexicon: POSLexicon, copies: int=1):
+    """
+    :return: the states of the sample graphs, where every state is at a random node with random scores.
+    """
+    rng = np.random.RandomState(0)
+    states = [POSState(graph, lexicon, save_gold=True) for graph in sample_graphs(copies)]
+
+    for state in states:
+        for _ in range(rng.randint(len(state.graph))):
+            state.process('NN', rng.uniform(size=len(lexicon.pos_zeros)).astype('float32'))
+
+    return states
+
+
+class POSStateTest(unittest.TestCase):
+    def test_process(self):
+        lexicon = POSLexicon(output_size=3)
+        state = POSState(NLPGraph([NLPNode(1, 'a'), NLPNode(2, 'b')]), lexicon, save_gold=True)
+        state.process('NN', np.array([0.1, 0.2, 0.7], dtype='float32'))
+
+        # the node reads the row of the state, which the features are built from
+        node = state.graph.nodes[1]
+        self.assertTrue(np.shares_memory(node.pos_scores, state.scores))
+        self.assertEqual(state.feature_matrix(np.array([1, -1]))[:, :3].tolist(), [node.pos_scores.tolist(), [0] * 3])
+
+        # scores of another width are not truncated into the state
+        self.assertRaises(ValueError, state.process, 'NN', np.zeros(4, dtype='float32'))
+        state.reset()
+        self.assertFalse(state.scores.any())
+        self.assertIs(node.pos_scores, lexicon.pos_zeros)
+
+
+class POSModelTest(unittest.TestCase):
+    def test_feature_vectors(self):
+        rng = np.random.RandomState(0)
+        keys = ['John', 'came', 'to', 'visit', 'Emory', 'University']
+        w2v = EmbeddingTable(rng.uniform(-1, 1, (len(keys), 4)).astype('float32'), keys)
+        a2v = EmbeddingTable(rng.uniform(0, 1, (3, 3)).astype('float32'), ['to', 'visit', 'yesterday'])
+
+        for dtype in (None, 'int8'):
+            lexicon = POSLexicon(w2v=w2v, a2v=a2v, output_size=3, dtype=dtype)
+            model = POSModel(num_label=3, w2v_dim=3 + 4 + 3)
+            states = sample_states(lexicon)
+            xs = model.feature_vectors(states)
+
+            self.assertEqual(xs.shape, (len(states), model.feature_dim))
+            self.assertEqual(model.feature_dim, len(model.feature_context) * lexicon.node_dim)
+            for state, x in zip(states, xs): self.assertEqual(x.tolist(), model.x(state).tolist())
+
+            # at the first and the last nodes, the windows run off both ends of the graphs
+            for state in states: state.idx_curr = 1
+            for state, x in zip(states, model.feature_vectors(states)):
+                self.assertEqual(x.tolist(), model.x(state).tolist())
+
+            for state in states: state.idx_curr = len(state.graph.nodes) - 1
+            for state, x in zip(states, model.feature_vectors(states)):
+                self.assertEqual(x.tolist(), model.x(state).tolist())
+
+    def test_train(self):
+        rng = np.random.RandomState(0)
+        keys = ['John', 'came', 'to', 'visit', 'Emory', 'University', 'yesterday']
+        lexicon = POSLexicon(w2v=EmbeddingTable(rng.uniform(-1, 1, (len(keys), 4)).astype('float32'), keys),
+                             output_size=12)
+        model = POSModel(batch_size=16, num_label=12, w2v_dim=lexicon.node_dim)
+        binds = []
+        bind = mx.mod.Module.bind
+
+        def count(module, *args, **kwargs):
+            binds.append(module)
+            return bind(module, *args, **kwargs)
+
+        # each bag of 18 states is fit in batches of 16 and 2 (padded to 8), and evaluated in batches of 2
+        with mock.patch.object(mx.mod.Module, 'bind', count):
+            acc = model.train(sample_graphs(15), sample_graphs(), lexicon, num_steps=4,
+                              optimizer_params=(('learning_rate', 0.1),))
+
+        # one executor is bound per bucket, and none is rebound across steps, fitting, and evaluation
+        self.assertEqual(sorted(model.mxmod._buckets), [8, 16])
+        self.assertEqual(len(binds), 2)
+        self.assertTrue(0 <= acc <= 1)
+        self.assertTrue(np.isfinite(model.mxmod.get_params()[0]['fc_weight'].asnumpy()).all())
+
+
+class FeaturePoolTest(unittest.TestCase):
+    class FastText(WordVectorModel):
+        def __init__(self):
+            pass
+
+        def __getitem__(self, key):
+            return [float(len(key))] * 3
+
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        keys = ['John', 'came', 'to', 'visit', 'Emory', 'University', 'yesterday']
+        self.w2v = EmbeddingTable(rng.uniform(-1, 1, (len(keys), 4)).astype('float32'), keys)
+
+    def test_feature_vectors(self):
+        lexicon = POSLexicon(w2v=self.w2v, output_size=3, dtype='int8')
+        model = POSModel(num_label=3, w2v_dim=3 + 4)
+        states = sample_states(lexicon, 3)
+
+        with FeaturePool(model, lexicon, workers=2, chunk_size=2) as pool:
+            self.assertIsNone(pool.model.mxmod)
+            self.assertIsNotNone(model.mxmod)
+            gold = model.feature_vectors(states)
+
+            # the rows are built by the workers only; this process writes the scores into them
+            with mock.patch.object(POSModel, 'feature_rows', side_effect=AssertionError):
+                self.assertEqual(pool.feature_vectors(states).tolist(), gold.tolist())
+            self.assertEqual(pool.feature_vectors(states[:1]).tolist(), model.feature_vectors(states[:1]).tolist())
+
+            # the workers are restarted once the vocabularies grow
+            executor = pool._pool()
+            graph = NLPGraph([NLPNode(1, 'new')])
+            states.append(POSState(graph, lexicon))
+            self.assertEqual(pool.feature_vectors(states).tolist(), model.feature_vectors(states).tolist())
+            self.assertIsNot(pool._pool(), executor)
+
+    def test_fasttext(self):
+        lexicon = POSLexicon(w2v=self.w2v, f2v=self.FastText(), output_size=3)
+        self.assertRaises(ValueError, FeaturePool, POSModel(num_label=3), lexicon, 2)
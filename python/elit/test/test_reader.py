@@ -0,0 +1,183 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import gzip
+import io
+import lzma
+import os
+import pickle
+import shutil
+import tempfile
+import threading
+import unittest
+from unittest import mock
+
+from elit.reader import INDEX_EXT, BackgroundReader, TSVReader, split_ranges
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+class TSVReaderTest(unittest.TestCase):
+    @classmethod
+    def setUpClass(cls):
+        cls.tmpdir = tempfile.mkdtemp()
+        cls.filename = os.path.join(cls.tmpdir, 'sample.tsv')
+
+        with open(SAMPLE_TSV) as fin: sentences = fin.read().strip().split('\n\n')
+        with open(cls.filename, 'w') as fout:
+            for i in range(50): fout.write(sentences[i % len(sentences)] + '\n\n')
+
+    @classmethod
+    def tearDownClass(cls):
+        shutil.rmtree(cls.tmpdir)
+
+    def setUp(self):
+        self.reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+        self.reader.open(self.filename)
+        self.graphs = self.reader.next_all
+        self.reader.close()
+
+    def test_pickle(self):
+        for graph in self.graphs[:2]:
+            self.assertEqual(str(pickle.loads(pickle.dumps(graph))), str(graph))
+
+    def test_split_ranges(self):
+        ranges = split_ranges(self.filename, 7)
+        self.assertEqual(ranges[0][0], 0)
+        self.assertEqual(ranges[-1][1], os.path.getsize(self.filename))
+        for (_, end), (begin, _) in zip(ranges, ranges[1:]): self.assertEqual(end, begin)
+
+    def test_iter_parallel(self):
+        for workers in (1, 3):
+            graphs = list(self.reader.iter_parallel(self.filename, workers))
+            self.assertEqual([str(g) for g in graphs], [str(g) for g in self.graphs])
+
+    def test_sequential(self):
+        filename = os.path.join(self.tmpdir, 'utf8.tsv')
+        with open(self.filename, encoding='utf-8') as fin: text = fin.read().replace('John', 'Jöhn')
+        with open(filename, 'w', encoding='utf-8') as fout: fout.write(text)
+
+        # the sequential fallback reads the same text as the workers, whatever the locale is
+        golds = [str(g) for g in self.reader.iter_parallel(filename, 3)]
+        self.assertIn('Jöhn', golds[0])
+        self.assertEqual([str(g) for g in self.reader.iter_parallel(filename, 1)], golds)
+        self.assertEqual([str(g) for g in self.reader.read_parallel(filename, 1).graphs()], golds)
+
+        # the file is closed once when the consumer stops early or fails
+        with mock.patch.object(TSVReader, 'close', autospec=True, side_effect=TSVReader.close) as close:
+            graphs = self.reader.iter_parallel(filename, 1)
+            next(graphs)
+            graphs.close()
+            self.assertEqual(close.call_count, 1)
+
+            graphs = self.reader.iter_parallel(filename, 1)
+            next(graphs)
+            self.assertRaises(ValueError, graphs.throw, ValueError('consumer error'))
+            self.assertEqual(close.call_count, 2)
+
+    def test_read_parallel(self):
+        for workers in (1, 3):
+            corpus = self.reader.read_parallel(self.filename, workers)
+            self.assertEqual([str(g) for g in corpus.graphs()], [str(g) for g in self.graphs])
+
+        chunks = list(self.reader.iter_chunks(self.filename, 3))
+        self.assertEqual(len(chunks), len(split_ranges(self.filename, 12)))
+        self.assertEqual(sum(len(chunk) for chunk in chunks), len(self.graphs))
+
+    def test_index(self):
+        offsets = TSVReader.build_index(self.filename)
+        self.assertEqual(len(offsets), len(self.graphs))
+        self.assertEqual(TSVReader.load_index(self.filename).tolist(), offsets.tolist())
+
+        self.reader.open(self.filename)
+        self.assertEqual(str(self.reader.get(0)), str(self.graphs[0]))
+        self.assertEqual(str(self.reader.get(-1)), str(self.graphs[-1]))
+        self.assertEqual([str(g) for g in self.reader.slice(3, 7)], [str(g) for g in self.graphs[3:7]])
+        self.assertEqual(self.reader.slice(7, 7), [])
+        self.assertEqual(str(self.reader.next), str(self.graphs[0]))
+        self.reader.close()
+
+    def test_empty_index(self):
+        for text in ('', '\n\n'):
+            filename = os.path.join(self.tmpdir, 'empty.tsv')
+            with open(filename, 'w') as fout: fout.write(text)
+
+            for i in range(2):  # built, then loaded
+                self.reader.open(filename)
+                self.assertEqual(self.reader.indexed().shape, (0, 2))
+                self.assertEqual(self.reader.slice(0, 5), [])
+                self.assertRaises(IndexError, self.reader.get, 0)
+                self.assertIsNone(self.reader.next)
+                self.reader.close()
+
+            os.remove(filename + INDEX_EXT)
+
+    def test_stale_index(self):
+        TSVReader.build_index(self.filename)
+        stat = os.stat(self.filename)
+        os.utime(self.filename, ns=(stat.st_atime_ns, stat.st_mtime_ns + 1000))
+        self.assertIsNone(TSVReader.load_index(self.filename))
+
+    def test_compressed(self):
+        with open(self.filename, 'rb') as fin: data = fin.read()
+
+        for ext, opener in (('.gz', gzip.open), ('.xz', lzma.open)):
+            filename = self.filename + ext
+            with opener(filename, 'wb') as fout: fout.write(data)
+
+            for background in (True, False):
+                self.reader.open(filename, background=background)
+                self.assertEqual([str(g) for g in self.reader.next_all], [str(g) for g in self.graphs])
+                self.reader.close()
+
+            graphs = list(self.reader.iter_parallel(filename, 2))
+            self.assertEqual([str(g) for g in graphs], [str(g) for g in self.graphs])
+            self.assertRaises(ValueError, TSVReader.build_index, filename)
+
+    def test_truncated(self):
+        with open(self.filename, 'rb') as fin: data = gzip.compress(fin.read())
+        filename = self.filename + '.gz'
+        with open(filename, 'wb') as fout: fout.write(data[:len(data) // 2])
+
+        # the number of EOFErrors out of two reads, made in a thread that is abandoned if a read hangs
+        def errors(read) -> int:
+            count = []
+
+            def run():
+                for _ in range(2):
+                    try:
+                        read()
+                    except EOFError:
+                        count.append(1)
+
+            thread = threading.Thread(target=run, daemon=True)
+            thread.start()
+            thread.join(10)
+            return len(count)
+
+        # the error of the background thread is raised by every read, rather than once followed by a hang
+        fin = io.BufferedReader(BackgroundReader(gzip.open(filename, 'rb'), chunk_size=16))
+        self.assertEqual(errors(fin.read), 2)
+        fin.close()
+
+        self.reader.open(filename)
+        self.assertEqual(errors(lambda: self.reader.next_all), 2)
+        self.reader.close()
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,77 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import unittest
+
+import numpy as np
+
+from elit.component.template.state import NLPState
+from elit.structure import NLPGraph, NLPNode, Relation
+
+__author__ = 'Jinho D. Choi'
+
+
+class SimpleState(NLPState):
+    def reset(self): pass
+
+    @property
+    def gold(self): return None
+
+    def eval(self, stats): return 0
+
+    def process(self, label, scores=None): pass
+
+    def terminate(self): return True
+
+    def features(self, node): return []
+
+
+def create_graph(heads):
+    return NLPGraph.from_heads([NLPNode(i) for i in range(1, len(heads) + 1)], heads, ['dep'] * len(heads))
+
+
+class NLPStateTest(unittest.TestCase):
+    def setUp(self):
+        self.states = [SimpleState(create_graph([3, 3, 0, 3, 3, 5, 5, 5, 3, 9])),
+                       SimpleState(create_graph([2, 0, 2]))]
+        self.windows = [-2, -1, 0, 1, 2, 0, 0, 0, 0, 1]
+        self.relations = [None, None, None, None, None, Relation.PARENT, Relation.LEFTMOST_CHILD,
+                          Relation.RIGHT_NEAREST_SIBLING, Relation.SND_RIGHTMOST_CHILD, Relation.GRANDPARENT]
+
+    def expected(self, indices):
+        def node_id(node): return node.node_id if node else -1
+        return np.array([[node_id(state.get_node(index, window, relation))
+                          for window, relation in zip(self.windows, self.relations)]
+                         for state, index in zip(self.states, indices)])
+
+    def test_get_nodes(self):
+        for indices in ([1, 1], [5, 2], [10, 3]):
+            gold = self.expected(indices)
+            ids = NLPState.get_nodes(self.states, indices, self.windows, self.relations)
+            self.assertEqual(ids.tolist(), gold.tolist())
+
+            for state in self.states: state.graph.build_relation_index()
+            self.assertEqual(self.expected(indices).tolist(), gold.tolist())
+            ids = NLPState.get_nodes(self.states, indices, self.windows, self.relations)
+            self.assertEqual(ids.tolist(), gold.tolist())
+            for state in self.states: state.graph.relation_index = None
+
+    def test_root(self):
+        ids = NLPState.get_nodes(self.states, [1, 1], [-1, 0], root=True)
+        self.assertEqual(ids.tolist(), [[0, 1], [0, 1]])
+
+
+if __name__ == '__main__':
+    unittest.main()
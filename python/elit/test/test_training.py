@@ -0,0 +1,217 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import random
+import unittest
+from concurrent.futures import ThreadPoolExecutor
+
+import mxnet as mx
+import numpy as np
+
+from elit.component.template.model import IGNORE_LABEL, BucketIter, NLPModel, PrefetchIter, batch_buckets
+
+__author__ = 'Jinho D. Choi'
+
+
+class DenseModel(NLPModel):
+    def __init__(self, batch_size: int=32, num_label: int=3):
+        super().__init__(None, batch_size)
+        data = mx.sym.Variable('data')
+        fc = mx.sym.FullyConnected(data=data, num_hidden=num_label, name='fc')
+        sm = mx.sym.SoftmaxOutput(data=fc, label=mx.sym.Variable('softmax_label'), name='softmax', use_ignore=True,
+                                  ignore_label=IGNORE_LABEL)
+        self.mxmod = mx.mod.BucketingModule(lambda bucket_key: (sm, ('data',), ('softmax_label',)),
+                                            default_bucket_key=batch_size, context=mx.cpu())
+
+    def x(self, state): return state.x
+
+    def feature_inputs(self, states): return [state.x for state in states]
+
+    def feature_rows(self, lexicon, inputs, out=None): return np.vstack(inputs)
+
+
+class VectorState:
+    def __init__(self, x: np.array, gold: str):
+        self.x = x
+        self.gold = gold
+        self.reset_count = 0
+
+
+class FailingIter(BucketIter):
+    def next(self):
+        if self.cursor >= 16: raise ValueError('corrupt batch')
+        return super().next()
+
+
+class BucketTest(unittest.TestCase):
+    def test_batch_buckets(self):
+        self.assertEqual(batch_buckets(128), (8, 16, 32, 64, 128))
+        self.assertEqual(batch_buckets(100, 20), (25, 50, 100))
+        self.assertEqual(batch_buckets(8), (8,))
+
+    def test_bucket_iter(self):
+        data = np.arange(45 * 2, dtype='float32').reshape(45, 2)
+        label = np.arange(45) % 3
+        batches = list(BucketIter(data, label, (8, 16, 32)))
+
+        self.assertEqual([batch.bucket_key for batch in batches], [32, 16])
+        self.assertEqual([batch.pad for batch in batches], [0, 3])
+        self.assertEqual([batch.provide_data[0].shape for batch in batches], [(32, 2), (16, 2)])
+        self.assertEqual([batch.provide_label[0].shape for batch in batches], [(32,), (16,)])
+
+        last = batches[-1]
+        self.assertEqual(last.data[0].asnumpy()[:13].tolist(), data[32:].tolist())
+        self.assertFalse(last.data[0].asnumpy()[13:].any())
+        self.assertEqual(last.label[0].asnumpy().tolist(), label[32:].tolist() + [IGNORE_LABEL] * 3)
+
+        # without labels, every row is ignored
+        batches = BucketIter(data[:5], buckets=(8, 16, 32))
+        batch = batches.next()
+        self.assertEqual((batch.bucket_key, batch.pad), (8, 3))
+        self.assertEqual(batch.label[0].asnumpy().tolist(), [IGNORE_LABEL] * 8)
+        self.assertRaises(StopIteration, batches.next)
+        batches.reset()
+        self.assertEqual(batches.next().pad, 3)
+
+
+class BindTest(unittest.TestCase):
+    def setUp(self):
+        rng = np.random.RandomState(0)
+        self.xs = rng.uniform(size=(40, 4)).astype('float32')
+        self.ys = rng.randint(3, size=40)
+
+    def test_predict(self):
+        model = DenseModel(16)
+        model.bind(self.xs, self.ys)
+        model.mxmod.init_params(mx.initializer.Normal(0.01))
+        batches = model.bind(self.xs, for_training=False)
+
+        # a module bound for training predicts without being rebound; the padded rows are stripped
+        self.assertTrue(model.mxmod.for_training)
+        self.assertEqual(model.predict(batches).shape, (40, 3))
+        self.assertEqual(sorted(model.mxmod._buckets), [8, 16])
+
+    def test_evaluate_before_train(self):
+        model = DenseModel(16)
+        batches = model.bind(self.xs, for_training=False)
+        model.mxmod.init_params(mx.initializer.Normal(0.01))
+        self.assertFalse(model.mxmod.for_training)
+        ys = model.predict(batches)
+        params = model.mxmod.get_params()[0]['fc_weight'].asnumpy()
+
+        batches = model.bind(self.xs, self.ys)
+        self.assertTrue(model.mxmod.for_training)
+        self.assertEqual(model.mxmod.get_params()[0]['fc_weight'].asnumpy().tolist(), params.tolist())
+        self.assertEqual(model.predict(batches).tolist(), ys.tolist())
+
+        model.mxmod.init_optimizer(optimizer_params=(('learning_rate', 0.1),))
+        batches.reset()
+        model.fit(batches)
+        self.assertNotEqual(model.mxmod.get_params()[0]['fc_weight'].asnumpy().tolist(), params.tolist())
+
+
+class PrefetchTest(unittest.TestCase):
+    def setUp(self):
+        self.data = np.arange(100 * 2, dtype='float32').reshape(100, 2)
+        self.label = np.arange(100) % 3
+
+    def assertBatches(self, batches, golds):
+        self.assertEqual([(batch.bucket_key, batch.pad) for batch in batches], [(b.bucket_key, b.pad) for b in golds])
+        for batch, gold in zip(batches, golds):
+            self.assertEqual(batch.data[0].asnumpy().tolist(), gold.data[0].asnumpy().tolist())
+            self.assertEqual(batch.label[0].asnumpy().tolist(), gold.label[0].asnumpy().tolist())
+
+    def test_batches(self):
+        golds = list(BucketIter(self.data, self.label, (8, 16)))
+        batches = PrefetchIter(BucketIter(self.data, self.label, (8, 16)))
+        self.assertEqual(batches.provide_data[0].shape, (16, 2))
+        self.assertEqual(batches.default_bucket_key, 16)
+        self.assertBatches(list(batches), golds)
+        self.assertRaises(StopIteration, batches.next)
+
+        # the consumer stops early, then starts over
+        batches.reset()
+        self.assertBatches([batches.next(), batches.next()], golds[:2])
+        batches.reset()
+        self.assertBatches(list(batches), golds)
+        batches.close()
+        self.assertFalse(batches._thread.is_alive())
+
+    def test_close(self):
+        # the producer is blocked on the full buffer when closed
+        batches = PrefetchIter(BucketIter(self.data, self.label, (8,)), max_batches=1)
+        batches.next()
+        batches.close()
+        self.assertFalse(batches._thread.is_alive())
+        batches.close()
+
+    def test_error(self):
+        batches = PrefetchIter(FailingIter(self.data, self.label, (8,)))
+        self.assertEqual(len([batches.next(), batches.next()]), 2)
+        self.assertRaisesRegex(ValueError, 'corrupt batch', batches.next)
+        batches._thread.join(1)
+        self.assertFalse(batches._thread.is_alive())
+
+    def test_predict(self):
+        model = DenseModel(16)
+        xs = np.random.RandomState(0).uniform(size=(40, 2)).astype('float32')
+        model.bind(xs, np.zeros(40))
+        model.mxmod.init_params(mx.initializer.Normal(0.01))
+        self.assertEqual(model.predict(model.bind(xs, prefetch=True)).tolist(), model.predict(model.bind(xs)).tolist())
+
+
+class NextBagTest(unittest.TestCase):
+    def states(self):
+        rng = np.random.RandomState(0)
+        return [VectorState(rng.uniform(size=3).astype('float32'), str(i % 3)) for i in range(20)]
+
+    def process(self, bag):
+        for i, state in enumerate(bag):
+            if i % 2: state.reset_count += 1
+
+    def test_serial(self):
+        model = DenseModel()
+        steps = 5
+
+        # the serial loop: each bag is drawn after the states of the previous bag are processed
+        random.seed(7)
+        states = self.states()
+        serial = []
+
+        for _ in range(steps):
+            random.shuffle(states)
+            states.sort(key=lambda x: x.reset_count)
+            bag = states[:12]
+            xs, ys = model.train_instances(bag)
+            serial.append(([state.x.tolist() for state in bag], xs.tolist(), [model.get_label(y) for y in ys]))
+            self.process(bag)
+
+        # the pipelined loop: the next bag is drawn in the background (see NLPModel.train)
+        random.seed(7)
+        states = self.states()
+        producer = ThreadPoolExecutor(1)
+        future = producer.submit(model.next_bag, states, 12)
+
+        for step in range(steps):
+            bag, xs, golds = future.result()
+            self.assertEqual(([state.x.tolist() for state in bag], xs.tolist(), golds), serial[step])
+            self.process(bag)
+            future = producer.submit(model.next_bag, states, 12)
+
+        producer.shutdown()
+
+
+if __name__ == '__main__':
+    unittest.main()
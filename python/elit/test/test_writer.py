@@ -0,0 +1,61 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import os
+import shutil
+import tempfile
+import unittest
+
+from elit.reader import TSVReader
+from elit.writer import TSVWriter
+
+__author__ = 'Jinho D. Choi'
+
+SAMPLE_TSV = os.path.join(os.path.dirname(__file__), '../../../resources/sample/sample.tsv')
+
+
+class TSVWriterTest(unittest.TestCase):
+    def setUp(self):
+        self.reader = TSVReader(1, 2, 3, 4, 5, 6, 7, 8)
+        self.reader.open(SAMPLE_TSV)
+        self.graphs = self.reader.next_all
+        self.reader.close()
+
+    def test_graph_to_tsv(self):
+        writer = TSVWriter()
+        for graph in self.graphs: self.assertEqual(writer.graph_to_tsv(graph), str(graph))
+
+        writer = TSVWriter(node_id_index=-1, word_index=0, lemma_index=-1, pos_index=2, feats_index=-1,
+                           head_index=-1, deprel_index=-1, sheads_index=-1, nament_index=-1)
+        self.assertEqual(writer.graph_to_tsv(self.graphs[0]).split('\n')[0], 'John\t_\tNNP')
+
+    def test_write_all(self):
+        tmpdir = tempfile.mkdtemp()
+        try:
+            filename = os.path.join(tmpdir, 'out.tsv')
+            writer = TSVWriter.create_writer(self.reader)
+            writer.open(filename)
+            self.assertEqual(writer.write_all(graph for graph in self.graphs), len(self.graphs))
+            writer.close()
+
+            self.reader.open(filename)
+            self.assertEqual([str(g) for g in self.reader.next_all], [str(g) for g in self.graphs])
+            self.reader.close()
+        finally:
+            shutil.rmtree(tmpdir)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,148 @@
+# ========================================================================
+# Copyright 2017 Emory University
+#
+# Licensed under the Apache License, Version 2.0 (the "License");
+# you may not use this file except in compliance with the License.
+# You may obtain a copy of the License at
+#
+#     http://www.apache.org/licenses/LICENSE-2.0
+#
+# Unless required by applicable law or agreed to in writing, software
+# distributed under the License is distributed on an "AS IS" BASIS,
+# WITHOUT WARRANTIES OR CONDITIONS OF ANY KIND, either express or implied.
+# See the License for the specific language governing permissions and
+# limitations under the License.
+# ========================================================================
+import io
+from typing import Callable, Iterable, List
+
+from elit.reader import TSVReader
+from elit.structure import *
+
+__author__ = 'Jinho D. Choi'
+
+
+def _node_id(node: NLPNode) -> str:
+    return str(node.node_id)
+
+
+def _word(node: NLPNode) -> str:
+    return node.word or BLANK
+
+
+def _lemma(node: NLPNode) -> str:
+    return node.lemma or BLANK
+
+
+def _pos(node: NLPNode) -> str:
+    return node.pos or BLANK
+
+
+def _nament(node: NLPNode) -> str:
+    return node.nament or BLANK
+
+
+def _feats(node: NLPNode) -> str:
+    return DELIM_FEAT.join([k + DELIM_FEAT_KV + v for k, v in node.feats.items()]) if node.feats else BLANK
+
+
+def _head(node: NLPNode) -> str:
+    return str(node.parent.node_id) if node.parent else BLANK
+
+
+def _deprel(node: NLPNode) -> str:
+    return node.get_dependency_label() or BLANK
+
+
+def _sheads(node: NLPNode) -> str:
+    if not node.secondary_parents: return BLANK
+    return DELIM_ARC.join([str(p.node_id) + DELIM_ARC_KV + (node.get_dependency_label(p) or BLANK)
+                           for p in node.secondary_parents])
+
+
+class TSVWriter:
+    """
+    :param node_id_index: the column index of node IDs.
+    :param word_index: the column index of word forms.
+    :param lemma_index: the column index of lemma.
+    :param pos_index: the column index of part-of-speech tags.
+    :param feats_index: the column index of extra features.
+    :param head_index: the column index of primary head IDs.
+    :param deprel_index: the column index of primary dependency labels.
+    :param sheads_index: the column index of secondary dependency heads.
+    :param nament_index: the column index of of named entity tags.
+    :param buffer_size: the size of the output buffer in bytes.
+      A field is not written if its index is negative; a column with no field is filled with BLANK.
+      The default layout is the same as NLPNode.__str__.
+    """
+    def __init__(self, node_id_index: int=0, word_index: int=1, lemma_index: int=2, pos_index: int=3,
+                 feats_index: int=4, head_index: int=5, deprel_index: int=6, sheads_index: int=7,
+                 nament_index: int=8, buffer_size: int=1 << 22):
+        self.node_id_index: int = node_id_index
+        self.word_index: int = word_index
+        self.lemma_index: int = lemma_index
+        self.pos_index: int = pos_index
+        self.feats_index: int = feats_index
+        self.head_index: int = head_index
+        self.deprel_index: int = deprel_index
+        self.sheads_index: int = sheads_index
+        self.nament_index: int = nament_index
+        self.buffer_size: int = buffer_size
+        self.outs: io.TextIOWrapper = None
+
+        columns = {}
+        for index, field in ((node_id_index, _node_id), (word_index, _word), (lemma_index, _lemma),
+                             (pos_index, _pos), (feats_index, _feats), (head_index, _head),
+                             (deprel_index, _deprel), (sheads_index, _sheads), (nament_index, _nament)):
+            if index >= 0: columns[index] = field
+
+        blank = lambda node: BLANK
+        size = max(columns) + 1 if columns else 0
+        self._fields: List[Callable[[NLPNode], str]] = [columns.get(i, blank) for i in range(size)]
+
+    @classmethod
+    def create_writer(cls, reader: TSVReader, node_id_index: int=0) -> 'TSVWriter':
+        """
+        :return: a writer whose layout is the same as the configuration of the reader.
+        """
+        return TSVWriter(node_id_index=node_id_index,
+                         word_index=reader.word_index,
+                         lemma_index=reader.lemma_index,
+                         pos_index=reader.pos_index,
+                         feats_index=reader.feats_index,
+                         head_index=reader.head_index,
+                         deprel_index=reader.deprel_index,
+                         sheads_index=reader.sheads_index,
+                         nament_index=reader.nament_index)
+
+    def open(self, filename: str):
+        self.outs = open(filename, 'w', buffering=self.buffer_size, encoding='utf-8')
+        return self.outs
+
+    def close(self):
+        self.outs.close()
+
+    def write(self, graph: NLPGraph):
+        """
+        :param graph: the graph to be written, followed by a blank line.
+        """
+        self.outs.write(self.graph_to_tsv(graph))
+        self.outs.write('\n\n')
+
+    def write_all(self, graphs: Iterable[NLPGraph]) -> int:
+        """
+        :param graphs: the graphs to be written, which can be a generator.
+        :return: the number of graphs written.
+        """
+        count = 0
+        for graph in graphs:
+            self.write(graph)
+            count += 1
+        return count
+
+    def graph_to_tsv(self, graph: NLPGraph) -> str:
+        """
+        :return: the graph in the TSV format with respect to the layout of this writer, without the trailing newline.
+        """
+        fields = self._fields
+        return '\n'.join(['\t'.join([field(node) for field in fields]) for node in graph.nodes[1:]])